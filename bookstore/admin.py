@@ -1,7 +1,15 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
 from django.contrib.auth.models import User
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from .models import Customer, Book, Order, OrderItem, Payment, Cart, CartItem, Coupon, CouponUsage, ContactMessage, Delivery, OrderCancellation
+from django.core.paginator import EmptyPage, Paginator
+from django.db import connection
+from django.db.models import F, Prefetch
+from django.shortcuts import render
+from django.utils.functional import cached_property
+from django.utils.html import format_html
+from .models import Customer, Book, Order, OrderItem, Payment, Cart, CartItem, Coupon, CouponUsage, ContactMessage, Delivery, OrderCancellation, StockReservation
+from . import cancellation, coupons, reservations
 
 class CustomerInline(admin.StackedInline):
     model = Customer
@@ -40,13 +48,31 @@ class BookAdmin(admin.ModelAdmin):
     
     def cover_image_preview(self, obj):
         if obj.cover_image:
-            return f'<img src="{obj.cover_image.url}" width="50" height="75" />'
+            return format_html('<img src="{}" width="50" height="75" />', obj.get_cover_url('thumb'))
         return "No Image"
     
-    cover_image_preview.allow_tags = True
     cover_image_preview.short_description = 'Cover'
 
 
+class GenerateCouponsForm(forms.Form):
+    count = forms.IntegerField(
+        min_value=1, max_value=coupons.ADMIN_MAX_CODES, initial=1000,
+        help_text=f'Number of unique codes (up to {coupons.ADMIN_MAX_CODES:,} here; '
+                  f'use "manage.py generate_coupons" for larger batches)',
+    )
+    prefix = forms.CharField(max_length=20, required=False, help_text='Optional, e.g. SUMMER')
+    max_usage = forms.IntegerField(min_value=1, initial=1, help_text='Uses allowed per code')
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        if 'count' in cleaned_data and 'prefix' in cleaned_data:
+            try:
+                coupons.check_code_length(cleaned_data['prefix'], cleaned_data['count'])
+            except ValueError as e:
+                self.add_error('prefix', str(e))
+        return cleaned_data
+
+
 @admin.register(Coupon)
 class CouponAdmin(admin.ModelAdmin):
     list_display = ('code', 'discount_type', 'discount_value', 'current_usage_display', 'max_usage', 'min_purchase', 'expiry_date', 'is_active', 'usage_percentage')
@@ -58,9 +84,48 @@ class CouponAdmin(admin.ModelAdmin):
     readonly_fields = ('current_usage_display', 'created_at')
     
     def current_usage_display(self, obj):
-        """Display current usage calculated from CouponUsage records"""
+        """Display current usage from the redemption counter"""
         return obj.current_usage
     current_usage_display.short_description = 'Current Usage'
+    current_usage_display.admin_order_field = 'usage_count'
+    
+    actions = ['generate_codes']
+    
+    def generate_codes(self, request, queryset):
+        """Bulk-create unique codes that copy the selected coupon's terms"""
+        if queryset.count() != 1:
+            self.message_user(request, 'Select exactly one coupon to use as the template.', messages.WARNING)
+            return None
+        coupon = queryset.get()
+        
+        form = GenerateCouponsForm(request.POST if 'apply' in request.POST else None)
+        if form.is_valid():
+            template = coupons.coupon_template(
+                discount_type=coupon.discount_type,
+                discount_value=coupon.discount_value,
+                min_purchase=coupon.min_purchase,
+                max_usage=form.cleaned_data['max_usage'],
+                expiry_date=coupon.expiry_date,
+                is_active=coupon.is_active,
+            )
+            prefix = form.cleaned_data['prefix']
+            tag, created, elapsed = coupons.generate_codes(form.cleaned_data['count'], template, prefix)
+            self.message_user(
+                request,
+                f'Generated {created} code(s) starting with {prefix.upper()}{tag} '
+                f'in {elapsed:.1f}s ({created / max(elapsed, 1e-9):,.0f}/s).',
+            )
+            return None
+        
+        return render(request, 'admin/bookstore/coupon/generate_codes.html', {
+            **self.admin_site.each_context(request),
+            'title': 'Generate coupon codes',
+            'opts': self.model._meta,
+            'coupon': coupon,
+            'form': form,
+            'action_checkbox_name': admin.helpers.ACTION_CHECKBOX_NAME,
+        })
+    generate_codes.short_description = 'Generate unique codes like the selected coupon'
     
     def usage_percentage(self, obj):
         if obj.max_usage > 0:
@@ -108,15 +173,82 @@ class OrderCancellationInline(admin.StackedInline):
     readonly_fields = ('cancelled_at',)
 
 
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for very large tables. An unfiltered changelist takes its row
+    count from the database's table statistics instead of COUNT(*), which
+    scans the whole table on InnoDB. Small tables and filtered lists are
+    still counted exactly.
+    The statistics can be off either way, so page numbers past the estimate
+    are served while there are rows, and a page past the real end falls back
+    to the real last page (the one case that pays for an exact count).
+    """
+    EXACT_COUNT_BELOW = 10000
+    estimated = False
+
+    @cached_property
+    def count(self):
+        query = self.object_list.query
+        if not query.where:
+            estimate = self._estimated_rows(self.object_list.model._meta.db_table)
+            if estimate is not None and estimate >= self.EXACT_COUNT_BELOW:
+                self.estimated = True
+                return estimate
+        return super().count
+
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            if not self.estimated or int(number) < 1:
+                raise
+            return int(number)
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if not self.estimated:
+            return super().page(number)
+
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page])
+        if rows or number == 1:
+            return self._get_page(rows, number, self)
+
+        # Past the real end of the table: count it and clamp to its last page
+        self.estimated = False
+        self.__dict__['count'] = self.object_list.count()
+        self.__dict__.pop('num_pages', None)
+        return super().page(min(number, self.num_pages))
+
+    def _estimated_rows(self, table):
+        if connection.vendor == 'mysql':
+            sql = 'SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s'
+        elif connection.vendor == 'postgresql':
+            sql = 'SELECT reltuples::bigint FROM pg_class WHERE relname = %s'
+        else:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [table])
+            row = cursor.fetchone()
+        return int(row[0]) if row and row[0] is not None else None
+
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ('id', 'customer', 'order_date', 'status', 'subtotal_display', 'total_discount_display', 'shipping_fee', 'total_amount')
+    list_display = ('id', 'customer', 'order_date', 'status', 'subtotal_display', 'total_discount_display', 'shipping_fee', 'total_display')
     list_filter = ('status', 'order_date')
     search_fields = ('customer__user__username', 'delivery__recipient_name', 'delivery__phone')
     
     list_editable = ('status',)
     
+    # Every column comes from the order row, its annotations or the joined
+    # customer/user, so a page of 100 orders is a single query
+    list_select_related = ('customer__user',)
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+    
     inlines = [OrderItemInline, DeliveryInline, OrderCancellationInline]
+    actions = ['cancel_orders', 'refresh_totals']
     
     fieldsets = (
         ('Order Information', {
@@ -129,13 +261,48 @@ class OrderAdmin(admin.ModelAdmin):
     
     readonly_fields = ('order_date',)
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            discount_total=F('coupon_discount_amount') + F('order_value_discount_amount') + F('first_time_discount_amount')
+        )
+    
     def subtotal_display(self, obj):
         return f"Rs. {obj.subtotal}"
     subtotal_display.short_description = 'Subtotal'
+    subtotal_display.admin_order_field = 'subtotal_amount'
     
     def total_discount_display(self, obj):
-        return f"Rs. {obj.total_discount}"
+        return f"Rs. {obj.discount_total}"
     total_discount_display.short_description = 'Total Discount'
+    total_discount_display.admin_order_field = 'discount_total'
+    
+    def total_display(self, obj):
+        return f"Rs. {obj.total_amount}"
+    total_display.short_description = 'Total Amount'
+    total_display.admin_order_field = 'grand_total_amount'
+    
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Item lines may have changed in the inline; keep the stored totals in step
+        form.instance.refresh_totals()
+    
+    def cancel_orders(self, request, queryset):
+        cancelled = cancellation.cancel_orders(
+            list(queryset.values_list('id', flat=True)), reason='Cancelled by admin', statuses=None
+        )
+        skipped = queryset.count() - len(cancelled)
+        message = f'{len(cancelled)} order(s) cancelled and their stock restored.'
+        if skipped:
+            message += f' {skipped} already cancelled order(s) skipped.'
+        self.message_user(request, message)
+    cancel_orders.short_description = 'Cancel selected orders and restore stock'
+    
+    def refresh_totals(self, request, queryset):
+        orders = list(queryset)
+        for order in orders:
+            order.refresh_totals()
+        self.message_user(request, f'Stored totals recomputed for {len(orders)} order(s).')
+    refresh_totals.short_description = 'Recompute stored totals from the items'
 
 
 @admin.register(OrderItem)
@@ -146,6 +313,20 @@ class OrderItemAdmin(admin.ModelAdmin):
     
     fields = ('order', 'book', 'quantity', 'unit_price', 'subtotal')
     readonly_fields = ('unit_price', 'subtotal')
+    
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        obj.order.refresh_totals()
+    
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        obj.order.refresh_totals()
+    
+    def delete_queryset(self, request, queryset):
+        orders = list(Order.objects.filter(orderitem__in=queryset).distinct())
+        super().delete_queryset(request, queryset)
+        for order in orders:
+            order.refresh_totals()
 
 
 @admin.register(Delivery)
@@ -203,6 +384,17 @@ class CartAdmin(admin.ModelAdmin):
     
     fields = ('customer', 'applied_coupon', 'created_at', 'updated_at', 'total_items', 'subtotal_display', 'total_discount_display', 'shipping_display', 'total_display')
     
+    def get_queryset(self, request):
+        """Load everything the pricing snapshot needs in a fixed number of queries"""
+        return super().get_queryset(request).select_related('customer__user', 'applied_coupon').prefetch_related(
+            Prefetch('cartitem_set', queryset=CartItem.objects.select_related('book').order_by('added_at', 'id'))
+        )
+    
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # The inline may have lowered or removed lines
+        reservations.trim_holds(form.instance.pk)
+    
     def subtotal_display(self, obj):
         return f"Rs. {obj.subtotal}"
     subtotal_display.short_description = 'Subtotal'
@@ -242,6 +434,46 @@ class CartItemAdmin(admin.ModelAdmin):
     def subtotal_display(self, obj):
         return f"Rs. {obj.subtotal}"
     subtotal_display.short_description = 'Subtotal'
+    
+    # Lowered or removed lines give back what the cart's checkout hold kept
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        reservations.trim_holds(obj.cart_id)
+    
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        reservations.trim_holds(obj.cart_id)
+    
+    def delete_queryset(self, request, queryset):
+        cart_ids = set(queryset.values_list('cart_id', flat=True))
+        super().delete_queryset(request, queryset)
+        for cart_id in cart_ids:
+            reservations.trim_holds(cart_id)
+
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ('id', 'book', 'cart', 'quantity', 'created_at', 'expires_at')
+    list_filter = ('expires_at',)
+    search_fields = ('book__title', 'cart__customer__user__username')
+    list_select_related = ('book', 'cart__customer__user')
+    
+    # Holds move Book.stock; they are only created, consumed and released by code
+    readonly_fields = ('book', 'cart', 'quantity', 'created_at', 'expires_at')
+    
+    actions = ['release_holds']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        # A plain delete would drop the hold without returning its copies
+        return False
+    
+    def release_holds(self, request, queryset):
+        released = reservations.release(queryset)
+        self.message_user(request, f'{released} hold(s) released and their stock restored.')
+    release_holds.short_description = 'Release selected holds and restore stock'
 
 
 @admin.register(ContactMessage)
@@ -0,0 +1,20 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+UserModel = get_user_model()
+
+
+class CustomerBackend(ModelBackend):
+    """
+    ModelBackend that loads the session user together with their customer
+    profile, cart and applied coupon in one joined query.
+    """
+
+    def get_user(self, user_id):
+        try:
+            user = UserModel._default_manager.select_related(
+                'customer__cart__applied_coupon'
+            ).get(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
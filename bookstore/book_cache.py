@@ -0,0 +1,201 @@
+"""
+Read-through cache for Book lookups by id.
+
+Hot books are served from two tiers: a small LRU in each process, then a
+shared Django cache (BOOK_CACHE_ALIAS; the default LocMemCache stands in
+for Redis or Memcached locally), and only then from the database.
+Shared entries are keyed by a per-book version that every change bumps,
+so a reader that loaded a book just before an edit can only store it
+under the old, unreachable version. Local entries live for
+BOOK_CACHE_LOCAL_TTL seconds, which bounds how stale another process's
+copy can be.
+
+Versions are bumped once the change commits: from the Book signals (admin
+saves, list_editable edits, deletes) and from inventory, which moves
+stock with queryset updates. Reads that must see the current stock pass
+fresh=True and go straight to the database. Renders that outlive the
+request (see page_cache) run under shared_only(), since only the shared
+tier is bumped in step with the catalog.
+"""
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .models import Book
+
+LOCAL_SIZE = 1000
+LOCAL_TTL = 5
+SHARED_TIMEOUT = 60 * 60
+
+_skip_local = ContextVar('book_cache_skip_local', default=False)
+
+
+def _fields():
+    return [field.attname for field in Book._meta.concrete_fields]
+
+
+def _values(book):
+    # Raw column values: a freshly loaded book has not built its FieldFile yet
+    return tuple(book.__dict__[attname] for attname in _fields())
+
+
+def _build(values):
+    return Book.from_db(Book.objects.db, _fields(), values)
+
+
+class LocalLRU:
+    """Per-process LRU of book values, each entry expiring after `ttl` seconds"""
+
+    def __init__(self, max_entries=LOCAL_SIZE, ttl=LOCAL_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, pk):
+        with self._lock:
+            entry = self._entries.get(pk)
+            if entry is None:
+                return None
+            expires_at, values = entry
+            if expires_at < time.monotonic():
+                del self._entries[pk]
+                return None
+            self._entries.move_to_end(pk)
+            return values
+
+    def set(self, pk, values):
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._entries[pk] = (time.monotonic() + self.ttl, values)
+            self._entries.move_to_end(pk)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, pk):
+        with self._lock:
+            self._entries.pop(pk, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SharedCache:
+    """Versioned book values in a Django cache shared by every process"""
+
+    def __init__(self, alias='default', timeout=SHARED_TIMEOUT):
+        self.cache = caches[alias]
+        self.timeout = timeout
+
+    def _version_key(self, pk):
+        return f'book:version:{pk}'
+
+    def _key(self, pk, version):
+        return f'book:{pk}:{version}'
+
+    def version(self, pk):
+        key = self._version_key(pk)
+        version = self.cache.get(key)
+        if version is None:
+            # A fresh, never-used version in case the old one was evicted
+            self.cache.add(key, time.time_ns(), None)
+            version = self.cache.get(key)
+        return version
+
+    def get(self, pk, version):
+        return self.cache.get(self._key(pk, version))
+
+    def set(self, pk, version, values):
+        self.cache.set(self._key(pk, version), values, self.timeout)
+
+    def bump(self, pks):
+        self.cache.set_many({self._version_key(pk): time.time_ns() for pk in pks}, None)
+
+
+class BookCache:
+    def __init__(self, local=None, shared=None):
+        self.local = local
+        self.shared = shared
+
+    def get(self, pk, fresh=False):
+        """The book with this id. Raises Book.DoesNotExist like Book.objects.get()."""
+        pk = int(pk)
+        if fresh:
+            return Book.objects.get(pk=pk)
+
+        local = self.local if not _skip_local.get() else None
+        values = local.get(pk) if local else None
+        if values is None:
+            version = self.shared.version(pk) if self.shared else None
+            values = self.shared.get(pk, version) if self.shared else None
+            if values is None:
+                values = _values(Book.objects.get(pk=pk))
+                if self.shared:
+                    self.shared.set(pk, version, values)
+            if local:
+                local.set(pk, values)
+        # A new instance per call, so callers can change it freely
+        return _build(values)
+
+    def invalidate(self, pks):
+        pks = list(pks)
+        if self.local:
+            for pk in pks:
+                self.local.delete(pk)
+        if self.shared and pks:
+            self.shared.bump(pks)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """The process-wide BookCache, configured from settings on first use"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                local_size = getattr(settings, 'BOOK_CACHE_LOCAL_SIZE', LOCAL_SIZE)
+                alias = getattr(settings, 'BOOK_CACHE_ALIAS', 'default')
+                _cache = BookCache(
+                    local=LocalLRU(local_size, getattr(settings, 'BOOK_CACHE_LOCAL_TTL', LOCAL_TTL)) if local_size else None,
+                    shared=SharedCache(alias, getattr(settings, 'BOOK_CACHE_TIMEOUT', SHARED_TIMEOUT)) if alias else None,
+                )
+    return _cache
+
+
+def get_book(pk, fresh=False):
+    return get_cache().get(pk, fresh)
+
+
+def invalidate(pks):
+    """Drop the cached copies of these books once the current transaction commits"""
+    pks = list(pks)
+    if pks:
+        transaction.on_commit(partial(get_cache().invalidate, pks))
+
+
+@contextmanager
+def shared_only():
+    """Skip the per-process tier, whose copies may predate a change another process just committed"""
+    token = _skip_local.set(True)
+    try:
+        yield
+    finally:
+        _skip_local.reset(token)
+
+
+def clear_local():
+    cache = get_cache()
+    if cache.local:
+        cache.local.clear()
@@ -0,0 +1,62 @@
+"""
+Order cancellation.
+
+cancel_orders() cancels any number of orders in one transaction with a
+fixed number of statements: the orders are locked and flipped to
+Cancelled with a guarded UPDATE (so two cancellations of the same order
+cannot both restore stock), the items' quantities go back to Book.stock
+in a single database-side increment, coupon usages (and their counters)
+are released and the OrderCancellation rows are written in bulk.
+"""
+from django.db import transaction
+from django.db.models import Sum
+
+from .models import CouponUsage, Order, OrderCancellation, OrderItem
+from . import coupons, inventory
+
+CANCELLABLE_STATUSES = ('Pending', 'Confirmed')
+
+
+def cancel_orders(order_ids, reason=None, statuses=CANCELLABLE_STATUSES, record=True):
+    """
+    Cancel the orders among `order_ids` that are still in one of `statuses`
+    (statuses=None accepts anything not already cancelled). With `record`
+    an OrderCancellation carrying `reason` is written for each.
+    Returns the ids that were actually cancelled.
+    """
+    with transaction.atomic():
+        orders = Order.objects.select_for_update().filter(pk__in=order_ids).exclude(status='Cancelled')
+        if statuses is not None:
+            orders = orders.filter(status__in=statuses)
+        cancelled = list(orders.values_list('id', flat=True))
+        if not cancelled:
+            return []
+
+        Order.objects.filter(pk__in=cancelled).update(status='Cancelled')
+
+        quantities = dict(
+            OrderItem.objects.filter(order_id__in=cancelled)
+            .values_list('book_id')
+            .annotate(total=Sum('quantity'))
+            .order_by()
+        )
+        inventory.increment_stock(quantities)
+
+        usages = CouponUsage.objects.filter(order_id__in=cancelled)
+        coupons.release(coupons.usage_by_coupon(usages))
+        usages.delete()
+
+        if record:
+            OrderCancellation.objects.filter(order_id__in=cancelled).delete()
+            OrderCancellation.objects.bulk_create(
+                OrderCancellation(order_id=order_id, reason=reason or None) for order_id in cancelled
+            )
+    return cancelled
+
+
+def cancel_order(order, reason=None):
+    """Cancel one customer order. Returns False if it was no longer cancellable."""
+    if not cancel_orders([order.pk], reason):
+        return False
+    order.status = order._original_status = 'Cancelled'
+    return True
@@ -0,0 +1,42 @@
+"""
+Cart badge for the navbar.
+
+The navbar is on every page, so the cart's item count is cached under the
+cart id (request.cart, set by CustomerMiddleware) and dropped whenever
+one of the cart's items changes. A warm page view costs no queries for the badge.
+"""
+from django.core.cache import cache
+from django.db.models import Sum
+
+from .models import CartItem
+
+CART_SUMMARY_TIMEOUT = 60 * 60
+
+
+def summary_key(cart_id):
+    return f'cart:summary:{cart_id}'
+
+
+def get_cart_id(request):
+    """The logged-in customer's cart id, or None for anyone without a cart"""
+    cart = getattr(request, 'cart', None)
+    return cart.pk if cart is not None else None
+
+
+def get_cart_summary(request):
+    """Return {'item_count': n} for the logged-in customer's cart"""
+    cart_id = get_cart_id(request)
+    if cart_id is None:
+        return {'item_count': 0}
+
+    key = summary_key(cart_id)
+    summary = cache.get(key)
+    if summary is None:
+        item_count = CartItem.objects.filter(cart_id=cart_id).aggregate(total=Sum('quantity'))['total']
+        summary = {'item_count': item_count or 0}
+        cache.set(key, summary, CART_SUMMARY_TIMEOUT)
+    return summary
+
+
+def invalidate_cart_summary(cart_id):
+    cache.delete(summary_key(cart_id))
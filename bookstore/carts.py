@@ -0,0 +1,118 @@
+"""
+Cart mutations as single atomic statements.
+
+Quantities are changed with UPDATE ... SET quantity = quantity + 1 WHERE
+quantity < (available copies), so the stock bound is enforced by the
+database in the same statement instead of by a read-modify-write in
+Python. Available means the book's free stock plus what the cart itself
+already holds for checkout (see reservations), since held copies are out
+of Book.stock.
+Queryset updates skip the CartItem signals, so each helper drops the
+cached navbar badge itself, and the ones that can shrink a line trim the
+cart's checkout holds to match.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, OuterRef, PositiveIntegerField, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest, Least
+
+from .cart_summary import invalidate_cart_summary
+from .models import Book, CartItem, StockReservation
+from . import reservations
+
+# Outcomes reported back to the views
+ADDED = 'added'
+INCREASED = 'increased'
+DECREASED = 'decreased'
+UPDATED = 'updated'
+REMOVED = 'removed'
+MAX_STOCK = 'max_stock'
+MIN_QUANTITY = 'min_quantity'
+OUT_OF_STOCK = 'out_of_stock'
+NOT_FOUND = 'not_found'
+
+
+def _book_stock():
+    """Correlated subquery for the stock of a cart item's book"""
+    return Subquery(Book.objects.filter(pk=OuterRef('book_id')).values('stock')[:1])
+
+
+def _available():
+    """Correlated expression for the copies a cart item can grow to"""
+    held = StockReservation.objects.filter(cart_id=OuterRef('cart_id'), book_id=OuterRef('book_id')).values('quantity')[:1]
+    return _book_stock() + Coalesce(Subquery(held), Value(0))
+
+
+def _increment(items):
+    return items.filter(quantity__lt=_available()).update(quantity=F('quantity') + 1)
+
+
+def add_book(cart_id, book):
+    """Add one copy of a book: a bounded increment, or an insert for a new line"""
+    if _increment(CartItem.objects.filter(cart_id=cart_id, book=book)):
+        status = INCREASED
+    elif book.stock < 1:
+        return OUT_OF_STOCK
+    else:
+        try:
+            with transaction.atomic():
+                CartItem.objects.create(cart_id=cart_id, book=book, quantity=1)
+            status = ADDED
+        except IntegrityError:
+            # The line already exists; either it is at the stock limit or a
+            # concurrent request just created it
+            status = INCREASED if _increment(CartItem.objects.filter(cart_id=cart_id, book=book)) else MAX_STOCK
+
+    invalidate_cart_summary(cart_id)
+    return status
+
+
+def increase_item(cart_id, item_id):
+    items = CartItem.objects.filter(cart_id=cart_id, pk=item_id)
+    if _increment(items):
+        invalidate_cart_summary(cart_id)
+        return INCREASED
+    return MAX_STOCK if items.exists() else NOT_FOUND
+
+
+def decrease_item(cart_id, item_id):
+    items = CartItem.objects.filter(cart_id=cart_id, pk=item_id)
+    if items.filter(quantity__gt=1).update(quantity=F('quantity') - 1):
+        invalidate_cart_summary(cart_id)
+        reservations.trim_holds(cart_id)
+        return DECREASED
+    return MIN_QUANTITY if items.exists() else NOT_FOUND
+
+
+def set_quantities(cart_id, quantities):
+    """
+    Set many line quantities at once from {item_id: quantity}.
+    Quantities are capped at the available copies but never below 1, so a
+    line whose book sold out stays in the cart at 1 for checkout to refuse;
+    zero or less removes the line.
+    Runs one DELETE and one UPDATE however many lines change.
+    Returns (updated line count, removed line count).
+    """
+    removals = [item_id for item_id, quantity in quantities.items() if quantity <= 0]
+    updates = {item_id: quantity for item_id, quantity in quantities.items() if quantity > 0}
+
+    removed = updated = 0
+    with transaction.atomic():
+        if removals:
+            removed, _ = CartItem.objects.filter(cart_id=cart_id, pk__in=removals).delete()
+        if updates:
+            available = _available()
+            updated = CartItem.objects.filter(cart_id=cart_id, pk__in=updates).update(
+                quantity=Case(
+                    *[
+                        When(pk=item_id, then=Greatest(Least(Value(quantity), available), Value(1)))
+                        for item_id, quantity in updates.items()
+                    ],
+                    default=F('quantity'),
+                    output_field=PositiveIntegerField(),
+                )
+            )
+
+    invalidate_cart_summary(cart_id)
+    if updated or removed:
+        reservations.trim_holds(cart_id)
+    return updated, removed
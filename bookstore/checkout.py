@@ -0,0 +1,111 @@
+"""
+Order placement shared by the cash and card checkout flows.
+
+place_order() turns a priced cart into an order inside one transaction
+with a fixed number of statements however many lines the cart has: the
+cart's stock holds are consumed, one guarded stock UPDATE covers anything
+they do not, then the Order, Delivery, a bulk insert of the
+OrderItems, the optional CouponUsage, the Payment, and clearing the cart.
+Any failure (a book running out of stock, a coupon reaching its usage
+limit) rolls all of it back.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Cart, CartItem, CouponUsage, Customer, Delivery, Order, OrderItem, Payment
+from . import coupons, inventory, reservations
+
+ORDER_ITEM_BATCH_SIZE = 500
+
+
+def _transaction_id(method, order):
+    return f"{method.upper()}-{order.id}-{timezone.now().strftime('%Y%m%d%H%M%S')}"
+
+
+def place_order(cart, delivery, payment_method, paid=False):
+    """
+    Create an order from `cart` (priced with cart.pricing).
+    `delivery` holds recipient_name, phone, address and notes.
+    Raises inventory.InsufficientStock if any line can no longer be filled.
+    """
+    pricing = cart.pricing
+    if not pricing.items:
+        raise ValueError('Cart is empty')
+
+    customer = cart.customer
+    # A coupon the snapshot priced at nothing (spent, expired, under its
+    # minimum) is just detached, as the customer was never shown a discount
+    coupon = cart.applied_coupon if pricing.coupon_discount > 0 else None
+    quantities = {}
+    for item in pricing.items:
+        quantities[item.book_id] = quantities.get(item.book_id, 0) + item.quantity
+
+    try:
+        with transaction.atomic():
+            # Stock held at the start of checkout is already out of Book.stock;
+            # only take what the holds do not cover and return any surplus
+            held = reservations.take_holds(cart)
+            needed = reservations.shortfall(quantities, held)
+            if not inventory.decrement_stock(needed):
+                raise inventory.StockShortfall(needed)
+            inventory.increment_stock(reservations.shortfall(held, quantities))
+
+            order = Order.objects.create(
+                customer=customer,
+                shipping_fee=pricing.shipping_fee,
+                applied_coupon=coupon,
+                coupon_discount_amount=pricing.coupon_discount,
+                order_value_discount_amount=pricing.order_value_discount,
+                first_time_discount_amount=pricing.first_time_discount,
+                subtotal_amount=pricing.subtotal,
+                grand_total_amount=pricing.total_amount,
+            )
+
+            Delivery.objects.create(
+                order=order,
+                recipient_name=delivery['recipient_name'],
+                phone=delivery['phone'],
+                address=delivery['address'],
+                notes=delivery.get('notes') or None,
+            )
+
+            OrderItem.objects.bulk_create(
+                [
+                    OrderItem(
+                        order=order,
+                        book=item.book,
+                        quantity=item.quantity,
+                        unit_price=item.book.price,
+                        subtotal=item.subtotal,
+                    )
+                    for item in pricing.items
+                ],
+                batch_size=ORDER_ITEM_BATCH_SIZE,
+            )
+
+            if coupon:
+                coupons.redeem(coupon)
+                CouponUsage.objects.create(coupon=coupon, customer=customer, order=order)
+
+            if customer.is_first_time_buyer:
+                Customer.objects.filter(pk=customer.pk).update(is_first_time_buyer=False)
+                customer.is_first_time_buyer = False
+
+            order.payment = Payment.objects.create(
+                order=order,
+                amount=pricing.total_amount,
+                method=payment_method,
+                status='Paid' if paid else 'Unpaid',
+                transaction_id=_transaction_id(payment_method, order) if paid else None,
+            )
+
+            CartItem.objects.filter(cart=cart).delete()
+            if cart.applied_coupon_id:
+                Cart.objects.filter(pk=cart.pk).update(applied_coupon=None)
+                cart.applied_coupon = None
+            cart.refresh_pricing()
+    except inventory.StockShortfall as e:
+        # Named only now, from the stock the rollback restored
+        raise inventory.InsufficientStock(inventory.short_titles(e.quantities)) from None
+
+    return order
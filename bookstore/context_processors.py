@@ -0,0 +1,8 @@
+from . import cart_summary as cart_summary_cache
+
+
+def cart_summary(request):
+    """Expose the navbar cart badge to every template"""
+    if getattr(request, 'customer', None) is None:
+        return {}
+    return {'cart_summary': cart_summary_cache.get_cart_summary(request)}
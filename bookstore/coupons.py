@@ -0,0 +1,216 @@
+"""
+Coupon redemption counter.
+
+Coupon.usage_count replaces COUNT(*) over CouponUsage for every validity
+check. Redeeming is a conditional increment (WHERE usage_count <
+max_usage), so the limit holds under concurrent checkouts without locking
+the coupon for longer than that one statement; cancellations give
+redemptions back with a single decrement. reconcile() compares the
+counters with CouponUsage and repairs drift (see reconcile_coupon_usage).
+
+generate_codes() creates campaign coupons in bulk (generate_coupons
+command, "Generate codes" admin action). Codes are PREFIX + a random
+batch tag + a permuted sequence number, so they are unique by
+construction and never need a lookup per code.
+"""
+import secrets
+import time
+from itertools import islice
+
+from django.db import connection, transaction
+from django.db.models import Case, Count, F, IntegerField, When
+from django.db.models.constants import OnConflict
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import Coupon, CouponUsage
+
+
+class CouponLimitReached(Exception):
+    def __init__(self, coupon):
+        self.coupon = coupon
+        super().__init__(f'Coupon "{coupon.code}" has reached its usage limit')
+
+
+def redeem(coupon):
+    """Count one use of the coupon. Raises CouponLimitReached if none are left."""
+    redeemed = Coupon.objects.filter(pk=coupon.pk, usage_count__lt=F('max_usage')).update(
+        usage_count=F('usage_count') + 1
+    )
+    if not redeemed:
+        raise CouponLimitReached(coupon)
+    coupon.usage_count += 1
+
+
+def release(counts):
+    """Give back {coupon_id: uses} in one UPDATE (never below zero)"""
+    if not counts:
+        return 0
+    groups = {}
+    for coupon_id, uses in counts.items():
+        groups.setdefault(uses, []).append(coupon_id)
+    return Coupon.objects.filter(pk__in=counts).update(
+        usage_count=Greatest(
+            Case(
+                *[When(pk__in=coupon_ids, then=F('usage_count') - uses) for uses, coupon_ids in groups.items()],
+                default=F('usage_count'),
+                output_field=IntegerField(),
+            ),
+            0,
+        )
+    )
+
+
+def usage_by_coupon(usages):
+    """{coupon_id: count} for a CouponUsage queryset"""
+    return dict(usages.values_list('coupon_id').annotate(uses=Count('id')).order_by())
+
+
+def reconcile(fix=True):
+    """
+    Compare every counter with its CouponUsage rows.
+    Returns [(coupon, counter, actual)] for the coupons that disagreed,
+    correcting them when `fix` is set.
+    """
+    actual = usage_by_coupon(CouponUsage.objects.all())
+    drifted = []
+    for coupon in Coupon.objects.only('id', 'code', 'usage_count').iterator():
+        used = actual.get(coupon.id, 0)
+        if coupon.usage_count != used:
+            drifted.append((coupon, coupon.usage_count, used))
+            if fix:
+                Coupon.objects.filter(pk=coupon.pk).update(usage_count=used)
+    return drifted
+
+
+# No 0/O or 1/I, so printed codes can be typed back unambiguously
+CODE_ALPHABET = '23456789ABCDEFGHJKLMNPQRSTUVWXYZ'
+BATCH_TAG_LENGTH = 4
+MIN_SEQUENCE_LENGTH = 6
+GENERATE_CHUNK_SIZE = 5000
+# A request can insert this many in a few seconds; larger runs belong in generate_coupons
+ADMIN_MAX_CODES = 20000
+
+
+def _encode(number, length):
+    base = len(CODE_ALPHABET)
+    chars = []
+    for _ in range(length):
+        number, digit = divmod(number, base)
+        chars.append(CODE_ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+
+def _sequence_length(count):
+    length = MIN_SEQUENCE_LENGTH
+    while len(CODE_ALPHABET) ** length < count:
+        length += 1
+    return length
+
+
+def check_code_length(prefix, count):
+    """Raise ValueError unless PREFIX + batch tag + sequence fits Coupon.code"""
+    max_length = Coupon._meta.get_field('code').max_length
+    length = len(prefix) + BATCH_TAG_LENGTH + _sequence_length(count)
+    if length > max_length:
+        raise ValueError(
+            f'Codes would be {length} characters long; shorten the prefix to at most '
+            f'{max_length - length + len(prefix)} characters.'
+        )
+
+
+def _new_batch_tag(prefix):
+    """A random tag no existing code under this prefix starts with"""
+    while True:
+        tag = ''.join(secrets.choice(CODE_ALPHABET) for _ in range(BATCH_TAG_LENGTH))
+        if not Coupon.objects.filter(code__startswith=prefix + tag).exists():
+            return tag
+
+
+def sequence_codes(prefix, tag, count):
+    """
+    Yield `count` distinct codes. Sequence numbers are spread over the code
+    space with i * multiplier + offset (mod base**length); the multiplier is
+    odd and the space a power of two, so the mapping is a permutation and
+    consecutive codes do not look consecutive.
+    """
+    length = _sequence_length(count)
+    space = len(CODE_ALPHABET) ** length
+    multiplier = secrets.randbelow(space // 2) * 2 + 1
+    offset = secrets.randbelow(space)
+    for index in range(count):
+        yield prefix + tag + _encode((index * multiplier + offset) % space, length)
+
+
+def _insert(codes, template, chunk_size, progress, ignore_conflicts=False):
+    """
+    Insert one coupon per code with executemany, a chunk at a time.
+    Every column but the code is the same for the whole run, so values are
+    prepared for the database once instead of per row as bulk_create does;
+    that per-field preparation dominates at millions of rows.
+    Returns the number of codes sent.
+    """
+    values = {**template, 'usage_count': 0, 'created_at': timezone.now()}
+    fields = [Coupon._meta.get_field('code')] + [Coupon._meta.get_field(name) for name in values]
+    constants = tuple(field.get_db_prep_save(values[field.name], connection) for field in fields[1:])
+
+    on_conflict = OnConflict.IGNORE if ignore_conflicts else None
+    quote = connection.ops.quote_name
+    sql = '{insert} {table} ({columns}) VALUES ({params}) {suffix}'.format(
+        insert=connection.ops.insert_statement(on_conflict=on_conflict),
+        table=quote(Coupon._meta.db_table),
+        columns=', '.join(quote(field.column) for field in fields),
+        params=', '.join(['%s'] * len(fields)),
+        suffix=connection.ops.on_conflict_suffix_sql(fields, on_conflict, None, None) or '',
+    ).strip()
+
+    sent = 0
+    codes = iter(codes)
+    with connection.cursor() as cursor:
+        while True:
+            # Sorted chunks append to the unique index instead of splitting pages at random
+            chunk = [(code, *constants) for code in sorted(islice(codes, chunk_size))]
+            if not chunk:
+                return sent
+            with transaction.atomic():
+                cursor.executemany(sql, chunk)
+            sent += len(chunk)
+            if progress:
+                progress(sent)
+
+
+def coupon_template(discount_type, discount_value, expiry_date, min_purchase=0, max_usage=1, is_active=True):
+    return {
+        'discount_type': discount_type,
+        'discount_value': discount_value,
+        'min_purchase': min_purchase,
+        'max_usage': max_usage,
+        'expiry_date': expiry_date,
+        'is_active': is_active,
+    }
+
+
+def generate_codes(count, template, prefix='', chunk_size=GENERATE_CHUNK_SIZE, progress=None):
+    """
+    Create `count` coupons from `template` (see coupon_template()) in chunked
+    bulk inserts. Returns (batch tag, coupons created, seconds taken).
+    Raises ValueError if the codes would not fit Coupon.code.
+    """
+    prefix = prefix.upper()
+    check_code_length(prefix, count)
+    started = time.perf_counter()
+    tag = _new_batch_tag(prefix)
+    created = _insert(sequence_codes(prefix, tag, count), template, chunk_size, progress)
+    return tag, created, time.perf_counter() - started
+
+
+def import_codes(codes, template, chunk_size=GENERATE_CHUNK_SIZE, progress=None):
+    """
+    Create coupons for externally supplied codes (e.g. a partner's file).
+    Codes that already exist are skipped by the unique index rather than
+    looked up one by one. Returns (codes sent, seconds taken).
+    """
+    started = time.perf_counter()
+    codes = (code.strip().upper() for code in codes)
+    sent = _insert((code for code in codes if code), template, chunk_size, progress, ignore_conflicts=True)
+    return sent, time.perf_counter() - started
@@ -0,0 +1,171 @@
+"""
+Faceted navigation for the catalog (category, author, price band, in stock).
+
+Facet counts are computed with a handful of GROUP BY queries and kept in
+the cache, so page views read them from memory. Category, author and
+price counts only change when a Book is saved or deleted. The in-stock
+count is cached apart from them and dropped only when a book's stock
+reaches or leaves zero (see inventory), so checkouts do not force the
+GROUP BYs to run again. The filters themselves translate to WHERE
+clauses on indexed Book columns.
+"""
+from decimal import Decimal
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from .models import Book
+
+FACET_CACHE_KEY = 'catalog:facet-counts'
+IN_STOCK_CACHE_KEY = 'catalog:in-stock-count'
+FACET_CACHE_TIMEOUT = 60 * 10
+AUTHOR_FACET_LIMIT = 15
+
+# (slug, label, lower bound inclusive, upper bound exclusive)
+PRICE_BANDS = [
+    ('under-500', 'Under Rs. 500', None, Decimal('500')),
+    ('500-1000', 'Rs. 500 - 1000', Decimal('500'), Decimal('1000')),
+    ('1000-2000', 'Rs. 1000 - 2000', Decimal('1000'), Decimal('2000')),
+    ('2000-plus', 'Rs. 2000+', Decimal('2000'), None),
+]
+
+
+def _price_band_q(slug, prefix=''):
+    for band, label, low, high in PRICE_BANDS:
+        if band == slug:
+            q = Q()
+            if low is not None:
+                q &= Q(**{f'{prefix}price__gte': low})
+            if high is not None:
+                q &= Q(**{f'{prefix}price__lt': high})
+            return q
+    return None
+
+
+def compute_facet_counts():
+    """Count books per category, author and price band straight from the database"""
+    categories = list(
+        Book.objects.values_list('category').annotate(count=Count('id')).order_by('category')
+    )
+    authors = list(
+        Book.objects.values_list('author').annotate(count=Count('id')).order_by('-count', 'author')[:AUTHOR_FACET_LIMIT]
+    )
+    band_counts = Book.objects.aggregate(
+        **{slug: Count('id', filter=_price_band_q(slug)) for slug, label, low, high in PRICE_BANDS},
+    )
+    return {
+        'category': categories,
+        'author': authors,
+        'price': [(slug, band_counts[slug]) for slug, label, low, high in PRICE_BANDS],
+    }
+
+
+def compute_in_stock_count():
+    return Book.objects.filter(stock__gt=0).count()
+
+
+def facet_counts():
+    """Return cached facet counts, recomputing whichever part was invalidated"""
+    cached = cache.get_many([FACET_CACHE_KEY, IN_STOCK_CACHE_KEY])
+    counts = cached.get(FACET_CACHE_KEY)
+    if counts is None:
+        counts = compute_facet_counts()
+        cache.set(FACET_CACHE_KEY, counts, FACET_CACHE_TIMEOUT)
+    in_stock = cached.get(IN_STOCK_CACHE_KEY)
+    if in_stock is None:
+        in_stock = compute_in_stock_count()
+        cache.set(IN_STOCK_CACHE_KEY, in_stock, FACET_CACHE_TIMEOUT)
+    return {**counts, 'in_stock': in_stock}
+
+
+def invalidate_facets():
+    cache.delete_many([FACET_CACHE_KEY, IN_STOCK_CACHE_KEY])
+
+
+def invalidate_in_stock():
+    """Drop the in-stock count after a book reached or left zero stock"""
+    cache.delete(IN_STOCK_CACHE_KEY)
+
+
+def parse_filters(params):
+    """Pick the recognised facet filters out of a QueryDict"""
+    filters = {}
+    for name in ('category', 'author'):
+        value = params.get(name, '').strip()
+        if value:
+            filters[name] = value
+    if _price_band_q(params.get('price', '')) is not None:
+        filters['price'] = params['price']
+    if params.get('in_stock') == '1':
+        filters['in_stock'] = '1'
+    return filters
+
+
+def filter_q(filters, prefix=''):
+    """Build the WHERE clause for the active filters. `prefix` is the lookup path to Book."""
+    q = Q()
+    if 'category' in filters:
+        q &= Q(**{f'{prefix}category': filters['category']})
+    if 'author' in filters:
+        q &= Q(**{f'{prefix}author': filters['author']})
+    if 'price' in filters:
+        q &= _price_band_q(filters['price'], prefix)
+    if 'in_stock' in filters:
+        q &= Q(**{f'{prefix}stock__gt': 0})
+    return q
+
+
+def _toggle_query(base_params, filters, name, value):
+    params = dict(base_params)
+    params.update(filters)
+    if filters.get(name) == value:
+        del params[name]
+    else:
+        params[name] = value
+    return urlencode(params)
+
+
+def build_facets(filters, base_params=None):
+    """
+    Return facet groups for the template. Each option carries its count,
+    whether it is active, and the query string that toggles it.
+    """
+    base_params = base_params or {}
+    counts = facet_counts()
+    price_labels = {slug: label for slug, label, low, high in PRICE_BANDS}
+
+    def option(name, value, label, count):
+        return {
+            'label': label,
+            'count': count,
+            'active': filters.get(name) == value,
+            'query': _toggle_query(base_params, filters, name, value),
+        }
+
+    authors = list(counts['author'])
+    if filters.get('author') and filters['author'] not in dict(authors):
+        authors.append((filters['author'], None))
+
+    return [
+        {
+            'name': 'category',
+            'label': 'Category',
+            'options': [option('category', value, value, count) for value, count in counts['category']],
+        },
+        {
+            'name': 'author',
+            'label': 'Author',
+            'options': [option('author', value, value, count) for value, count in authors],
+        },
+        {
+            'name': 'price',
+            'label': 'Price',
+            'options': [option('price', slug, price_labels[slug], count) for slug, count in counts['price'] if count],
+        },
+        {
+            'name': 'in_stock',
+            'label': 'Availability',
+            'options': [option('in_stock', '1', 'In stock', counts['in_stock'])],
+        },
+    ]
@@ -0,0 +1,155 @@
+"""
+Idempotency keys for checkout submissions.
+
+Checkout forms carry a one-off token (IDEMPOTENCY_KEY_FIELD). The first
+request with a token inserts an IdempotencyKey row before doing any work;
+the unique (customer, key) constraint makes every retry of the same
+submission fail that insert, and the retry is answered from the stored
+response instead of placing a second order. A retry that arrives while the
+original is still running gets the view's "in progress" answer.
+
+A claim with no response is only taken over once it is older than
+IDEMPOTENCY_CLAIM_TIMEOUT seconds, which must exceed the server's hard
+request timeout so the original request is certainly dead, and only if
+the customer has placed no order since it was claimed: a worker killed
+after committing its order but before storing the response must not have
+its order placed a second time.
+
+Only responses a view marks with completed() are stored. Anything else
+(validation errors, an out-of-stock book) releases the token so the
+customer can fix the form and submit it again. Rows expire after
+IDEMPOTENCY_KEY_TTL seconds and are removed by purge_idempotency_keys.
+"""
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, HttpResponseBadRequest
+from django.utils import timezone
+
+from .models import IdempotencyKey, Order
+
+IDEMPOTENCY_KEY_FIELD = 'idempotency_key'
+MAX_KEY_LENGTH = 64
+DEFAULT_KEY_TTL = 24 * 60 * 60
+# Longer than any request may run (the worker's hard timeout)
+DEFAULT_CLAIM_TIMEOUT = 10 * 60
+PURGE_BATCH_SIZE = 1000
+
+
+def key_ttl():
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', DEFAULT_KEY_TTL))
+
+
+def claim_timeout():
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCY_CLAIM_TIMEOUT', DEFAULT_CLAIM_TIMEOUT))
+
+
+def _is_abandoned(record, now):
+    """The claim's request is past any timeout and got no order through"""
+    return (
+        record.response is None
+        and record.created_at < now - claim_timeout()
+        and not Order.objects.filter(customer_id=record.customer_id, order_date__gte=record.created_at).exists()
+    )
+
+
+def request_key(request):
+    key = request.POST.get(IDEMPOTENCY_KEY_FIELD, '').strip()
+    return key if 0 < len(key) <= MAX_KEY_LENGTH else None
+
+
+def claim(customer, key, endpoint):
+    """
+    Insert the key. Returns (record, True) when this request owns it, or
+    (existing record, False) for a retry. An abandoned claim is taken over
+    with a compare-and-set on created_at so only one retry can win it.
+    """
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(customer=customer, key=key, endpoint=endpoint), True
+    except IntegrityError:
+        record = IdempotencyKey.objects.get(customer=customer, key=key)
+
+    now = timezone.now()
+    if _is_abandoned(record, now):
+        taken = IdempotencyKey.objects.filter(pk=record.pk, created_at=record.created_at, response__isnull=True).update(
+            created_at=now
+        )
+        if taken:
+            record.created_at = now
+            return record, True
+    return record, False
+
+
+def completed(response):
+    """Mark a response as the final result of the submission, to be replayed to retries"""
+    response.idempotent_result = True
+    return response
+
+
+def _store(record, response):
+    record.response = {
+        'status': response.status_code,
+        'content_type': response.get('Content-Type', ''),
+        'location': response.get('Location'),
+        'body': response.content.decode(response.charset),
+    }
+    record.save(update_fields=['response'])
+
+
+def _replay(stored):
+    response = HttpResponse(stored['body'], status=stored['status'], content_type=stored['content_type'])
+    if stored['location']:
+        response['Location'] = stored['location']
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(in_progress):
+    """
+    Make a customer view idempotent for POSTs that carry a key.
+    `in_progress(request)` builds the answer for a retry that arrives while
+    the original request is still being processed.
+    """
+    def decorator(view_func):
+        endpoint = view_func.__name__
+
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            key = request_key(request) if request.method == 'POST' else None
+            if key is None:
+                return view_func(request, *args, **kwargs)
+
+            record, owned = claim(request.customer, key, endpoint)
+            if not owned:
+                if record.endpoint != endpoint:
+                    return HttpResponseBadRequest('Idempotency key was already used for another request.')
+                if record.response is None:
+                    return in_progress(request)
+                return _replay(record.response)
+
+            try:
+                response = view_func(request, *args, **kwargs)
+            except BaseException:
+                record.delete()
+                raise
+
+            if getattr(response, 'idempotent_result', False):
+                _store(record, response)
+            else:
+                record.delete()
+            return response
+        return wrapper
+    return decorator
+
+
+def purge_expired(batch_size=PURGE_BATCH_SIZE):
+    """Delete one batch of expired keys. Returns how many were removed."""
+    cutoff = timezone.now() - key_ttl()
+    ids = list(IdempotencyKey.objects.filter(created_at__lt=cutoff).values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return 0
+    deleted, _ = IdempotencyKey.objects.filter(id__in=ids).delete()
+    return deleted
@@ -0,0 +1,158 @@
+"""
+Cover image derivatives.
+
+Uploaded covers can be several megabytes, but the catalog shows them at a
+few hundred pixels. For every cover we keep resized copies in WebP and a
+JPEG fallback under media/book_covers/derived/, generated when the cover
+is uploaded (or by the generate_cover_derivatives command for existing
+books). Templates ask for a size and get the derivative URL, falling back
+to the original until the derivative exists, plus a srcset of every size
+so the browser can pick the one that suits the screen.
+
+Which derivatives exist, and how wide they came out, is recorded in the
+cache when they are written, so rendering a cover never asks the storage.
+"""
+import hashlib
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.templatetags.static import static
+from PIL import Image, ImageOps, features
+
+# Bounding boxes (width, height); covers keep their aspect ratio
+COVER_SIZES = {
+    'thumb': (100, 150),
+    'card': (300, 450),
+    'detail': (600, 900),
+}
+
+COVER_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 6}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+DERIVATIVE_DIR = 'book_covers/derived'
+PLACEHOLDER_COVER = 'images/no-cover.png'
+# A cover with no record yet is looked up in storage at most this often
+MISSING_RECHECK = 60
+
+
+def available_formats():
+    """WebP needs libwebp in the Pillow build; JPEG is always there"""
+    return [fmt for fmt in COVER_FORMATS if fmt != 'webp' or features.check('webp')]
+
+
+def derivative_name(original_name, size, fmt):
+    """Storage name of one derivative. The hash keeps a.png and a.jpg apart."""
+    path = PurePosixPath(original_name)
+    digest = hashlib.md5(original_name.encode()).hexdigest()[:8]
+    return f'{DERIVATIVE_DIR}/{path.stem}-{digest}-{size}.{fmt}'
+
+
+def _record_key(original_name):
+    return 'covers:derived:' + hashlib.md5(original_name.encode()).hexdigest()
+
+
+def derivatives(field_file):
+    """
+    {fmt: {size: width}} of the derivatives written for this cover. Read
+    from the record generate_derivatives() leaves; only when that is gone
+    (cache flushed, covers generated before records) is the storage asked,
+    taking the box widths, and the answer kept.
+    """
+    key = _record_key(field_file.name)
+    record = cache.get(key)
+    if record is None:
+        storage = field_file.storage
+        record = {
+            fmt: {size: box[0] for size, box in COVER_SIZES.items()}
+            for fmt in COVER_FORMATS
+            if all(storage.exists(derivative_name(field_file.name, size, fmt)) for size in COVER_SIZES)
+        }
+        cache.set(key, record, None if record else MISSING_RECHECK)
+    return record
+
+
+def _flatten(image):
+    """Drop alpha onto a white background so covers survive JPEG encoding"""
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def generate_derivatives(field_file):
+    """Write every size/format derivative of a cover. Returns the storage names written."""
+    storage = field_file.storage
+    with field_file.open('rb') as source:
+        original = _flatten(Image.open(source))
+
+    written = []
+    record = {}
+    for size, box in COVER_SIZES.items():
+        resized = original.copy()
+        resized.thumbnail(box, Image.LANCZOS)
+        for fmt in available_formats():
+            pil_format, save_options = COVER_FORMATS[fmt]
+            buffer = BytesIO()
+            resized.save(buffer, pil_format, **save_options)
+
+            name = derivative_name(field_file.name, size, fmt)
+            if storage.exists(name):
+                storage.delete(name)
+            written.append(storage.save(name, ContentFile(buffer.getvalue())))
+            record.setdefault(fmt, {})[size] = resized.width
+    cache.set(_record_key(field_file.name), record, None)
+    return written
+
+
+def delete_derivatives(storage, original_name):
+    cache.delete(_record_key(original_name))
+    for size in COVER_SIZES:
+        for fmt in COVER_FORMATS:
+            name = derivative_name(original_name, size, fmt)
+            if storage.exists(name):
+                storage.delete(name)
+
+
+def has_derivatives(field_file):
+    return all(
+        field_file.storage.exists(derivative_name(field_file.name, size, fmt))
+        for size in COVER_SIZES
+        for fmt in available_formats()
+    )
+
+
+def cover_url(book, size, fmt='jpg', fallback=True):
+    """
+    URL of a cover derivative. Without one, return the original upload (or
+    the placeholder for books with no cover), or '' when fallback is off.
+    """
+    if not book.cover_image:
+        return static(PLACEHOLDER_COVER) if fallback else ''
+
+    if size in derivatives(book.cover_image).get(fmt, {}):
+        return book.cover_image.storage.url(derivative_name(book.cover_image.name, size, fmt))
+    return book.cover_image.url if fallback else ''
+
+
+def cover_srcset(book, fmt='jpg'):
+    """'url 100w, url 300w, ...' over every size of the cover, or '' without derivatives"""
+    if not book.cover_image:
+        return ''
+    storage, name = book.cover_image.storage, book.cover_image.name
+    by_width = {}
+    # Small originals are never upscaled, so sizes can share a width; keep the smaller file
+    for size, width in sorted(derivatives(book.cover_image).get(fmt, {}).items(), key=lambda item: item[1]):
+        by_width.setdefault(width, size)
+    return ', '.join(f'{storage.url(derivative_name(name, size, fmt))} {width}w' for width, size in by_width.items())
+
+
+def cover_sizes(size):
+    """The sizes attribute for a cover shown in the `size` slot"""
+    return f'{COVER_SIZES[size][0]}px'
@@ -0,0 +1,112 @@
+"""
+Stock bookkeeping.
+
+Stock moves with one UPDATE per batch of books. Decrements carry their
+own guard (WHERE stock >= quantity for every row), so two checkouts racing
+for the last copy cannot both succeed and no row is read before it is
+written. Books are grouped by quantity, so the statement grows with the
+number of distinct quantities rather than the number of lines.
+
+Queryset updates bypass the Book signals, so the caches that depend on
+stock are dropped here once the change commits, each only when what it
+shows changed: the cached book and its detail page on every move, the
+catalog pages when a book is at or below LOW_STOCK before or after, and
+the in-stock facet count when a book's stock reaches or leaves zero.
+Reading the new levels costs one primary-key query per move.
+"""
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, When
+
+from .models import Book
+from . import book_cache, facets, page_cache
+
+# The catalog cards show the exact count only at or below this (book_cards.html)
+LOW_STOCK = 5
+
+
+class InsufficientStock(Exception):
+    """Raised when one or more books cannot cover the requested quantity"""
+
+    def __init__(self, titles):
+        self.titles = titles
+        super().__init__(f"Insufficient stock for {', '.join(titles)}")
+
+
+class StockShortfall(Exception):
+    """
+    Raised inside a transaction when decrement_stock() fails. Catch it
+    outside the block, once the partial decrement has been rolled back, and
+    raise InsufficientStock(short_titles(quantities)) from the real stock.
+    """
+
+    def __init__(self, quantities):
+        self.quantities = quantities
+        super().__init__(f'Not enough stock for books {sorted(quantities)}')
+
+
+def _by_quantity(quantities):
+    """Group {book_id: quantity} as {quantity: [book_id, ...]} to keep the SQL small"""
+    groups = {}
+    for book_id, quantity in quantities.items():
+        groups.setdefault(quantity, []).append(book_id)
+    return groups
+
+
+def _stock_change(groups, sign):
+    return Case(
+        *[When(pk__in=book_ids, then=F('stock') + sign * quantity) for quantity, book_ids in groups.items()],
+        default=F('stock'),
+        output_field=IntegerField(),
+    )
+
+
+def _stock_moved(quantities, sign):
+    """Drop the caches that depend on these books' stock once the move commits"""
+    after = dict(Book.objects.filter(pk__in=quantities).values_list('pk', 'stock'))
+    levels = [(stock - sign * quantities[book_id], stock) for book_id, stock in after.items()]
+
+    # Callbacks run in order: drop what pages are built from before the pages
+    book_cache.invalidate(quantities)
+    if any((before == 0) != (stock == 0) for before, stock in levels):
+        transaction.on_commit(facets.invalidate_in_stock)
+    page_cache.invalidate_books(quantities)
+    if any(min(before, stock) <= LOW_STOCK for before, stock in levels):
+        page_cache.invalidate_pages()
+
+
+def decrement_stock(quantities):
+    """
+    Take stock for {book_id: quantity} in a single conditional UPDATE.
+    Returns True only if every book had enough. On False the books that did
+    have enough were still decremented, so the caller must roll back.
+    """
+    if not quantities:
+        return True
+    groups = _by_quantity(quantities)
+    enough = Q()
+    for quantity, book_ids in groups.items():
+        enough |= Q(pk__in=book_ids, stock__gte=quantity)
+    updated = Book.objects.filter(enough).update(stock=_stock_change(groups, -1))
+    if updated != len(quantities):
+        return False
+    _stock_moved(quantities, -1)
+    return True
+
+
+def increment_stock(quantities):
+    """Put stock back for {book_id: quantity} in a single UPDATE"""
+    if not quantities:
+        return 0
+    updated = Book.objects.filter(pk__in=quantities).update(stock=_stock_change(_by_quantity(quantities), 1))
+    _stock_moved(quantities, 1)
+    return updated
+
+
+def short_titles(quantities):
+    """
+    Titles of the books that cannot cover the requested quantity (for error
+    messages). Read it only after a failed decrement_stock() is rolled back:
+    until then the books that did have enough read as already decremented.
+    """
+    books = Book.objects.filter(pk__in=quantities).only('id', 'title', 'stock')
+    return [book.title for book in books if book.stock < quantities[book.id]]
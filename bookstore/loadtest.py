@@ -0,0 +1,264 @@
+"""
+In-process load testing.
+
+Simulated shoppers each run in their own thread with a Django test
+Client signed in as a synthetic customer (see generate_dataset), so the
+whole request stack runs, middleware and templates included, without a
+web server in front. MetricsMiddleware records what every request cost
+per view. run() summarises that with the throughput into a dict that
+is stored as JSON, so a later run can be compared with it.
+"""
+import json
+import random
+import subprocess
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import date
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, connections
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Book, Customer, Order
+from . import metrics, page_cache, synthetic
+
+CARD_DETAILS = {
+    'card_number': '4111111111111111',
+    'card_holder': 'Load Test',
+    'expiry_month': '12',
+    'cvv': '123',
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def shopper_users(count, rng):
+    """`count` distinct synthetic customers' users, chosen by the seeded rng"""
+    user_ids = list(
+        User.objects.filter(username__startswith=synthetic.USERNAME_PREFIX, customer__isnull=False)
+        .order_by('pk').values_list('pk', flat=True)
+    )
+    if len(user_ids) < count:
+        raise ValueError(f'Need {count} synthetic customers but found {len(user_ids)}; run generate_dataset first')
+    return list(User.objects.filter(pk__in=rng.sample(user_ids, count)).order_by('pk'))
+
+
+def in_stock_books(limit=5000):
+    """Ids of the best-stocked books; shoppers pick from the front more often"""
+    return list(Book.objects.filter(stock__gt=5).order_by('-stock', 'pk').values_list('pk', flat=True)[:limit])
+
+
+class Shopper:
+    """One simulated customer walking the browse -> cart -> checkout flow"""
+
+    def __init__(self, user, book_ids, rng, card_share=0.5):
+        self.client = Client()
+        self.client.force_login(user)
+        self.book_ids = book_ids
+        self.rng = rng
+        self.card_share = card_share
+        self.errors = Counter()
+        self.checkouts = Counter()
+
+    def request(self, method, step, url, data=None):
+        response = getattr(self.client, method)(url, data)
+        if response.status_code >= 400:
+            self.errors[step] += 1
+        return response
+
+    def page(self, step, url, data=None):
+        """A page-cached page, then the navbar fragment a browser loads after it"""
+        self.request('get', step, url, data)
+        self.request('get', 'navbar_fragment', reverse('navbar_fragment'))
+
+    def pick_book(self):
+        return self.book_ids[min(len(self.book_ids) - 1, int(len(self.book_ids) * self.rng.random() ** 2))]
+
+    def browse(self):
+        rng = self.rng
+        if rng.random() < 0.3:
+            params = {'search': rng.choice(synthetic.TITLE_WORDS)}
+        elif rng.random() < 0.3:
+            params = {'category': rng.choice(synthetic.CATEGORIES)[0]}
+        else:
+            params = {}
+        self.page('book_list', reverse('book_list'), params)
+
+    def fill_cart(self):
+        for _ in range(self.rng.randint(1, 3)):
+            book_id = self.pick_book()
+            self.page('book_detail', reverse('book_detail', args=[book_id]))
+            self.request('post', 'add_to_cart', reverse('add_to_cart', args=[book_id]))
+        self.request('get', 'view_cart', reverse('view_cart'))
+
+    def check_out(self):
+        self.request('get', 'checkout', reverse('checkout'))
+        delivery = {
+            'delivery_name': 'Load Test', 'delivery_phone': '03000000000', 'delivery_address': 'Load test lane',
+            'idempotency_key': uuid.uuid4().hex,
+        }
+        if self.rng.random() < self.card_share:
+            self.request('post', 'checkout', reverse('checkout'), {**delivery, 'payment_method': 'Card'})
+            response = self.request('post', 'process_card_payment', reverse('process_card_payment'), {
+                **delivery, **CARD_DETAILS, 'expiry_year': str(date.today().year + 2),
+                'idempotency_key': uuid.uuid4().hex,
+            })
+            placed = response.status_code == 200 and response.json().get('success')
+        else:
+            response = self.request('post', 'checkout', reverse('checkout'), {**delivery, 'payment_method': 'Cash'})
+            placed = response.status_code == 302 and response.url == reverse('order_history')
+        self.checkouts['placed' if placed else 'failed'] += 1
+
+    def iteration(self):
+        self.browse()
+        self.fill_cart()
+        self.check_out()
+
+
+def _summary(values, scale=1):
+    values = sorted(values)
+    if not values:
+        return {}
+    return {
+        'mean': round(sum(values) / len(values) * scale, 3),
+        **{f'p{round(q * 100)}': round(metrics.quantile(values, q) * scale, 3) for q in metrics.QUANTILES},
+        'max': round(values[-1] * scale, 3),
+    }
+
+
+def summarize_views(elapsed):
+    views = {}
+    for view_name, (count, exceeded, sums, samples) in sorted(metrics.registry.snapshot().items()):
+        views[view_name] = {
+            'requests': count,
+            'requests_per_second': round(count / elapsed, 2),
+            'latency_ms': _summary(samples['duration_seconds'], 1000),
+            'queries': _summary(samples['queries']),
+            'db_ms': _summary(samples['db_seconds'], 1000),
+            'template_ms': _summary(samples['template_seconds'], 1000),
+            'over_query_budget': exceeded,
+        }
+    return views
+
+
+def run(users=10, iterations=20, warmup=1, seed=0, card_share=0.5):
+    """Drive `users` concurrent shoppers through `iterations` flows each and return the results"""
+    rng = random.Random(seed)
+    book_ids = in_stock_books()
+    if not book_ids:
+        raise ValueError('No books in stock; run generate_dataset first')
+    shoppers = [
+        Shopper(user, book_ids, random.Random(rng.random()), card_share)
+        for user in shopper_users(users, rng)
+    ]
+    warmed = threading.Barrier(users + 1)
+    go = threading.Barrier(users + 1)
+    failures = []
+
+    def work(shopper):
+        try:
+            for _ in range(warmup):
+                shopper.iteration()
+            shopper.errors.clear()
+            shopper.checkouts.clear()
+            warmed.wait()
+            go.wait()
+            for _ in range(iterations):
+                shopper.iteration()
+        except Exception as exc:
+            failures.append(exc)
+            warmed.abort()
+            go.abort()
+        finally:
+            connections.close_all()
+
+    started_at = timezone.now()
+    # Keep every sample of the run, and let the test Client's host through
+    with override_settings(METRICS_WINDOW=10 ** 7, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+        threads = [threading.Thread(target=work, args=(shopper,)) for shopper in shoppers]
+        for thread in threads:
+            thread.start()
+        try:
+            warmed.wait()
+            metrics.registry.clear()
+            page_cache.stats.clear()
+            go.wait()
+        except threading.BrokenBarrierError:
+            pass
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+    if failures:
+        raise failures[0]
+
+    views = summarize_views(elapsed)
+    requests = sum(view['requests'] for view in views.values())
+    checkouts = sum((shopper.checkouts for shopper in shoppers), Counter())
+    pages = page_cache.stats.snapshot()
+    return {
+        'started_at': started_at.isoformat(),
+        'commit': git_commit(),
+        'database': connection.vendor,
+        'options': {
+            'users': users, 'iterations': iterations, 'warmup': warmup, 'seed': seed, 'card_share': card_share,
+        },
+        'dataset': {
+            'books': Book.objects.count(),
+            'customers': Customer.objects.count(),
+            'orders': Order.objects.count(),
+        },
+        'elapsed_seconds': round(elapsed, 3),
+        'requests': requests,
+        'requests_per_second': round(requests / elapsed, 2),
+        'checkouts': {'placed': checkouts['placed'], 'failed': checkouts['failed']},
+        'errors': dict(sum((shopper.errors for shopper in shoppers), Counter())),
+        'views': views,
+        'page_cache': {**pages, 'hit_ratio': round(page_cache.hit_ratio(pages), 3)},
+    }
+
+
+def save(results, path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(results, indent=2) + '\n')
+
+
+def load(path):
+    return json.loads(path.read_text())
+
+
+def _change(old, new):
+    if not old:
+        return ''
+    return f'{(new - old) / old * 100:+.0f}%'
+
+
+def compare(baseline, current):
+    """Rows of (view, metric, baseline, current, change) for every view in either run"""
+    rows = [('all views', 'req/s', baseline['requests_per_second'], current['requests_per_second'],
+             _change(baseline['requests_per_second'], current['requests_per_second']))]
+    for view_name in sorted(set(baseline['views']) | set(current['views'])):
+        old, new = baseline['views'].get(view_name), current['views'].get(view_name)
+        if old is None or new is None:
+            rows.append((view_name, 'present', old is not None, new is not None, ''))
+            continue
+        for label, a, b in [
+            ('req/s', old['requests_per_second'], new['requests_per_second']),
+            ('p50 ms', old['latency_ms']['p50'], new['latency_ms']['p50']),
+            ('p90 ms', old['latency_ms']['p90'], new['latency_ms']['p90']),
+            ('queries', old['queries']['mean'], new['queries']['mean']),
+        ]:
+            rows.append((view_name, label, a, b, _change(a, b)))
+    return rows
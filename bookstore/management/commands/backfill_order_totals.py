@@ -0,0 +1,33 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q, Sum
+
+from bookstore.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Store subtotal and total on orders that do not have them yet, or have zero from a legacy import (or on every order with --all)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Recompute the stored totals of every order')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Orders written per UPDATE batch')
+
+    def handle(self, *args, **options):
+        orders = Order.objects.annotate(items_subtotal=Sum('orderitem__subtotal')).order_by()
+        if not options['all']:
+            orders = orders.filter(Q(subtotal_amount__isnull=True) | Q(subtotal_amount=0))
+
+        batch, updated = [], 0
+        for order in orders.iterator(chunk_size=options['batch_size']):
+            order.subtotal_amount = order.items_subtotal or Decimal('0.00')
+            order.grand_total_amount = order._total_from_subtotal()
+            batch.append(order)
+            if len(batch) >= options['batch_size']:
+                Order.objects.bulk_update(batch, ['subtotal_amount', 'grand_total_amount'])
+                updated += len(batch)
+                batch = []
+        Order.objects.bulk_update(batch, ['subtotal_amount', 'grand_total_amount'])
+        updated += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'Stored totals for {updated} order(s)'))
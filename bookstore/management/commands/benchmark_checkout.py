@@ -0,0 +1,64 @@
+import statistics
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from bookstore.checkout import place_order
+from bookstore.models import Book, Cart, CartItem, Customer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Time place_order() for carts of growing size and report the queries it runs (all writes are rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1,5,10,25,50,100', help='Comma-separated cart sizes (distinct books)')
+        parser.add_argument('--repeat', type=int, default=5, help='Checkouts per size; the median time is reported')
+
+    def _run_once(self, size, index):
+        """Place one order for a throwaway customer and cart, returning (queries, seconds)"""
+        user = User.objects.create_user(f'benchmark-checkout-{size}-{index}')
+        customer = Customer.objects.create(user=user, phone='0000000000', address='Benchmark')
+        cart = Cart.objects.create(customer=customer)
+        books = Book.objects.bulk_create(
+            Book(title=f'Benchmark {size}-{n}', author='Benchmark', category='Benchmark', price=Decimal('250'), stock=10)
+            for n in range(size)
+        )
+        CartItem.objects.bulk_create(CartItem(cart=cart, book=book, quantity=2) for book in books)
+
+        cart = Cart.objects.select_related('applied_coupon', 'customer').get(pk=cart.pk)
+        cart.pricing
+
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            place_order(cart, {'recipient_name': 'Benchmark', 'phone': '0000000000', 'address': 'Benchmark'}, 'Cash')
+            elapsed = time.perf_counter() - started
+        return len(queries), elapsed
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',') if size.strip()]
+
+        self.stdout.write(f"{'items':>6} {'queries':>8} {'median ms':>10} {'max ms':>8}")
+        for size in sizes:
+            counts, timings = set(), []
+            for index in range(options['repeat']):
+                try:
+                    with transaction.atomic():
+                        count, elapsed = self._run_once(size, index)
+                        raise Rollback
+                except Rollback:
+                    pass
+                counts.add(count)
+                timings.append(elapsed * 1000)
+
+            query_counts = '/'.join(str(count) for count in sorted(counts))
+            self.stdout.write(
+                f'{size:>6} {query_counts:>8} {statistics.median(timings):>10.2f} {max(timings):>8.2f}'
+            )
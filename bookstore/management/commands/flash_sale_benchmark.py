@@ -0,0 +1,191 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from decimal import Decimal
+from pathlib import Path
+
+import django
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from django.db.models import Sum
+
+from bookstore import loadtest, metrics
+from bookstore.checkout import place_order
+from bookstore.inventory import InsufficientStock
+from bookstore.models import Book, Cart, CartItem, Customer, Order, OrderItem
+
+BUYER_PREFIX = 'flash-sale-buyer-'
+DELIVERY = {'recipient_name': 'Flash Sale', 'phone': '0000000000', 'address': 'Benchmark'}
+
+
+def attempt(path, cart_id, customer_id, book_id, quantity, start_at):
+    """
+    One buyer's checkout, started at the shared `start_at` wall-clock time.
+    Returns (outcome, seconds): 'sold', 'sold_out' or the error class name.
+    """
+    time.sleep(max(0.0, start_at - time.time()))
+    started = time.perf_counter()
+    try:
+        if path == 'checkout':
+            place_order(Cart.objects.select_related('customer', 'applied_coupon').get(pk=cart_id), DELIVERY, 'Cash')
+        else:
+            # Order items saved one by one, as the admin does
+            with transaction.atomic():
+                order = Order.objects.create(customer_id=customer_id)
+                OrderItem(order=order, book=Book.objects.get(pk=book_id), quantity=quantity).save()
+        outcome = 'sold'
+    except (InsufficientStock, ValidationError):
+        outcome = 'sold_out'
+    except Exception as exc:
+        outcome = type(exc).__name__
+    finally:
+        connections.close_all()
+    return outcome, time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = (
+        'Fire parallel checkouts (threads and processes) at one low-stock book, check that it is never '
+        'oversold, and report how checkout throughput degrades as contention rises'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stock', type=int, default=50, help='Copies of the limited edition')
+        parser.add_argument('--buyers', type=int, default=200, help='Checkouts fired per run (one per buyer)')
+        parser.add_argument('--quantity', type=int, default=1, help='Copies each buyer orders')
+        parser.add_argument('--workers', default='1,4,16,32', help='Comma-separated concurrency levels')
+        parser.add_argument('--mode', choices=['threads', 'processes', 'both'], default='both')
+        parser.add_argument('--path', choices=['checkout', 'order-item'], default='checkout',
+                            help='Sell through place_order() or through OrderItem.save()')
+        parser.add_argument('--output', help='Also write the results to this JSON file')
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark books, buyers and orders')
+
+    def _buyers(self, count):
+        """(cart id, customer id) for `count` throwaway buyers, created once per invocation"""
+        buyers = []
+        for n in range(count):
+            user = User.objects.create_user(f'{BUYER_PREFIX}{n}')
+            customer = Customer.objects.create(user=user, phone='0000000000', address='Benchmark')
+            buyers.append((Cart.objects.create(customer=customer).pk, customer.pk))
+        return buyers
+
+    def _run(self, mode, workers, buyers, options):
+        stock, quantity = options['stock'], options['quantity']
+        book = Book.objects.create(
+            title=f'Limited Edition ({mode}, {workers} workers)', author='Benchmark', category='Benchmark',
+            price=Decimal('2500'), stock=stock,
+        )
+        if options['path'] == 'checkout':
+            CartItem.objects.filter(cart_id__in=[cart_id for cart_id, customer_id in buyers]).delete()
+            CartItem.objects.bulk_create(CartItem(cart_id=cart_id, book=book, quantity=quantity) for cart_id, customer_id in buyers)
+
+        connections.close_all()
+        if mode == 'threads':
+            pool = ThreadPoolExecutor(max_workers=workers)
+        else:
+            # Spawned workers import this module, so Django must be set up first
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=django.setup,
+                                       mp_context=multiprocessing.get_context('spawn'))
+        with pool:
+            # Let the processes boot before the clock starts
+            start_at = time.time() + (0.2 if mode == 'threads' else 2.0 + 0.05 * workers)
+            futures = [
+                pool.submit(attempt, options['path'], cart_id, customer_id, book.pk, quantity, start_at)
+                for cart_id, customer_id in buyers
+            ]
+            results = [future.result() for future in futures]
+        elapsed = time.time() - start_at
+
+        book.refresh_from_db()
+        items = OrderItem.objects.filter(book=book)
+        units = items.aggregate(units=Sum('quantity'))['units'] or 0
+        sold = sum(1 for outcome, seconds in results if outcome == 'sold')
+        errors = {}
+        for outcome, seconds in results:
+            if outcome not in ('sold', 'sold_out'):
+                errors[outcome] = errors.get(outcome, 0) + 1
+
+        problems = []
+        if book.stock < 0:
+            problems.append(f'stock went negative ({book.stock})')
+        if units != stock - book.stock:
+            problems.append(f'{units} unit(s) ordered but stock fell by {stock - book.stock}')
+        if items.values('order').distinct().count() != sold or units != sold * quantity:
+            problems.append(f'{sold} successful checkout(s) but {items.count()} order line(s) for {units} unit(s)')
+        if sold * quantity > stock:
+            problems.append(f'oversold: {sold * quantity} unit(s) sold from {stock}')
+
+        latencies = sorted(seconds for outcome, seconds in results)
+        return book, {
+            'mode': mode,
+            'workers': workers,
+            'attempts': len(results),
+            'sold': sold,
+            'sold_out': sum(1 for outcome, seconds in results if outcome == 'sold_out'),
+            'errors': errors,
+            'final_stock': book.stock,
+            'units_ordered': units,
+            'elapsed_seconds': round(elapsed, 3),
+            'checkouts_per_second': round(len(results) / elapsed, 2),
+            'latency_ms': {
+                f'p{round(q * 100)}': round(metrics.quantile(latencies, q) * 1000, 2) for q in metrics.QUANTILES
+            },
+            'problems': problems,
+        }
+
+    def _clean_up(self, books):
+        Order.objects.filter(orderitem__book__in=books).delete()
+        Order.objects.filter(customer__user__username__startswith=BUYER_PREFIX).delete()
+        Book.objects.filter(pk__in=[book.pk for book in books]).delete()
+        User.objects.filter(username__startswith=BUYER_PREFIX).delete()
+
+    def handle(self, *args, **options):
+        levels = [int(level) for level in options['workers'].split(',') if level.strip()]
+        modes = ['threads', 'processes'] if options['mode'] == 'both' else [options['mode']]
+        if options['stock'] < 1 or options['buyers'] < 1 or options['quantity'] < 1:
+            raise CommandError('--stock, --buyers and --quantity must be positive')
+        if User.objects.filter(username__startswith=BUYER_PREFIX).exists():
+            raise CommandError(f'Buyers from an earlier --keep run exist; delete the {BUYER_PREFIX}* users first')
+        if connection.vendor == 'sqlite':
+            self.stdout.write(self.style.WARNING(
+                'SQLite serialises every write, so this measures queueing rather than row locking; '
+                'use MySQL or PostgreSQL for real numbers'
+            ))
+
+        buyers = self._buyers(options['buyers'])
+        books, runs = [], []
+        self.stdout.write(
+            f"{'mode':<10} {'workers':>7} {'sold':>5} {'sold out':>8} {'errors':>6} {'stock':>5} "
+            f"{'checkouts/s':>11} {'p50 ms':>8} {'p99 ms':>8}"
+        )
+        try:
+            for mode in modes:
+                for workers in levels:
+                    book, run = self._run(mode, workers, buyers, options)
+                    books.append(book)
+                    runs.append(run)
+                    self.stdout.write(
+                        f"{mode:<10} {workers:>7} {run['sold']:>5} {run['sold_out']:>8} "
+                        f"{sum(run['errors'].values()):>6} {run['final_stock']:>5} {run['checkouts_per_second']:>11} "
+                        f"{run['latency_ms']['p50']:>8} {run['latency_ms']['p99']:>8}"
+                    )
+                    for problem in run['problems']:
+                        self.stdout.write(self.style.ERROR(f'  {problem}'))
+        finally:
+            if not options['keep']:
+                self._clean_up(books)
+
+        if options['output']:
+            loadtest.save({
+                'commit': loadtest.git_commit(),
+                'database': connection.vendor,
+                'options': {name: options[name] for name in ('stock', 'buyers', 'quantity', 'path')},
+                'runs': runs,
+            }, Path(options['output']))
+
+        failed = [run for run in runs if run['problems']]
+        if failed:
+            raise CommandError(f'Stock invariants broken in {len(failed)} run(s)')
+        self.stdout.write(self.style.SUCCESS(f'No oversell in {len(runs)} run(s)'))
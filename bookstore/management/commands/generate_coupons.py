@@ -0,0 +1,73 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime, parse_date
+
+from bookstore import coupons
+from bookstore.models import Coupon
+
+
+class Command(BaseCommand):
+    help = 'Generate N unique coupon codes from a template (or import codes from a file) with chunked bulk inserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('count', nargs='?', type=int, help='Number of codes to generate')
+        parser.add_argument('--type', dest='discount_type', default='percentage',
+                            choices=[choice for choice, label in Coupon.DISCOUNT_TYPE_CHOICES])
+        parser.add_argument('--value', type=Decimal, required=True, help='Discount value (amount or percent)')
+        parser.add_argument('--min-purchase', type=Decimal, default=Decimal('0'))
+        parser.add_argument('--max-usage', type=int, default=1, help='Uses allowed per code (default: single use)')
+        parser.add_argument('--expires', help='Expiry date (YYYY-MM-DD or ISO datetime); default 30 days from now')
+        parser.add_argument('--prefix', default='', help='Prefix for every generated code, e.g. SUMMER')
+        parser.add_argument('--from-file', help='Import the codes listed in this file (one per line) instead of generating')
+        parser.add_argument('--chunk-size', type=int, default=coupons.GENERATE_CHUNK_SIZE, help='Rows per INSERT')
+
+    def _expiry(self, value):
+        if not value:
+            return timezone.now() + timedelta(days=30)
+        parsed = parse_datetime(value)
+        if parsed is None:
+            day = parse_date(value)
+            if day is None:
+                raise CommandError(f'Invalid --expires value: {value}')
+            parsed = timezone.datetime.combine(day, timezone.datetime.max.time())
+        return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+    def handle(self, *args, **options):
+        template = coupons.coupon_template(
+            discount_type=options['discount_type'],
+            discount_value=options['value'],
+            min_purchase=options['min_purchase'],
+            max_usage=options['max_usage'],
+            expiry_date=self._expiry(options['expires']),
+        )
+
+        def progress(done):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'  {done} written')
+
+        if options['from_file']:
+            with open(options['from_file']) as codes:
+                sent, elapsed = coupons.import_codes(codes, template, options['chunk_size'], progress)
+            self.stdout.write(self.style.SUCCESS(
+                f'Imported {sent} code(s) (existing codes skipped) in {elapsed:.2f}s ({sent / max(elapsed, 1e-9):,.0f}/s)'
+            ))
+            return
+
+        if not options['count'] or options['count'] < 1:
+            raise CommandError('Give the number of codes to generate, or --from-file')
+
+        try:
+            coupons.check_code_length(options['prefix'], options['count'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        tag, created, elapsed = coupons.generate_codes(
+            options['count'], template, options['prefix'], options['chunk_size'], progress
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {created} code(s) starting with {options["prefix"].upper()}{tag} '
+            f'in {elapsed:.2f}s ({created / max(elapsed, 1e-9):,.0f}/s)'
+        ))
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from bookstore import images
+from bookstore.models import Book
+
+
+class Command(BaseCommand):
+    help = 'Generate resized WebP/JPEG cover derivatives for books that are missing them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('book_ids', nargs='*', type=int, help='Only process these book IDs')
+        parser.add_argument('--force', action='store_true', help='Regenerate derivatives that already exist')
+
+    def handle(self, *args, **options):
+        books = Book.objects.exclude(cover_image='').exclude(cover_image__isnull=True).only('id', 'cover_image')
+        if options['book_ids']:
+            books = books.filter(id__in=options['book_ids'])
+
+        started = time.perf_counter()
+        generated = skipped = failed = 0
+        for book in books.iterator():
+            if not options['force'] and images.has_derivatives(book.cover_image):
+                skipped += 1
+                continue
+            try:
+                images.generate_derivatives(book.cover_image)
+            except (OSError, ValueError) as e:
+                failed += 1
+                self.stderr.write(f'Book #{book.id} ({book.cover_image.name}): {e}')
+                continue
+            generated += 1
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated derivatives for {generated} cover(s), skipped {skipped}, failed {failed} in {elapsed:.1f}s'
+        ))
@@ -0,0 +1,60 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bookstore import facets, page_cache, search, synthetic
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate a reproducible synthetic dataset (books, customers with carts, coupons, orders with items, '
+        'deliveries and payments) with chunked bulk inserts, for benchmarks'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=10000)
+        parser.add_argument('--customers', type=int, default=2000)
+        parser.add_argument('--coupons', type=int, default=50)
+        parser.add_argument('--orders', type=int, default=20000,
+                            help='Orders to place; each has 1 to --max-lines items (about 2 on average)')
+        parser.add_argument('--max-lines', type=int, default=4, help='Most distinct books in one order')
+        parser.add_argument('--coupon-rate', type=float, default=0.1, help='Share of orders that try a coupon')
+        parser.add_argument('--cart-rate', type=float, default=0.3, help='Share of new customers with items in their cart')
+        parser.add_argument('--days', type=int, default=365, help='Spread registrations and orders over this many days')
+        parser.add_argument('--seed', type=int, default=0, help='Same seed and sizes give the same rows')
+        parser.add_argument('--password', default=synthetic.DEFAULT_PASSWORD, help='Password of every generated user')
+        parser.add_argument('--chunk-size', type=int, default=synthetic.DEFAULT_CHUNK_SIZE, help='Rows per INSERT batch')
+        parser.add_argument('--skip-index', action='store_true', help='Do not build search postings for the new books')
+
+    def report(self, label, rows, seconds):
+        self.stdout.write(f'  {label}: {rows:,} in {seconds:.1f}s ({rows / max(seconds, 1e-9):,.0f}/s)')
+
+    def handle(self, *args, **options):
+        if options['max_lines'] < 1:
+            raise CommandError('--max-lines must be at least 1')
+
+        started = time.perf_counter()
+        generator = synthetic.DatasetGenerator(
+            seed=options['seed'], days=options['days'], chunk_size=options['chunk_size'], report=self.report,
+        )
+
+        if options['books']:
+            generator.books(options['books'])
+            if not options['skip_index']:
+                indexing = time.perf_counter()
+                # Raw inserts bypass the post_save hook that indexes each book
+                self.report('search postings', search.update_index(batch_size=options['chunk_size']),
+                            time.perf_counter() - indexing)
+            facets.invalidate_facets()
+            page_cache.invalidate_pages()
+        if options['customers']:
+            generator.customers(options['customers'], password=options['password'], cart_rate=options['cart_rate'])
+        if options['coupons']:
+            generator.coupons(options['coupons'])
+        if options['orders']:
+            try:
+                generator.orders(options['orders'], max_lines=options['max_lines'], coupon_rate=options['coupon_rate'])
+            except ValueError as exc:
+                raise CommandError(str(exc))
+
+        self.stdout.write(self.style.SUCCESS(f'Generated the dataset in {time.perf_counter() - started:.1f}s'))
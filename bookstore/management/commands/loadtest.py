@@ -0,0 +1,65 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from bookstore import loadtest
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive concurrent simulated customers through book_list -> book_detail -> add_to_cart -> checkout '
+        '(cash or card) against a database seeded with generate_dataset, and report throughput, latency '
+        'and queries per view. Orders placed are kept, so run it against a benchmark database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help='Concurrent shoppers (one thread each)')
+        parser.add_argument('--iterations', type=int, default=20, help='Browse-to-checkout flows per shopper')
+        parser.add_argument('--warmup', type=int, default=1, help='Unmeasured flows per shopper before the run')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--card-share', type=float, default=0.5, help='Share of checkouts paid by card')
+        parser.add_argument('--output', help='Results file (default: loadtest-results/<time>-<commit>.json)')
+        parser.add_argument('--compare', help='Results file of an earlier run to compare against')
+
+    def handle(self, *args, **options):
+        baseline = loadtest.load(Path(options['compare'])) if options['compare'] else None
+        try:
+            results = loadtest.run(
+                users=options['users'], iterations=options['iterations'], warmup=options['warmup'],
+                seed=options['seed'], card_share=options['card_share'],
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        self.stdout.write(f"{'view':<32} {'req':>6} {'req/s':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'queries':>8}")
+        for view_name, view in results['views'].items():
+            latency = view['latency_ms']
+            self.stdout.write(
+                f"{view_name:<32} {view['requests']:>6} {view['requests_per_second']:>8} {latency['p50']:>8} "
+                f"{latency['p90']:>8} {latency['p99']:>8} {view['queries']['mean']:>8}"
+            )
+        pages = results['page_cache']
+        self.stdout.write(
+            f"Page cache: {pages['hit_ratio']:.1%} hit ratio ({pages['hits']} hits, {pages['not_modified']} 304s, "
+            f"{pages['misses']} misses), {pages['saved_seconds']:.2f}s of rendering saved"
+        )
+        if results['errors']:
+            self.stdout.write(self.style.WARNING(f"Error responses: {results['errors']}"))
+
+        output = Path(options['output']) if options['output'] else (
+            settings.BASE_DIR / 'loadtest-results'
+            / f"{timezone.now():%Y%m%d-%H%M%S}-{results['commit'] or 'nocommit'}.json"
+        )
+        loadtest.save(results, output)
+        self.stdout.write(self.style.SUCCESS(
+            f"{results['requests']} requests in {results['elapsed_seconds']}s "
+            f"({results['requests_per_second']} req/s), {results['checkouts']['placed']} order(s) placed, "
+            f"{results['checkouts']['failed']} checkout(s) failed. Results saved to {output}"
+        ))
+
+        if baseline:
+            self.stdout.write(f"\nCompared with {options['compare']} ({baseline.get('commit') or 'unknown commit'}):")
+            for view_name, metric, old, new, change in loadtest.compare(baseline, results):
+                self.stdout.write(f'{view_name:<32} {metric:<8} {old!s:>10} -> {new!s:<10} {change}')
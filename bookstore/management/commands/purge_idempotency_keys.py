@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from bookstore import idempotency
+
+
+class Command(BaseCommand):
+    help = 'Delete checkout idempotency keys older than IDEMPOTENCY_KEY_TTL (run daily, e.g. from cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=idempotency.PURGE_BATCH_SIZE,
+                            help='Keys deleted per statement')
+
+    def handle(self, *args, **options):
+        purged = 0
+        while True:
+            count = idempotency.purge_expired(options['batch_size'])
+            purged += count
+            if count < options['batch_size']:
+                break
+        self.stdout.write(self.style.SUCCESS(f'Purged {purged} expired idempotency key(s)'))
@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from bookstore import search
+
+
+class Command(BaseCommand):
+    help = 'Drop and rebuild the catalog search index from every Book'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        count = search.rebuild_index(batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} book(s) in {elapsed:.2f}s'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from bookstore import coupons
+
+
+class Command(BaseCommand):
+    help = 'Check each coupon usage counter against its CouponUsage records and correct any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without fixing it')
+
+    def handle(self, *args, **options):
+        drifted = coupons.reconcile(fix=not options['dry_run'])
+        for coupon, counter, actual in drifted:
+            self.stdout.write(f'{coupon.code}: counter {counter}, usages {actual}')
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('All coupon usage counters match'))
+        elif options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'{len(drifted)} coupon(s) out of step (dry run, nothing changed)'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Corrected {len(drifted)} coupon counter(s)'))
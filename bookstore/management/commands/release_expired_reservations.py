@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from bookstore import reservations
+
+
+class Command(BaseCommand):
+    help = 'Return expired checkout stock holds to Book.stock (run every minute or so, e.g. from cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=reservations.RELEASE_BATCH_SIZE,
+                            help='Holds released per transaction')
+        parser.add_argument('--loop', type=int, metavar='SECONDS',
+                            help='Keep running, sweeping again every SECONDS')
+
+    def sweep(self, batch_size):
+        released = 0
+        while True:
+            count = reservations.release_expired(batch_size)
+            released += count
+            if count < batch_size:
+                return released
+
+    def handle(self, *args, **options):
+        while True:
+            released = self.sweep(options['batch_size'])
+            if released or options['verbosity'] > 1:
+                self.stdout.write(self.style.SUCCESS(f'Released {released} expired reservation(s)'))
+            if not options['loop']:
+                return
+            time.sleep(options['loop'])
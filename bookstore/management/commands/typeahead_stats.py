@@ -0,0 +1,36 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from bookstore import typeahead
+
+
+class Command(BaseCommand):
+    help = 'Build the autocomplete trigram index and report build time, size and memory footprint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('queries', nargs='*', help='Sample queries to time against the index')
+
+    def handle(self, *args, **options):
+        rows = list(typeahead.load_rows())
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        index = typeahead.TrigramIndex()
+        index.build(rows)
+        elapsed = time.perf_counter() - started
+        memory, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        self.stdout.write(f'Books indexed:   {len(index)}')
+        self.stdout.write(f'Trigrams:        {index.trigram_count}')
+        self.stdout.write(f'Build time:      {elapsed * 1000:.1f} ms')
+        self.stdout.write(f'Memory:          {memory / 1024 / 1024:.2f} MiB (peak {peak / 1024 / 1024:.2f} MiB)')
+
+        for query in options['queries']:
+            started = time.perf_counter()
+            results = index.suggest(query)
+            elapsed = time.perf_counter() - started
+            titles = ', '.join(result['title'] for result in results[:3]) or '-'
+            self.stdout.write(f'{query!r}: {len(results)} result(s) in {elapsed * 1000:.2f} ms [{titles}]')
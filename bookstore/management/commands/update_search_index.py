@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from bookstore import search
+
+
+class Command(BaseCommand):
+    help = 'Index books missing from the catalog search index, or reindex specific books'
+
+    def add_arguments(self, parser):
+        parser.add_argument('book_ids', nargs='*', type=int, help='Reindex only these book IDs')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = search.update_index(options['book_ids'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} book(s)'))
@@ -0,0 +1,224 @@
+"""
+Per-view request metrics.
+
+MetricsMiddleware times every request and, through a database execute
+wrapper and the DjangoTemplates backend below, counts its queries and
+measures DB and template time. Samples are kept per view name in a
+rolling window, and the metrics endpoint renders their percentiles in
+the Prometheus text format. The registry lives in process memory, so
+each worker reports its own traffic.
+
+QUERY_BUDGETS maps view names to the most queries a request may run.
+Going over is logged, or raises QueryBudgetExceeded when
+QUERY_BUDGET_STRICT is on (as in the test suite).
+"""
+import logging
+import threading
+from collections import deque
+from contextvars import ContextVar
+from time import perf_counter
+
+from django.conf import settings
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates as BaseDjangoTemplates
+from django.template.backends.django import Template, reraise
+
+logger = logging.getLogger(__name__)
+
+METRICS_WINDOW = 1024
+QUANTILES = (0.5, 0.9, 0.99)
+
+# name, help text, Prometheus metric suffix
+SERIES = [
+    ('queries', 'Database queries per request', 'queries'),
+    ('db_seconds', 'Time spent in database queries per request', 'db_seconds'),
+    ('template_seconds', 'Time spent rendering templates per request', 'template_seconds'),
+    ('duration_seconds', 'Wall time per request', 'duration_seconds'),
+]
+
+_current = ContextVar('request_stats', default=None)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class RequestStats:
+    """What one request spent, filled in while it runs"""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # Database execute wrapper
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_seconds += perf_counter() - start
+            self.queries += 1
+
+
+class ViewMetrics:
+    """Running totals and a rolling sample window for one view"""
+
+    def __init__(self, window):
+        self.count = 0
+        self.budget_exceeded = 0
+        self.sums = {name: 0.0 for name, help_text, suffix in SERIES}
+        self.samples = {name: deque(maxlen=window) for name, help_text, suffix in SERIES}
+
+    def add(self, values):
+        self.count += 1
+        for name, value in values.items():
+            self.sums[name] += value
+            self.samples[name].append(value)
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def record(self, view_name, values, over_budget=False):
+        window = getattr(settings, 'METRICS_WINDOW', METRICS_WINDOW)
+        with self._lock:
+            metrics = self._views.get(view_name)
+            if metrics is None:
+                metrics = self._views[view_name] = ViewMetrics(window)
+            metrics.add(values)
+            if over_budget:
+                metrics.budget_exceeded += 1
+
+    def snapshot(self):
+        """Copy the registry so rendering does not hold the lock"""
+        with self._lock:
+            return {
+                view_name: (
+                    metrics.count,
+                    metrics.budget_exceeded,
+                    dict(metrics.sums),
+                    {name: list(samples) for name, samples in metrics.samples.items()},
+                )
+                for view_name, metrics in self._views.items()
+            }
+
+    def clear(self):
+        with self._lock:
+            self._views.clear()
+
+
+registry = Registry()
+
+
+def start_request():
+    stats = RequestStats()
+    return stats, _current.set(stats)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+def query_budget(view_name):
+    return getattr(settings, 'QUERY_BUDGETS', {}).get(view_name)
+
+
+def record_request(view_name, stats, duration):
+    """
+    Add a finished request to the registry, then enforce the view's query
+    budget: log when it is exceeded, or raise in strict mode.
+    """
+    budget = query_budget(view_name)
+    over_budget = budget is not None and stats.queries > budget
+    registry.record(view_name, {
+        'queries': stats.queries,
+        'db_seconds': stats.db_seconds,
+        'template_seconds': stats.template_seconds,
+        'duration_seconds': duration,
+    }, over_budget)
+
+    if over_budget:
+        message = f'{view_name} ran {stats.queries} queries, over its budget of {budget}'
+        if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+
+def quantile(sorted_values, q):
+    """Nearest-rank quantile of an already sorted list"""
+    index = max(0, min(len(sorted_values) - 1, round(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus(prefix='shelfly_view'):
+    window = getattr(settings, 'METRICS_WINDOW', METRICS_WINDOW)
+    snapshot = sorted(registry.snapshot().items())
+    lines = [
+        f'# HELP {prefix}_requests_total Requests handled per view.',
+        f'# TYPE {prefix}_requests_total counter',
+    ]
+    lines += [f'{prefix}_requests_total{{view="{_label(view)}"}} {count}' for view, (count, *rest) in snapshot]
+
+    lines += [
+        f'# HELP {prefix}_query_budget_exceeded_total Requests that ran more queries than their budget.',
+        f'# TYPE {prefix}_query_budget_exceeded_total counter',
+    ]
+    lines += [
+        f'{prefix}_query_budget_exceeded_total{{view="{_label(view)}"}} {exceeded}'
+        for view, (count, exceeded, *rest) in snapshot
+    ]
+
+    for name, help_text, suffix in SERIES:
+        metric = f'{prefix}_{suffix}'
+        lines += [
+            f'# HELP {metric} {help_text} (quantiles over the last {window} requests).',
+            f'# TYPE {metric} summary',
+        ]
+        for view, (count, exceeded, sums, samples) in snapshot:
+            label = _label(view)
+            values = sorted(samples[name])
+            if values:
+                for q in QUANTILES:
+                    lines.append(f'{metric}{{view="{label}",quantile="{q}"}} {_number(quantile(values, q))}')
+            lines.append(f'{metric}_sum{{view="{label}"}} {_number(sums[name])}')
+            lines.append(f'{metric}_count{{view="{label}"}} {count}')
+
+    return '\n'.join(lines) + '\n'
+
+
+class TimedTemplate(Template):
+    """Adds each top-level render to the current request's template time"""
+
+    def render(self, context=None, request=None):
+        stats = _current.get()
+        if stats is None:
+            return super().render(context, request)
+        start = perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.template_seconds += perf_counter() - start
+
+
+class DjangoTemplates(BaseDjangoTemplates):
+    """The stock DjangoTemplates backend, returning timed templates"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
@@ -0,0 +1,71 @@
+"""
+Request-scoped customer and cart, and per-view request metrics.
+
+CustomerBackend already fetched the user with their customer and cart, so
+CustomerMiddleware only reads them off the user and pins them on the
+request. Views, the customer_required decorator and the navbar use
+request.customer and request.cart instead of looking the profile up again.
+"""
+from contextlib import ExitStack
+from time import perf_counter
+
+from django.db import connections
+
+from . import metrics
+from .models import Cart, Customer
+
+
+def load_customer(user):
+    """
+    Return (customer, cart) for a shopping user, creating a missing cart.
+    Anonymous users, staff and users without a profile get (None, None).
+    """
+    if not user.is_authenticated or user.is_staff or user.is_superuser:
+        return None, None
+    try:
+        customer = user.customer
+    except Customer.DoesNotExist:
+        return None, None
+    try:
+        cart = customer.cart
+    except Cart.DoesNotExist:
+        cart, created = Cart.objects.get_or_create(customer=customer)
+    return customer, cart
+
+
+class CustomerMiddleware:
+    """Set request.customer and request.cart. Must come after AuthenticationMiddleware."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.customer, request.cart = load_customer(request.user)
+        return self.get_response(request)
+
+
+class MetricsMiddleware:
+    """
+    Time each request and count its queries, recorded under the resolved
+    view name. Goes first in MIDDLEWARE so the session and auth lookups
+    are counted too.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = perf_counter()
+        stats, token = metrics.start_request()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(stats))
+                response = self.get_response(request)
+        finally:
+            metrics.end_request(token)
+
+        match = request.resolver_match
+        if match is not None and match.view_name != 'metrics':
+            metrics.record_request(match.view_name, stats, perf_counter() - start)
+        return response
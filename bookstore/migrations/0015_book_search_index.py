@@ -0,0 +1,81 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:25
+
+import re
+import unicodedata
+from collections import Counter
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# A frozen copy of bookstore.search's tokenizer as it was when this
+# migration was written, so later changes to search cannot alter it
+FIELD_WEIGHTS = {"title": 5, "author": 3, "category": 2, "isbn": 5}
+MAX_TERM_LENGTH = 50
+TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text):
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return [token[:MAX_TERM_LENGTH] for token in TOKEN_RE.findall(stripped.casefold())]
+
+
+def book_terms(book):
+    weights = Counter()
+    for field, weight in FIELD_WEIGHTS.items():
+        for term in tokenize(getattr(book, field)):
+            weights[term] += weight
+    if book.isbn:
+        compact_isbn = re.sub(r"\W", "", book.isbn)
+        if compact_isbn:
+            weights[compact_isbn[:MAX_TERM_LENGTH]] += FIELD_WEIGHTS["isbn"]
+    return weights
+
+
+def build_search_index(apps, schema_editor):
+    Book = apps.get_model("bookstore", "Book")
+    BookSearchTerm = apps.get_model("bookstore", "BookSearchTerm")
+    postings = [
+        BookSearchTerm(term=term, book_id=book.pk, weight=weight)
+        for book in Book.objects.iterator()
+        for term, weight in book_terms(book).items()
+    ]
+    BookSearchTerm.objects.bulk_create(postings, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookstore", "0014_alter_order_status"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BookSearchTerm",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("term", models.CharField(max_length=50)),
+                ("weight", models.PositiveIntegerField(default=1)),
+                (
+                    "book",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="search_terms",
+                        to="bookstore.book",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("term", "book")},
+            },
+        ),
+        migrations.RunPython(build_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookstore", "0015_book_search_index"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(
+                fields=["category", "id"], name="bookstore_b_categor_562dfb_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(
+                fields=["author", "id"], name="bookstore_b_author_a6a54c_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(fields=["price"], name="bookstore_b_price_5c50db_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(fields=["stock"], name="bookstore_b_stock_812192_idx"),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:39
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def backfill_order_totals(apps, schema_editor):
+    Order = apps.get_model("bookstore", "Order")
+    orders = Order.objects.annotate(items_subtotal=Sum("orderitem__subtotal"))
+    batch = []
+    for order in orders.iterator(chunk_size=1000):
+        order.subtotal_amount = order.items_subtotal or Decimal("0.00")
+        order.grand_total_amount = (
+            order.subtotal_amount
+            - order.coupon_discount_amount
+            - order.order_value_discount_amount
+            - order.first_time_discount_amount
+            + order.shipping_fee
+        )
+        batch.append(order)
+        if len(batch) >= 1000:
+            Order.objects.bulk_update(batch, ["subtotal_amount", "grand_total_amount"])
+            batch = []
+    Order.objects.bulk_update(batch, ["subtotal_amount", "grand_total_amount"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookstore", "0018_idempotency_key"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="grand_total_amount",
+            field=models.DecimalField(
+                blank=True, decimal_places=2, max_digits=10, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="subtotal_amount",
+            field=models.DecimalField(
+                blank=True, decimal_places=2, max_digits=10, null=True
+            ),
+        ),
+        migrations.RunPython(backfill_order_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookstore", "0019_order_stored_totals"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["-order_date"], name="bookstore_o_order_d_6fef37_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["status", "-order_date"], name="bookstore_o_status_bf3fee_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["grand_total_amount"], name="bookstore_o_grand_t_2aac89_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:42
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_existing_usage(apps, schema_editor):
+    Coupon = apps.get_model("bookstore", "Coupon")
+    coupons = list(Coupon.objects.annotate(used=Count("couponusage")))
+    for coupon in coupons:
+        coupon.usage_count = coupon.used
+    Coupon.objects.bulk_update(coupons, ["usage_count"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookstore", "0020_order_list_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="coupon",
+            name="usage_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_existing_usage, migrations.RunPython.noop),
+    ]
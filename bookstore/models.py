@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.db.models.signals import post_save
 from django.dispatch import receiver
@@ -6,7 +6,9 @@ from django.core.exceptions import ValidationError
 from decimal import Decimal
 from datetime import datetime
 from django.utils import timezone
-from django.db.models import Count
+from django.db.models import Count, Sum
+from django.utils.functional import cached_property
+from . import images, pricing
 
 class Customer(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -29,6 +31,25 @@ class Book(models.Model):
     isbn = models.CharField(max_length=13, blank=True, null=True)
     cover_image = models.ImageField(upload_to='book_covers/', blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['category', 'id']),
+            models.Index(fields=['author', 'id']),
+            models.Index(fields=['price']),
+            models.Index(fields=['stock']),
+        ]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._original_cover_name = self._cover_name() if self.pk else ''
+
+    def _cover_name(self):
+        """Stored cover path, or None if the column was deferred"""
+        if 'cover_image' not in self.__dict__:
+            return None
+        value = self.__dict__['cover_image']
+        return getattr(value, 'name', value) or ''
+
     def __str__(self):
         return self.title
     
@@ -39,6 +60,23 @@ class Book(models.Model):
             return self.cover_image.url
         return '/static/images/no-cover.png'
 
+    def get_cover_url(self, size, fmt='jpg'):
+        """Return the URL of a resized cover derivative (see bookstore.images)"""
+        return images.cover_url(self, size, fmt)
+
+
+
+class BookSearchTerm(models.Model):
+    """Inverted index posting: one row per (term, book) with a relevance weight"""
+    term = models.CharField(max_length=50)
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='search_terms')
+    weight = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        unique_together = ('term', 'book')
+
+    def __str__(self):
+        return f"{self.term} -> Book #{self.book_id} ({self.weight})"
 
 class Coupon(models.Model):
     DISCOUNT_TYPE_CHOICES = [
@@ -54,14 +92,16 @@ class Coupon(models.Model):
     expiry_date = models.DateTimeField()
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Redemptions, kept in step with CouponUsage by bookstore.coupons
+    usage_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return f"{self.code} - {self.get_discount_type_display()}"
     
     @property
     def current_usage(self):
-        """Calculate current usage from CouponUsage records"""
-        return self.couponusage_set.count()
+        """Current usage from the redemption counter"""
+        return self.usage_count
     
     def is_valid(self):
         """Check if coupon is valid and can be used"""
@@ -116,20 +156,32 @@ class Order(models.Model):
     order_value_discount_amount = models.DecimalField(max_digits=8, decimal_places=2, default=0.00)
     first_time_discount_amount = models.DecimalField(max_digits=8, decimal_places=2, default=0.00)
 
+    # Stored at checkout (orders do not change once placed) so listings do
+    # not aggregate the items of every order. NULL only for rows not yet
+    # backfilled by backfill_order_totals.
+    subtotal_amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    grand_total_amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._original_status = self.status if self.pk else None
 
     def save(self, *args, **kwargs):
-        if self.pk and self._original_status and self._original_status != 'Cancelled' and self.status == 'Cancelled':
-            for order_item in self.orderitem_set.all():
-                order_item.book.stock += order_item.quantity
-                order_item.book.save()
-            
-            if self.applied_coupon:
-                CouponUsage.objects.filter(order=self).delete()
+        if self.subtotal_amount is not None:
+            # Shipping and discounts are editable in the admin; keep the total in step
+            self.grand_total_amount = self._total_from_subtotal()
+            if 'update_fields' in kwargs and kwargs['update_fields'] is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'grand_total_amount'}
         
-        super().save(*args, **kwargs)
+        if self.pk and self._original_status and self._original_status != 'Cancelled' and self.status == 'Cancelled':
+            # Status edited to Cancelled (e.g. in the admin): restore stock and
+            # release the coupon through the cancellation service
+            from .cancellation import cancel_orders
+            with transaction.atomic():
+                cancel_orders([self.pk], statuses=None, record=False)
+                super().save(*args, **kwargs)
+        else:
+            super().save(*args, **kwargs)
         
         self._original_status = self.status
 
@@ -138,20 +190,35 @@ class Order(models.Model):
     
     @property
     def subtotal(self):
-        """Calculate subtotal (items only, without shipping)"""
+        """Stored subtotal (items only, without shipping), or the sum of the items"""
+        if self.subtotal_amount is not None:
+            return self.subtotal_amount
         return sum(item.subtotal for item in self.orderitem_set.all())
     
+    def _total_from_subtotal(self):
+        amounts = (
+            self.coupon_discount_amount, self.order_value_discount_amount,
+            self.first_time_discount_amount, self.shipping_fee,
+        )
+        coupon, order_value, first_time, shipping = (Decimal(str(amount)) for amount in amounts)
+        return self.subtotal_amount - coupon - order_value - first_time + shipping
+    
+    def refresh_totals(self):
+        """Recompute the stored subtotal and total from the order's items"""
+        self.subtotal_amount = self.orderitem_set.aggregate(total=Sum('subtotal'))['total'] or Decimal('0.00')
+        self.grand_total_amount = self._total_from_subtotal()
+        Order.objects.filter(pk=self.pk).update(
+            subtotal_amount=self.subtotal_amount,
+            grand_total_amount=self.grand_total_amount,
+        )
+    
     @property
     def coupon_discount(self):
         """Return stored coupon discount or calculate for new orders"""
         if self.pk:
             return self.coupon_discount_amount
         
-        if self.applied_coupon:
-            is_valid, msg = self.applied_coupon.is_valid()
-            if is_valid and self.subtotal >= self.applied_coupon.min_purchase:
-                return self.applied_coupon.calculate_discount(self.subtotal)
-        return Decimal('0.00')
+        return pricing.coupon_discount(self.applied_coupon, self.subtotal)
     
     @property
     def order_value_discount(self):
@@ -159,14 +226,7 @@ class Order(models.Model):
         if self.pk:
             return self.order_value_discount_amount
         
-        subtotal = self.subtotal
-        if subtotal >= 5000:
-            return subtotal * Decimal('0.15')
-        elif subtotal >= 2000:
-            return subtotal * Decimal('0.10')
-        elif subtotal >= 1000:
-            return subtotal * Decimal('0.05')
-        return Decimal('0.00')
+        return pricing.order_value_discount(self.subtotal)
     
     @property
     def first_time_discount(self):
@@ -174,9 +234,7 @@ class Order(models.Model):
         if self.pk:
             return self.first_time_discount_amount
         
-        if self.customer.is_first_time_buyer:
-            return self.subtotal * Decimal('0.15')
-        return Decimal('0.00')
+        return pricing.first_time_discount(self.subtotal, self.customer.is_first_time_buyer)
     
     @property
     def total_discount(self):
@@ -185,11 +243,18 @@ class Order(models.Model):
     
     @property
     def total_amount(self):
-        """Calculate total amount including shipping and after discounts"""
+        """Total including shipping and after discounts, stored at checkout"""
+        if self.grand_total_amount is not None:
+            return self.grand_total_amount
         return self.subtotal - self.total_discount + self.shipping_fee
 
     class Meta:
         ordering = ['-order_date']
+        indexes = [
+            models.Index(fields=['-order_date']),
+            models.Index(fields=['status', '-order_date']),
+            models.Index(fields=['grand_total_amount']),
+        ]
 
 
 class Delivery(models.Model):
@@ -227,11 +292,15 @@ class OrderItem(models.Model):
         self.subtotal = self.unit_price * self.quantity
         
         if not self.pk:
-            if self.book.stock >= self.quantity:
-                self.book.stock -= self.quantity
-                self.book.save()
-            else:
-                raise ValidationError(f"Insufficient stock for {self.book.title}")
+            # Guarded UPDATE instead of read-modify-write, so two saves
+            # racing for the last copies cannot both take them
+            from . import inventory
+            with transaction.atomic():
+                if not inventory.decrement_stock({self.book_id: self.quantity}):
+                    raise ValidationError(f"Insufficient stock for {self.book.title}")
+                super().save(*args, **kwargs)
+            self.book.refresh_from_db(fields=['stock'])
+            return
         
         super().save(*args, **kwargs)
 
@@ -272,79 +341,59 @@ class Cart(models.Model):
     def __str__(self):
         return f"Cart - {self.customer.user.username}"
     
+    @cached_property
+    def pricing(self):
+        """Immutable pricing snapshot, computed once per cart instance"""
+        return pricing.price_cart(self)
+    
+    def refresh_pricing(self):
+        """Drop the snapshot after the cart's items or coupon change"""
+        self.__dict__.pop('pricing', None)
+        getattr(self, '_prefetched_objects_cache', {}).pop('cartitem_set', None)
+    
     @property
     def subtotal(self):
         """Calculate cart subtotal (items only)"""
-        return sum(item.subtotal for item in self.cartitem_set.all())
+        return self.pricing.subtotal
     
     @property
     def shipping_fee(self):
         """Calculate shipping fee based on cart"""
-        return self.calculate_shipping()
+        return self.pricing.shipping_fee
     
     @property
     def coupon_discount(self):
         """Calculate coupon discount if applied"""
-        if self.applied_coupon:
-            is_valid, msg = self.applied_coupon.is_valid()
-            if is_valid and self.subtotal >= self.applied_coupon.min_purchase:
-                return self.applied_coupon.calculate_discount(self.subtotal)
-        return Decimal('0.00')
+        return self.pricing.coupon_discount
     
     @property
     def order_value_discount(self):
         """Calculate auto discount based on order value"""
-        subtotal = self.subtotal
-        if subtotal >= 5000:
-            return subtotal * Decimal('0.15')
-        elif subtotal >= 2000:
-            return subtotal * Decimal('0.10')
-        elif subtotal >= 1000:
-            return subtotal * Decimal('0.05')
-        return Decimal('0.00')
+        return self.pricing.order_value_discount
     
     @property
     def first_time_discount(self):
         """Calculate first-time buyer discount (15%)"""
-        if self.customer.is_first_time_buyer:
-            return self.subtotal * Decimal('0.15')
-        return Decimal('0.00')
+        return self.pricing.first_time_discount
     
     @property
     def total_discount(self):
         """Calculate total discount"""
-        return self.coupon_discount + self.order_value_discount + self.first_time_discount
+        return self.pricing.total_discount
     
     @property
     def total_amount(self):
         """Calculate total including shipping and after discounts"""
-        return self.subtotal - self.total_discount + self.shipping_fee
+        return self.pricing.total_amount
     
     @property
     def total_items(self):
         """Count total items in cart"""
-        return sum(item.quantity for item in self.cartitem_set.all())
+        return self.pricing.total_items
     
     def calculate_shipping(self):
-        """
-        Shipping calculation logic:
-        - Free shipping for orders above Rs. 5000
-        - Rs. 50 for orders below Rs. 5000
-        - Rs. 10 per book if more than 5 books
-        """
-        subtotal = self.subtotal
-        total_items = self.total_items
-        
-        if subtotal >= 5000:
-            return Decimal('0.00')
-        
-        base_fee = Decimal('50.00')
-        
-        if total_items > 5:
-            additional_fee = (total_items - 5) * Decimal('10.00')
-            return base_fee + additional_fee
-        
-        return base_fee
+        """Shipping fee for the cart (rules live in bookstore.pricing.shipping_fee)"""
+        return self.pricing.shipping_fee
 
 
 class CartItem(models.Model):
@@ -365,6 +414,36 @@ class CartItem(models.Model):
         return self.book.price * self.quantity
 
 
+class StockReservation(models.Model):
+    """Stock held for a cart between the start of checkout and the order (or expiry)"""
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='reservations')
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ('cart', 'book')
+
+    def __str__(self):
+        return f"{self.book.title} x {self.quantity} held for cart #{self.cart_id}"
+
+
+class IdempotencyKey(models.Model):
+    """A client token for a checkout submission and the response it produced"""
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
+    key = models.CharField(max_length=64)
+    endpoint = models.CharField(max_length=50)
+    response = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        unique_together = ('customer', 'key')
+
+    def __str__(self):
+        return f"{self.endpoint} {self.key}"
+
+
 class ContactMessage(models.Model):
     SUBJECT_CHOICES = [
         ('order', 'Order Inquiry'),
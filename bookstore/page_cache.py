@@ -0,0 +1,227 @@
+"""
+Full-page cache for the catalog pages.
+
+The home, about, catalog and book pages are a shell that is the same for
+every visitor: the navbar leaves the per-user links and flash messages
+to a fragment the page fetches after it loads (views.navbar_fragment).
+Each page is cached under a version that changes only when what it shows
+does, and the version also gives its ETag and Last-Modified, so clients
+and proxies revalidate with a conditional GET and get a 304 without the
+view running at all.
+
+- Home and about show no catalog data and share the site version. It is
+  keyed by the deployed release (SHELFLY_RELEASE in settings, else the
+  checked-out git commit), so it starts afresh with every deploy, and
+  every other page is cached under whichever of its own version and the
+  site version is newer: new templates and assets are never answered
+  with a 304 for a page rendered by the old ones.
+- A book's detail page has a version of its own, bumped by every change
+  to that book, stock included.
+- The catalog pages share the catalog version. Book saves and deletes
+  bump it, and so do the stock moves the cards can show (see inventory),
+  so ordinary checkouts leave the catalog pages cached.
+
+Versions are bumped once the change commits. They live in the default
+cache, so with several workers it must be a shared backend (REDIS_URL in
+settings); with the per-process LocMemCache each worker only sees its
+own invalidations. Cached pages read books from the shared tier of
+book_cache only, so none is built from a copy older than its version.
+Callers drop the book and facet caches before invalidating pages in the
+same commit, for the same reason. Hits, misses, 304s and the render time
+saved are counted per process and served with the view metrics.
+"""
+import hashlib
+import subprocess
+import threading
+import time
+from functools import lru_cache, partial, wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from . import book_cache
+
+CATALOG_VERSION_KEY = 'pages:version:catalog'
+PAGE_CACHE_TIMEOUT = 60 * 10
+# An expired version only costs a fresh render, and keeps ids nobody asks
+# for again from piling up
+VERSION_TIMEOUT = 60 * 60 * 24
+
+
+@lru_cache(maxsize=None)
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=5,
+        ).stdout.strip()
+    except OSError:
+        return ''
+
+
+def release():
+    """Identifier of the deployed code the pages are rendered with"""
+    return getattr(settings, 'SHELFLY_RELEASE', '') or _git_commit()
+
+
+def site_version_key():
+    return f'pages:version:site:{release()}'
+
+
+def book_version_key(book_id):
+    return f'pages:version:book:{book_id}'
+
+
+def site_pages(request, *args, **kwargs):
+    return site_version_key()
+
+
+def catalog_pages(request, *args, **kwargs):
+    return CATALOG_VERSION_KEY
+
+
+def book_page(request, book_id):
+    return book_version_key(book_id)
+
+
+def version(*keys):
+    """Nanosecond timestamp of the last change behind any of these version keys"""
+    found = cache.get_many(keys)
+    for key in keys:
+        if found.get(key) is None:
+            # Lost to eviction or a restart: start a new version rather than reuse an old one
+            cache.add(key, time.time_ns(), VERSION_TIMEOUT)
+            found[key] = cache.get(key)
+    return max(found.values())
+
+
+def _bump(keys):
+    now = time.time_ns()
+    cache.set_many({key: now for key in keys}, VERSION_TIMEOUT)
+
+
+def invalidate_pages():
+    """Retire the cached catalog pages once the current transaction commits"""
+    transaction.on_commit(partial(_bump, [CATALOG_VERSION_KEY]))
+
+
+def invalidate_books(book_ids):
+    """Retire these books' detail pages once the current transaction commits"""
+    keys = [book_version_key(book_id) for book_id in book_ids]
+    if keys:
+        transaction.on_commit(partial(_bump, keys))
+
+
+class PageCacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.not_modified = 0
+            self.bypassed = 0
+            self.saved_seconds = 0.0
+
+    def add(self, outcome, saved_seconds=0.0):
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+            self.saved_seconds += saved_seconds
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'not_modified': self.not_modified,
+                'bypassed': self.bypassed,
+                'saved_seconds': self.saved_seconds,
+            }
+
+
+stats = PageCacheStats()
+
+
+def hit_ratio(snapshot):
+    """Share of cacheable requests answered without rendering (hits and 304s)"""
+    served = snapshot['hits'] + snapshot['not_modified']
+    total = served + snapshot['misses']
+    return served / total if total else 0.0
+
+
+def _page_key(request, version_key, current):
+    digest = hashlib.md5(request.get_full_path().encode(), usedforsecurity=False).hexdigest()
+    return f'page:{version_key}:{current}:{digest}'
+
+
+def cache_shared_page(version_key):
+    """
+    Serve GETs of the decorated view from the page cache, answering
+    conditional GETs with 304. `version_key(request, *args, **kwargs)`
+    names the version the page is cached under, along with the site
+    version.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                stats.add('bypassed')
+                return view_func(request, *args, **kwargs)
+
+            key_name = version_key(request, *args, **kwargs)
+            current = version(*dict.fromkeys([key_name, site_version_key()]))
+            etag = f'"{current:x}"'
+            last_modified = current // 10 ** 9
+            key = _page_key(request, key_name, current)
+            entry = cache.get(key)
+
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is not None:
+                stats.add('not_modified', entry[2] if entry else 0.0)
+            elif entry is not None:
+                content, content_type, render_seconds = entry
+                response = HttpResponse(content, content_type=content_type)
+                stats.add('hits', render_seconds)
+            else:
+                started = time.perf_counter()
+                with book_cache.shared_only():
+                    response = view_func(request, *args, **kwargs)
+                render_seconds = time.perf_counter() - started
+                if response.status_code == 200 and not response.streaming and not response.cookies:
+                    cache.set(key, (response.content, response['Content-Type'], render_seconds), PAGE_CACHE_TIMEOUT)
+                stats.add('misses')
+
+            if response.status_code in (200, 304):
+                response['ETag'] = etag
+                response['Last-Modified'] = http_date(last_modified)
+                # Revalidate on every use
+                patch_cache_control(response, max_age=0, must_revalidate=True)
+            return response
+        return wrapper
+    return decorator
+
+
+def render_prometheus(prefix='shelfly_page_cache'):
+    snapshot = stats.snapshot()
+    lines = [
+        f'# HELP {prefix}_requests_total Requests to page-cached views by outcome.',
+        f'# TYPE {prefix}_requests_total counter',
+    ]
+    lines += [
+        f'{prefix}_requests_total{{outcome="{outcome}"}} {snapshot[outcome]}'
+        for outcome in ('hits', 'not_modified', 'misses', 'bypassed')
+    ]
+    lines += [
+        f'# HELP {prefix}_hit_ratio Share of page requests answered without rendering.',
+        f'# TYPE {prefix}_hit_ratio gauge',
+        f'{prefix}_hit_ratio {hit_ratio(snapshot)!r}',
+        f'# HELP {prefix}_saved_seconds_total Render time saved by hits and 304s.',
+        f'# TYPE {prefix}_saved_seconds_total counter',
+        f'{prefix}_saved_seconds_total {snapshot["saved_seconds"]!r}',
+    ]
+    return '\n'.join(lines) + '\n'
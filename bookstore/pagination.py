@@ -0,0 +1,109 @@
+"""
+Keyset (cursor) pagination for the catalog.
+
+Pages are fetched with a WHERE on the last row seen instead of OFFSET, so
+every page costs the same indexed range scan no matter how deep the
+customer scrolls or how large the Book table grows. Cursors come from the
+query string, so one that does not parse or is out of range is ignored and
+the first page is served.
+"""
+from django.db.models import Prefetch, Q
+
+from .models import Book, Order, OrderItem
+from . import facets, search
+
+CATALOG_PAGE_SIZE = 24
+ORDER_PAGE_SIZE = 20
+# Largest value a key column holds; a bigger cursor was not issued by us
+MAX_CURSOR_VALUE = 2 ** 63 - 1
+
+# Columns rendered by book_cards.html
+BOOK_CARD_FIELDS = ('id', 'title', 'author', 'category', 'price', 'stock', 'cover_image')
+
+
+class KeysetPage:
+    """One page of results plus the cursor that fetches the page after it"""
+
+    def __init__(self, items, next_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def parse_cursor(cursor, parts=1):
+    """The cursor's `parts` dot-separated integers, or None to start from the first page"""
+    if not cursor:
+        return None
+    try:
+        values = tuple(int(part) for part in cursor.split('.'))
+    except ValueError:
+        return None
+    if len(values) != parts or not all(0 <= value <= MAX_CURSOR_VALUE for value in values):
+        return None
+    return values
+
+
+def _split(rows, page_size):
+    return rows[:page_size], len(rows) > page_size
+
+
+def book_page(cursor=None, filters=None, page_size=CATALOG_PAGE_SIZE):
+    """Browse the catalog in primary-key order. The cursor is the last book id seen."""
+    books = Book.objects.only(*BOOK_CARD_FIELDS).filter(facets.filter_q(filters or {})).order_by('id')
+    after = parse_cursor(cursor)
+    if after:
+        books = books.filter(id__gt=after[0])
+
+    items, has_next = _split(list(books[:page_size + 1]), page_size)
+    return KeysetPage(items, str(items[-1].id) if has_next else None)
+
+
+def search_page(query, cursor=None, filters=None, page_size=CATALOG_PAGE_SIZE):
+    """
+    Page through ranked search results ordered by (score desc, book id asc).
+    The cursor is "<score>.<book id>" of the last result seen.
+    """
+    matches = search.ranked_matches(query)
+    if filters:
+        matches = matches.filter(facets.filter_q(filters, prefix='book__'))
+    after = parse_cursor(cursor, parts=2)
+    if after:
+        score, book_id = after
+        matches = matches.filter(Q(score__lt=score) | Q(score=score, book_id__gt=book_id))
+
+    rows, has_next = _split(list(matches[:page_size + 1]), page_size)
+    books = Book.objects.only(*BOOK_CARD_FIELDS).in_bulk([row['book_id'] for row in rows])
+    items = [books[row['book_id']] for row in rows if row['book_id'] in books]
+
+    next_cursor = None
+    if has_next:
+        last = rows[-1]
+        next_cursor = f"{last['score']}.{last['book_id']}"
+    return KeysetPage(items, next_cursor)
+
+
+def order_page(customer, cursor=None, page_size=ORDER_PAGE_SIZE):
+    """
+    A customer's orders, newest first. The cursor is the last order id seen.
+    Delivery and coupon come in the same query and the items with their
+    books in one more, however many orders and lines the page has.
+    """
+    orders = (
+        Order.objects.filter(customer=customer)
+        .select_related('delivery', 'applied_coupon')
+        .prefetch_related(
+            Prefetch('orderitem_set', queryset=OrderItem.objects.select_related('book').only(
+                'id', 'order_id', 'quantity', 'subtotal', 'book__id', 'book__title',
+            ).order_by('id'))
+        )
+        .order_by('-id')
+    )
+    before = parse_cursor(cursor)
+    if before:
+        orders = orders.filter(id__lt=before[0])
+
+    items, has_next = _split(list(orders[:page_size + 1]), page_size)
+    return KeysetPage(items, str(items[-1].id) if has_next else None)
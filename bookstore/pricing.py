@@ -0,0 +1,109 @@
+"""
+Cart pricing.
+
+price_cart() loads a cart's items with their books in one query and
+computes every money figure once into an immutable CartPricing snapshot.
+Cart's money properties, the cart/checkout templates and CartAdmin all
+read from that snapshot instead of re-walking cartitem_set.
+"""
+from dataclasses import dataclass
+from decimal import Decimal
+
+ZERO = Decimal('0.00')
+
+FREE_SHIPPING_THRESHOLD = Decimal('5000')
+BASE_SHIPPING_FEE = Decimal('50.00')
+FREE_ITEMS_PER_SHIPMENT = 5
+EXTRA_ITEM_SHIPPING_FEE = Decimal('10.00')
+
+FIRST_TIME_DISCOUNT_RATE = Decimal('0.15')
+
+# (minimum subtotal, discount rate), highest threshold first
+ORDER_VALUE_DISCOUNT_TIERS = [
+    (Decimal('5000'), Decimal('0.15')),
+    (Decimal('2000'), Decimal('0.10')),
+    (Decimal('1000'), Decimal('0.05')),
+]
+
+
+def order_value_discount(subtotal):
+    """Automatic discount based on order value"""
+    for threshold, rate in ORDER_VALUE_DISCOUNT_TIERS:
+        if subtotal >= threshold:
+            return subtotal * rate
+    return ZERO
+
+
+def first_time_discount(subtotal, is_first_time_buyer):
+    """First-time buyer discount (15%)"""
+    if is_first_time_buyer:
+        return subtotal * FIRST_TIME_DISCOUNT_RATE
+    return ZERO
+
+
+def coupon_discount(coupon, subtotal):
+    """Discount from an applied coupon, if it is still valid for this subtotal"""
+    if coupon:
+        is_valid, msg = coupon.is_valid()
+        if is_valid and subtotal >= coupon.min_purchase:
+            return coupon.calculate_discount(subtotal)
+    return ZERO
+
+
+def shipping_fee(subtotal, total_items):
+    """
+    Shipping calculation logic:
+    - Free shipping for orders above Rs. 5000
+    - Rs. 50 for orders below Rs. 5000
+    - Rs. 10 per book if more than 5 books
+    """
+    if subtotal >= FREE_SHIPPING_THRESHOLD:
+        return ZERO
+
+    if total_items > FREE_ITEMS_PER_SHIPMENT:
+        return BASE_SHIPPING_FEE + (total_items - FREE_ITEMS_PER_SHIPMENT) * EXTRA_ITEM_SHIPPING_FEE
+
+    return BASE_SHIPPING_FEE
+
+
+@dataclass(frozen=True)
+class CartPricing:
+    """Every money figure of a cart, computed once"""
+    items: tuple
+    subtotal: Decimal
+    total_items: int
+    coupon_discount: Decimal
+    order_value_discount: Decimal
+    first_time_discount: Decimal
+    shipping_fee: Decimal
+
+    @property
+    def total_discount(self):
+        return self.coupon_discount + self.order_value_discount + self.first_time_discount
+
+    @property
+    def total_amount(self):
+        return self.subtotal - self.total_discount + self.shipping_fee
+
+
+def cart_items(cart):
+    """Cart items with their books, reusing a prefetch when the caller made one"""
+    if 'cartitem_set' in getattr(cart, '_prefetched_objects_cache', {}):
+        return list(cart.cartitem_set.all())
+    return list(cart.cartitem_set.select_related('book').order_by('added_at', 'id'))
+
+
+def price_cart(cart):
+    items = tuple(cart_items(cart))
+    subtotal = sum((item.book.price * item.quantity for item in items), ZERO)
+    total_items = sum(item.quantity for item in items)
+
+    return CartPricing(
+        items=items,
+        subtotal=subtotal,
+        total_items=total_items,
+        coupon_discount=coupon_discount(cart.applied_coupon, subtotal),
+        order_value_discount=order_value_discount(subtotal),
+        first_time_discount=first_time_discount(subtotal, cart.customer.is_first_time_buyer),
+        shipping_fee=shipping_fee(subtotal, total_items),
+    )
@@ -0,0 +1,153 @@
+"""
+Stock reservations for checkout.
+
+When a customer opens checkout, the cart's quantities are taken out of
+Book.stock and recorded as StockReservation rows that expire after
+STOCK_RESERVATION_TTL seconds. Book.stock therefore always means "free to
+sell", so the catalog and cart checks see held copies as gone and a flash
+sale cannot oversell at the last step. place_order() converts the holds
+into the sale; release_expired() (run by release_expired_reservations)
+puts abandoned holds back. Shrinking the cart trims its holds to match
+(trim_holds), and deleting a cart, directly or with its customer, releases
+them (see signals), so a hold never keeps more copies than the cart wants.
+
+Every path moves stock with the single-statement primitives in inventory,
+so a hot title costs one short row lock per checkout, not a read-modify-
+write.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, Value, When
+from django.utils import timezone
+
+from .models import CartItem, StockReservation
+from . import inventory
+
+DEFAULT_RESERVATION_TTL = 15 * 60
+RELEASE_BATCH_SIZE = 1000
+
+
+def reservation_ttl():
+    return timedelta(seconds=getattr(settings, 'STOCK_RESERVATION_TTL', DEFAULT_RESERVATION_TTL))
+
+
+def shortfall(wanted, held):
+    """Quantities in `wanted` beyond what `held` already covers"""
+    return {book_id: quantity - held.get(book_id, 0) for book_id, quantity in wanted.items() if quantity > held.get(book_id, 0)}
+
+
+def _sum_by_book(rows):
+    totals = {}
+    for book_id, quantity in rows:
+        totals[book_id] = totals.get(book_id, 0) + quantity
+    return totals
+
+
+def hold_cart(cart):
+    """
+    Reserve stock for everything in the cart and (re)start the expiry clock.
+    Only the difference from the cart's current holds moves stock.
+    Raises inventory.InsufficientStock, leaving existing holds untouched,
+    if a book no longer has enough free copies. Returns the expiry time.
+    """
+    wanted = {item.book_id: item.quantity for item in cart.pricing.items}
+    expires_at = timezone.now() + reservation_ttl()
+
+    try:
+        with transaction.atomic():
+            holds = StockReservation.objects.select_for_update().filter(cart=cart)
+            held = dict(holds.values_list('book_id', 'quantity'))
+
+            if held == wanted:
+                holds.update(expires_at=expires_at)
+                return expires_at
+
+            take = shortfall(wanted, held)
+            if not inventory.decrement_stock(take):
+                raise inventory.StockShortfall(take)
+            inventory.increment_stock(shortfall(held, wanted))
+
+            holds.delete()
+            StockReservation.objects.bulk_create(
+                StockReservation(cart=cart, book_id=book_id, quantity=quantity, expires_at=expires_at)
+                for book_id, quantity in wanted.items()
+            )
+    except inventory.StockShortfall as e:
+        # Named only now, from the stock the rollback restored
+        raise inventory.InsufficientStock(inventory.short_titles(e.quantities)) from None
+    return expires_at
+
+
+def take_holds(cart):
+    """
+    Lock and delete the cart's holds, returning {book_id: quantity} held.
+    Must run inside the order's transaction so a rollback restores them;
+    expired holds that the sweeper has not reached yet still count.
+    """
+    holds = StockReservation.objects.select_for_update().filter(cart=cart)
+    held = dict(holds.values_list('book_id', 'quantity'))
+    if held:
+        holds.delete()
+    return held
+
+
+def trim_holds(cart_id):
+    """
+    Shrink the cart's holds to its current quantities and return the excess
+    to stock. Holds never grow here; hold_cart() tops them up at checkout.
+    """
+    with transaction.atomic():
+        holds = StockReservation.objects.select_for_update().filter(cart_id=cart_id)
+        held = dict(holds.values_list('book_id', 'quantity'))
+        if not held:
+            return
+        in_cart = dict(CartItem.objects.filter(cart_id=cart_id, book_id__in=held).values_list('book_id', 'quantity'))
+        excess = shortfall(held, in_cart)
+        if not excess:
+            return
+
+        inventory.increment_stock(excess)
+        holds.filter(book_id__in=[book_id for book_id in excess if book_id not in in_cart]).delete()
+        kept = {book_id: in_cart[book_id] for book_id in excess if book_id in in_cart}
+        if kept:
+            holds.filter(book_id__in=kept).update(
+                quantity=Case(
+                    *[When(book_id=book_id, then=Value(quantity)) for book_id, quantity in kept.items()],
+                    default=F('quantity'),
+                    output_field=PositiveIntegerField(),
+                )
+            )
+
+
+def release(holds):
+    """Return these holds to stock and delete them. Returns the number released."""
+    with transaction.atomic():
+        rows = list(holds.select_for_update().values_list('id', 'book_id', 'quantity'))
+        if not rows:
+            return 0
+
+        inventory.increment_stock(_sum_by_book((book_id, quantity) for _, book_id, quantity in rows))
+        StockReservation.objects.filter(id__in=[hold_id for hold_id, _, _ in rows]).delete()
+    return len(rows)
+
+
+def release_expired(batch_size=RELEASE_BATCH_SIZE):
+    """
+    Return one batch of expired holds to stock. Rows another transaction
+    has locked (an order being placed) are skipped rather than waited on.
+    Returns the number of holds released.
+    """
+    with transaction.atomic():
+        expired = list(
+            StockReservation.objects.select_for_update(skip_locked=True)
+            .filter(expires_at__lte=timezone.now())
+            .values_list('id', 'book_id', 'quantity')[:batch_size]
+        )
+        if not expired:
+            return 0
+
+        inventory.increment_stock(_sum_by_book((book_id, quantity) for _, book_id, quantity in expired))
+        StockReservation.objects.filter(id__in=[hold_id for hold_id, _, _ in expired]).delete()
+    return len(expired)
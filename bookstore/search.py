@@ -0,0 +1,153 @@
+"""
+Catalog search backed by an inverted index.
+
+Every Book is tokenized into BookSearchTerm postings (term, book, weight).
+A search looks up the postings for the query terms through the
+(term, book) unique index, so its cost depends on how many books match
+rather than on the size of the catalog. Results are ranked by the sum of
+the field weights of the matched terms.
+"""
+import re
+import unicodedata
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Case, Count, IntegerField, Max, Q, Sum, When
+
+from .models import Book, BookSearchTerm
+
+# Relevance weight contributed by a term for each field it appears in
+FIELD_WEIGHTS = {
+    'title': 5,
+    'author': 3,
+    'category': 2,
+    'isbn': 5,
+}
+
+INDEXED_FIELDS = tuple(FIELD_WEIGHTS)
+MAX_TERM_LENGTH = 50
+MIN_PREFIX_LENGTH = 2
+SEARCH_RESULT_LIMIT = 200
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def normalize(text):
+    """Casefold text and strip accents/diacritics so spellings compare equal"""
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    stripped = ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return stripped.casefold()
+
+
+def tokenize(text):
+    """Split text into normalized search terms"""
+    return [token[:MAX_TERM_LENGTH] for token in TOKEN_RE.findall(normalize(text))]
+
+
+def book_terms(book):
+    """Return {term: weight} for a book's indexed fields"""
+    weights = Counter()
+    for field, weight in FIELD_WEIGHTS.items():
+        for term in tokenize(getattr(book, field)):
+            weights[term] += weight
+
+    # ISBNs are often typed without their separators
+    if book.isbn:
+        compact_isbn = re.sub(r'\W', '', book.isbn)
+        if compact_isbn:
+            weights[compact_isbn[:MAX_TERM_LENGTH]] += FIELD_WEIGHTS['isbn']
+
+    return weights
+
+
+def _postings(book):
+    return [
+        BookSearchTerm(term=term, book_id=book.pk, weight=weight)
+        for term, weight in book_terms(book).items()
+    ]
+
+
+def index_book(book):
+    """Replace the postings of a single book"""
+    with transaction.atomic():
+        BookSearchTerm.objects.filter(book_id=book.pk).delete()
+        BookSearchTerm.objects.bulk_create(_postings(book))
+
+
+def index_books(books, batch_size=1000):
+    """Bulk-insert postings for the given books. Returns the number of books written."""
+    batch = []
+    count = 0
+    for book in books:
+        batch.extend(_postings(book))
+        count += 1
+        if len(batch) >= batch_size:
+            BookSearchTerm.objects.bulk_create(batch, batch_size=batch_size)
+            batch = []
+    if batch:
+        BookSearchTerm.objects.bulk_create(batch, batch_size=batch_size)
+    return count
+
+
+def rebuild_index(batch_size=1000):
+    """Drop and rebuild the whole index. Returns the number of books indexed."""
+    books = Book.objects.only(*INDEXED_FIELDS).order_by('pk').iterator(chunk_size=batch_size)
+    with transaction.atomic():
+        BookSearchTerm.objects.all().delete()
+        return index_books(books, batch_size=batch_size)
+
+
+def update_index(book_ids=None, batch_size=1000):
+    """
+    Incrementally index books.
+    With book_ids, reindex exactly those books; otherwise index every
+    book that has no postings yet (e.g. rows created by bulk imports,
+    which bypass the post_save hook).
+    """
+    if book_ids:
+        books = Book.objects.filter(pk__in=book_ids)
+        with transaction.atomic():
+            BookSearchTerm.objects.filter(book_id__in=book_ids).delete()
+            return index_books(books.only(*INDEXED_FIELDS).iterator(chunk_size=batch_size), batch_size)
+
+    books = Book.objects.filter(search_terms__isnull=True).only(*INDEXED_FIELDS)
+    return index_books(books.iterator(chunk_size=batch_size), batch_size)
+
+
+def ranked_matches(query):
+    """
+    Return a values queryset of {'book_id', 'score'} for books matching
+    every term of the query, best match first. The last term is matched
+    as a prefix so results keep up while the customer is still typing.
+    """
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms:
+        return BookSearchTerm.objects.none()
+
+    *exact_terms, last_term = terms
+    if len(last_term) >= MIN_PREFIX_LENGTH:
+        last_match = Q(term__startswith=last_term)
+    else:
+        last_match = Q(term=last_term)
+
+    term_filter = last_match
+    matched = Max(Case(When(last_match, then=1), default=0, output_field=IntegerField()))
+    if exact_terms:
+        term_filter |= Q(term__in=exact_terms)
+        matched += Count('term', filter=Q(term__in=exact_terms), distinct=True)
+
+    return (
+        BookSearchTerm.objects
+        .filter(term_filter)
+        .values('book_id')
+        .annotate(score=Sum('weight'), matched=matched)
+        .filter(matched=len(terms))
+        .order_by('-score', 'book_id')
+    )
+
+
+def search_books(query, limit=SEARCH_RESULT_LIMIT):
+    """Return up to `limit` Books matching the query, in relevance order"""
+    book_ids = list(ranked_matches(query).values_list('book_id', flat=True)[:limit])
+    books = Book.objects.in_bulk(book_ids)
+    return [books[book_id] for book_id in book_ids if book_id in books]
@@ -0,0 +1,81 @@
+import logging
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .models import Book, Cart, CartItem, StockReservation
+from . import book_cache, cart_summary, facets, images, page_cache, reservations, search, typeahead
+
+logger = logging.getLogger(__name__)
+
+
+def _changes_any(update_fields, fields):
+    return update_fields is None or not set(update_fields).isdisjoint(fields)
+
+
+@receiver(post_save, sender=Book)
+def index_book_on_save(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Keep the search indexes in step with catalog edits (postings cascade on delete)"""
+    # Fixture loads are left to search.update_index(), which indexes books without postings
+    if not raw and _changes_any(update_fields, search.INDEXED_FIELDS):
+        search.index_book(instance)
+    typeahead.refresh_book(instance)
+    transaction.on_commit(facets.invalidate_facets)
+    book_cache.invalidate([instance.pk])
+    page_cache.invalidate_books([instance.pk])
+    page_cache.invalidate_pages()
+
+
+@receiver(post_delete, sender=Book)
+def unindex_book_on_delete(sender, instance, **kwargs):
+    typeahead.forget_book(instance.pk)
+    transaction.on_commit(facets.invalidate_facets)
+    book_cache.invalidate([instance.pk])
+    page_cache.invalidate_books([instance.pk])
+    page_cache.invalidate_pages()
+
+
+def _refresh_cover_derivatives(field_file, old_name):
+    try:
+        if old_name:
+            images.delete_derivatives(field_file.storage, old_name)
+        if field_file:
+            images.generate_derivatives(field_file)
+    except (OSError, ValueError):
+        logger.exception('Could not generate cover derivatives for %s', field_file.name)
+    # Pages cached meanwhile point at the original upload
+    page_cache.invalidate_books([field_file.instance.pk])
+    page_cache.invalidate_pages()
+
+
+@receiver(post_save, sender=Book)
+def regenerate_cover_derivatives(sender, instance, raw=False, **kwargs):
+    """Resize a newly uploaded cover once the save has committed"""
+    old_name = instance._original_cover_name
+    new_name = instance._cover_name()
+    if raw or old_name is None or new_name == old_name:
+        return
+
+    instance._original_cover_name = new_name
+    field_file = instance.cover_image
+    transaction.on_commit(lambda: _refresh_cover_derivatives(field_file, old_name))
+
+
+@receiver(post_delete, sender=Book)
+def delete_cover_derivatives(sender, instance, **kwargs):
+    if instance.cover_image:
+        storage, name = instance.cover_image.storage, instance.cover_image.name
+        transaction.on_commit(lambda: images.delete_derivatives(storage, name))
+
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def invalidate_cart_badge(sender, instance, **kwargs):
+    cart_summary.invalidate_cart_summary(instance.cart_id)
+
+
+@receiver(pre_delete, sender=Cart)
+def release_cart_holds(sender, instance, **kwargs):
+    """Holds cascade with their cart (or its customer); put their copies back first"""
+    reservations.release(StockReservation.objects.filter(cart=instance))
@@ -0,0 +1,372 @@
+"""
+Synthetic datasets for benchmarks.
+
+generate_dataset builds books, customers (with their users and carts),
+coupons, and orders with items, deliveries, payments and coupon usages
+at any scale. Rows go in with executemany a chunk at a time. Primary keys
+are allocated past the current maximum so orders are linked to their
+rows without reading ids back (MySQL does not return them from bulk
+inserts), and one seed always produces the same rows.
+
+Synthetic users are named synth_<id> and share one password, so load
+tests can log in as them.
+"""
+import math
+import random
+import time
+from array import array
+from datetime import timedelta
+from decimal import ROUND_HALF_UP, Decimal
+from functools import partial
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import (
+    Book, Cart, CartItem, Coupon, CouponUsage, Customer, Delivery, Order, OrderCancellation, OrderItem, Payment,
+)
+from . import pricing
+
+USERNAME_PREFIX = 'synth_'
+DEFAULT_PASSWORD = 'synthetic-shopper'
+DEFAULT_CHUNK_SIZE = 5000
+CENT = Decimal('0.01')
+
+CATEGORIES = [
+    ('Fiction', 20), ('Self Help', 10), ('Finance', 6), ('Spy', 5), ('Mystery', 9), ('Romance', 8),
+    ('Science', 6), ('History', 6), ('Biography', 5), ('Poetry', 3), ('Children', 8), ('Religion', 5),
+    ('Urdu Literature', 6), ('Technology', 3),
+]
+FIRST_NAMES = [
+    'Ahmed', 'Ayesha', 'Bilal', 'Fatima', 'Hamza', 'Hira', 'Imran', 'Iqra', 'Junaid', 'Kiran', 'Mahnoor',
+    'Omar', 'Saad', 'Sana', 'Usman', 'Zainab', 'Ali', 'Maryam', 'Hassan', 'Noor', 'James', 'Emily', 'Daniel',
+    'Sarah', 'Michael', 'Olivia', 'Yusuf', 'Amna', 'Faisal', 'Rabia',
+]
+LAST_NAMES = [
+    'Khan', 'Ahmed', 'Malik', 'Hussain', 'Qureshi', 'Siddiqui', 'Butt', 'Chaudhry', 'Sheikh', 'Raza',
+    'Iqbal', 'Mirza', 'Abbasi', 'Javed', 'Aslam', 'Clear', 'Morgan', 'Hill', 'Carter', 'Brooks', 'Hayes',
+    'Farooq', 'Rehman', 'Anwar', 'Baig',
+]
+TITLE_WORDS = [
+    'Silent', 'River', 'Shadow', 'Garden', 'Secret', 'Mountain', 'Night', 'Habits', 'Money', 'Mind', 'Empire',
+    'Desert', 'Letters', 'Storm', 'Journey', 'Light', 'City', 'Memory', 'Stone', 'Crown', 'Winter', 'House',
+    'Last', 'Hidden', 'Golden', 'Lost', 'Broken', 'Wild', 'Quiet', 'Iron', 'Paper', 'Moon', 'Ocean', 'Code',
+    'Dream', 'Fire', 'Glass', 'Thinking', 'Wealth', 'Power',
+]
+CITIES = ['Lahore', 'Karachi', 'Islamabad', 'Rawalpindi', 'Faisalabad', 'Multan', 'Peshawar', 'Quetta', 'Sialkot']
+CANCEL_REASONS = ['Ordered by mistake', 'Found a better price', 'Delivery too slow', 'Changed my mind', None]
+
+# (status, weight) for orders placed in the last RECENT_DAYS days; older ones are settled
+RECENT_DAYS = 14
+RECENT_STATUSES = [('Pending', 10), ('Confirmed', 35), ('Shipped', 30), ('Delivered', 20), ('Cancelled', 5)]
+SETTLED_STATUSES = [('Delivered', 90), ('Cancelled', 10)]
+
+def _weighted(choices):
+    values, weights = zip(*choices)
+    return list(values), list(accumulate(weights))
+
+
+def person_name(n):
+    return FIRST_NAMES[n % len(FIRST_NAMES)], LAST_NAMES[(n // len(FIRST_NAMES)) % len(LAST_NAMES)]
+
+
+def phone_number(n):
+    return f'03{(n * 7919) % 10 ** 9:09d}'
+
+
+def address(n):
+    return f'House {n % 500 + 1}, Street {n % 40 + 1}, {CITIES[n % len(CITIES)]}'
+
+
+def isbn13(n):
+    digits = f'978{n % 10 ** 9:09d}'
+    check = (10 - sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(digits)) % 10) % 10
+    return f'{digits}{check}'
+
+
+def next_id(model):
+    return (model.objects.aggregate(top=Max('pk'))['top'] or 0) + 1
+
+
+class Inserter:
+    """Buffered executemany INSERT of raw rows into one model's table"""
+
+    def __init__(self, model, field_names):
+        fields = [model._meta.get_field(name) for name in field_names]
+        ops = connection.ops
+        adapters = {
+            'DateTimeField': lambda field: ops.adapt_datetimefield_value,
+            'DecimalField': lambda field: partial(
+                ops.adapt_decimalfield_value, max_digits=field.max_digits, decimal_places=field.decimal_places,
+            ),
+        }
+        # Values are already the right Python types, so only the backend
+        # adaptation is needed, not the field's full per-value preparation
+        self.prep = [
+            adapters[field.get_internal_type()](field) if field.get_internal_type() in adapters else None
+            for field in fields
+        ]
+        quote = connection.ops.quote_name
+        self.sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            quote(model._meta.db_table),
+            ', '.join(quote(field.column) for field in fields),
+            ', '.join(['%s'] * len(fields)),
+        )
+        self.rows = []
+        self.written = 0
+
+    def add(self, *values):
+        self.rows.append(values)
+
+    def flush(self, cursor):
+        if not self.rows:
+            return
+        prep = self.prep
+        cursor.executemany(self.sql, [
+            tuple(value if convert is None else convert(value) for convert, value in zip(prep, row))
+            for row in self.rows
+        ])
+        self.written += len(self.rows)
+        self.rows = []
+
+
+def flush(*inserters):
+    """Write the buffered rows in dependency order, in one transaction"""
+    with transaction.atomic(), connection.cursor() as cursor:
+        for inserter in inserters:
+            inserter.flush(cursor)
+
+
+def reset_sequences(models):
+    """Move PostgreSQL sequences past the explicit ids (a no-op elsewhere)"""
+    statements = connection.ops.sequence_reset_sql(no_style(), models)
+    if statements:
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+
+
+class DatasetGenerator:
+    """
+    Generates one dataset. Every random choice comes from one seeded
+    Random, in a fixed order, so the same seed and sizes give the same rows.
+    `report(label, rows, seconds)` is called as each table group finishes.
+    """
+
+    def __init__(self, seed=0, days=365, chunk_size=DEFAULT_CHUNK_SIZE, report=None):
+        self.rng = random.Random(seed)
+        self.days = days
+        self.chunk_size = chunk_size
+        self.report = report or (lambda label, rows, seconds: None)
+        self.now = timezone.now().replace(microsecond=0)
+        self.start = self.now - timedelta(days=days)
+
+    def _moment(self, fraction):
+        """A datetime `fraction` of the way through the generated period"""
+        return self.start + timedelta(seconds=int(fraction * self.days * 86400))
+
+    def _skewed(self, size, power):
+        """Index into a sequence of `size`, favouring the front (popular items)"""
+        return min(size - 1, int(size * self.rng.random() ** power))
+
+    def _finish(self, label, started, rows, models):
+        reset_sequences(models)
+        self.report(label, rows, time.perf_counter() - started)
+
+    def books(self, count):
+        started = time.perf_counter()
+        rng = self.rng
+        categories, category_weights = _weighted(CATEGORIES)
+        author_pool = max(50, count // 20)
+        first_id = next_id(Book)
+        books = Inserter(Book, ['id', 'title', 'author', 'category', 'price', 'stock', 'description', 'isbn'])
+
+        for n in range(count):
+            book_id = first_id + n
+            title = ' '.join(rng.choice(TITLE_WORDS) for _ in range(rng.randint(2, 4)))
+            first, last = person_name(self._skewed(author_pool, 3))
+            category = rng.choices(categories, cum_weights=category_weights)[0]
+            price = Decimal(min(9999, max(150, round(rng.lognormvariate(math.log(900), 0.6), -1))))
+            stock = 0 if rng.random() < 0.08 else rng.randint(1, 200)
+            books.add(
+                book_id, f'The {title}', f'{first} {last}', category, price, stock,
+                f'A {category.lower()} title by {first} {last}.', isbn13(book_id),
+            )
+            if len(books.rows) >= self.chunk_size:
+                flush(books)
+        flush(books)
+        self._finish('books', started, books.written, [Book])
+        return books.written
+
+    def customers(self, count, password=DEFAULT_PASSWORD, cart_rate=0.3):
+        """Users, their customer profiles and carts; `cart_rate` of the carts get items"""
+        started = time.perf_counter()
+        rng = self.rng
+        password_hash = make_password(password)
+        book_ids = self._book_ids()
+        user_id, customer_id, cart_id = next_id(User), next_id(Customer), next_id(Cart)
+
+        users = Inserter(User, [
+            'id', 'password', 'is_superuser', 'username', 'first_name', 'last_name', 'email',
+            'is_staff', 'is_active', 'date_joined',
+        ])
+        customers = Inserter(Customer, ['id', 'user', 'phone', 'address', 'registration_date', 'is_first_time_buyer'])
+        carts = Inserter(Cart, ['id', 'customer', 'created_at', 'updated_at'])
+        cart_items = Inserter(CartItem, ['cart', 'book', 'quantity', 'added_at'])
+
+        for n in range(count):
+            uid, cid, kid = user_id + n, customer_id + n, cart_id + n
+            first, last = person_name(uid)
+            joined = self._moment(rng.random())
+            users.add(
+                uid, password_hash, False, f'{USERNAME_PREFIX}{uid}', first, last,
+                f'{USERNAME_PREFIX}{uid}@example.com', False, True, joined,
+            )
+            customers.add(cid, uid, phone_number(cid), address(cid), joined, True)
+            carts.add(kid, cid, joined, joined)
+            if book_ids and rng.random() < cart_rate:
+                for book_index in {self._skewed(len(book_ids), 2.5) for _ in range(rng.randint(1, 4))}:
+                    cart_items.add(kid, book_ids[book_index], rng.randint(1, 2), self._moment(rng.uniform(0.9, 1)))
+            if len(users.rows) >= self.chunk_size:
+                flush(users, customers, carts, cart_items)
+        flush(users, customers, carts, cart_items)
+        self._finish('customers', started, customers.written, [User, Customer, Cart, CartItem])
+        return customers.written
+
+    def coupons(self, count):
+        started = time.perf_counter()
+        rng = self.rng
+        first_id = next_id(Coupon)
+        coupons = Inserter(Coupon, [
+            'id', 'code', 'discount_type', 'discount_value', 'max_usage', 'min_purchase',
+            'expiry_date', 'is_active', 'created_at', 'usage_count',
+        ])
+        for n in range(count):
+            coupon_id = first_id + n
+            if rng.random() < 0.6:
+                discount_type, value = 'percentage', Decimal(rng.choice([5, 10, 15, 20, 25]))
+            else:
+                discount_type, value = 'fixed', Decimal(rng.choice([100, 200, 250, 500]))
+            coupons.add(
+                coupon_id, f'SYN{coupon_id}', discount_type, value, rng.choice([100, 500, 1000, 5000]),
+                Decimal(rng.choice([0, 500, 1000, 2000])), self.now + timedelta(days=rng.randint(-30, 365)),
+                rng.random() < 0.9, self._moment(rng.random() * 0.5), 0,
+            )
+        flush(coupons)
+        self._finish('coupons', started, coupons.written, [Coupon])
+        return coupons.written
+
+    def orders(self, count, max_lines=4, coupon_rate=0.1):
+        """
+        Orders with their items, delivery, payment, coupon usage and
+        cancellation, placed by synthetic customers in time order.
+        Stored totals follow bookstore.pricing.
+        """
+        started = time.perf_counter()
+        rng = self.rng
+        customer_ids = list(
+            Customer.objects.filter(user__username__startswith=USERNAME_PREFIX).order_by('pk').values_list('pk', flat=True)
+        )
+        books = self._book_prices()
+        if not customer_ids or not books[0]:
+            raise ValueError('Orders need synthetic customers and books; generate those first')
+        book_ids, book_prices = books
+        coupons = list(Coupon.objects.filter(code__startswith='SYN').order_by('pk'))
+        coupon_uses = {coupon.pk: coupon.usage_count for coupon in coupons}
+        recent_statuses, recent_weights = _weighted(RECENT_STATUSES)
+        settled_statuses, settled_weights = _weighted(SETTLED_STATUSES)
+        recent_from = self.now - timedelta(days=RECENT_DAYS)
+        ordered = set(Order.objects.filter(customer_id__in=customer_ids).values_list('customer_id', flat=True).distinct())
+
+        first_id = next_id(Order)
+        orders = Inserter(Order, [
+            'id', 'customer', 'order_date', 'status', 'shipping_fee', 'applied_coupon', 'coupon_discount_amount',
+            'order_value_discount_amount', 'first_time_discount_amount', 'subtotal_amount', 'grand_total_amount',
+        ])
+        deliveries = Inserter(Delivery, ['order', 'recipient_name', 'phone', 'address', 'created_at'])
+        items = Inserter(OrderItem, ['order', 'book', 'quantity', 'unit_price', 'subtotal'])
+        payments = Inserter(Payment, ['order', 'amount', 'method', 'status', 'transaction_id', 'date'])
+        usages = Inserter(CouponUsage, ['coupon', 'customer', 'order', 'used_at'])
+        cancellations = Inserter(OrderCancellation, ['order', 'reason', 'cancelled_at'])
+
+        for n in range(count):
+            order_id = first_id + n
+            customer_id = customer_ids[self._skewed(len(customer_ids), 2)]
+            placed = self._moment((n + rng.random()) / count)
+
+            cents = total_items = 0
+            for book_index in {self._skewed(len(book_ids), 2.5) for _ in range(1 + self._skewed(max_lines, 2))}:
+                quantity = 1 if rng.random() < 0.8 else rng.randint(2, 3)
+                price = book_prices[book_index]
+                items.add(order_id, book_ids[book_index], quantity, Decimal(price) / 100, Decimal(price * quantity) / 100)
+                cents += price * quantity
+                total_items += quantity
+            subtotal = Decimal(cents) / 100
+
+            coupon = None
+            coupon_discount = pricing.ZERO
+            if coupons and rng.random() < coupon_rate:
+                candidate = coupons[self._skewed(len(coupons), 2)]
+                if subtotal >= candidate.min_purchase and coupon_uses[candidate.pk] < candidate.max_usage:
+                    coupon = candidate
+                    coupon_uses[coupon.pk] += 1
+                    coupon_discount = coupon.calculate_discount(subtotal).quantize(CENT, ROUND_HALF_UP)
+                    usages.add(coupon.pk, customer_id, order_id, placed)
+            value_discount = pricing.order_value_discount(subtotal).quantize(CENT, ROUND_HALF_UP)
+            first_discount = pricing.first_time_discount(subtotal, customer_id not in ordered).quantize(CENT, ROUND_HALF_UP)
+            ordered.add(customer_id)
+            shipping = pricing.shipping_fee(subtotal, total_items)
+            total = subtotal - coupon_discount - value_discount - first_discount + shipping
+
+            if placed >= recent_from:
+                status = rng.choices(recent_statuses, cum_weights=recent_weights)[0]
+            else:
+                status = rng.choices(settled_statuses, cum_weights=settled_weights)[0]
+            orders.add(
+                order_id, customer_id, placed, status, shipping, coupon.pk if coupon else None,
+                coupon_discount, value_discount, first_discount, subtotal, total,
+            )
+
+            first, last = person_name(customer_id)
+            deliveries.add(order_id, f'{first} {last}', phone_number(customer_id), address(customer_id), placed)
+
+            method = 'Card' if rng.random() < 0.4 else 'Cash'
+            paid = method == 'Card' or status == 'Delivered'
+            if status == 'Cancelled':
+                payment_status = 'Refunded' if paid else 'Unpaid'
+                cancellations.add(order_id, rng.choice(CANCEL_REASONS), placed + timedelta(hours=rng.randint(1, 48)))
+            else:
+                payment_status = 'Paid' if paid else 'Unpaid'
+            transaction_id = f"{method.upper()}-{order_id}-{placed.strftime('%Y%m%d%H%M%S')}" if paid else None
+            payments.add(order_id, total, method, payment_status, transaction_id, placed)
+
+            if len(orders.rows) >= self.chunk_size:
+                flush(orders, deliveries, items, payments, usages, cancellations)
+        flush(orders, deliveries, items, payments, usages, cancellations)
+
+        Coupon.objects.bulk_update(
+            [Coupon(pk=pk, usage_count=uses) for pk, uses in coupon_uses.items()], ['usage_count'], batch_size=500,
+        )
+        Customer.objects.filter(
+            is_first_time_buyer=True, pk__in=Order.objects.filter(pk__gte=first_id).values('customer_id'),
+        ).update(is_first_time_buyer=False)
+
+        self._finish('orders', started, orders.written, [Order, Delivery, OrderItem, Payment, CouponUsage, OrderCancellation])
+        self.report('order items', items.written, time.perf_counter() - started)
+        return orders.written, items.written
+
+    def _book_ids(self):
+        return array('q', Book.objects.order_by('pk').values_list('pk', flat=True).iterator(chunk_size=self.chunk_size))
+
+    def _book_prices(self):
+        """Every book's id and price in cents, as compact arrays"""
+        ids, prices = array('q'), array('q')
+        for book_id, price in Book.objects.order_by('pk').values_list('pk', 'price').iterator(chunk_size=self.chunk_size):
+            ids.append(book_id)
+            prices.append(int(price * 100))
+        return ids, prices
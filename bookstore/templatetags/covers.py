@@ -0,0 +1,23 @@
+from django import template
+
+from bookstore import images
+
+register = template.Library()
+
+
+@register.filter
+def cover_url(book, size):
+    """{{ book|cover_url:"card" }} -> JPEG derivative URL"""
+    return images.cover_url(book, size, 'jpg')
+
+
+@register.filter
+def cover_srcset(book, fmt):
+    """{{ book|cover_srcset:"webp" }} -> every size in that format, or '' if not generated"""
+    return images.cover_srcset(book, fmt)
+
+
+@register.filter
+def cover_sizes(size):
+    """{{ size|cover_sizes }} -> sizes attribute for that slot"""
+    return images.cover_sizes(size)
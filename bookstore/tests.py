@@ -1,3 +1,902 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
 
-# Create your tests here.
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import (
+    book_cache, cancellation, cart_summary, carts, coupons, facets, idempotency, images, inventory, metrics, pagination,
+    reservations, search, typeahead,
+)
+from .checkout import place_order
+from .models import (
+    Book, BookSearchTerm, Cart, CartItem, Coupon, CouponUsage, Customer, Delivery, IdempotencyKey, Order, OrderItem,
+    StockReservation,
+)
+from .pagination import ORDER_PAGE_SIZE
+
+
+class ShopDataMixin:
+    DELIVERY = {'recipient_name': 'Recipient', 'phone': '0300', 'address': 'Lahore'}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.books = [
+            Book.objects.create(title=f'Book {n}', author='Author', category='Fiction', price=Decimal('300'), stock=100)
+            for n in range(5)
+        ]
+        cls.coupon = Coupon.objects.create(
+            code='SAVE10', discount_type='percentage', discount_value=Decimal('10'),
+            expiry_date=timezone.now() + timedelta(days=30),
+        )
+
+    def setUp(self):
+        # Cached cart badges would otherwise leak between tests that reuse cart ids
+        cache.clear()
+
+    def make_customer(self, username):
+        user = User.objects.create_user(username, password='secret-pass-123')
+        customer = Customer.objects.create(user=user, phone='0300', address='Lahore')
+        Cart.objects.create(customer=customer)
+        return user, customer
+
+    def fill_cart(self, customer, *quantities):
+        """One line per quantity, for self.books in order"""
+        return [
+            CartItem.objects.create(cart=customer.cart, book=book, quantity=quantity)
+            for book, quantity in zip(self.books, quantities)
+        ]
+
+    def shopper(self, username, *quantities, coupon=None):
+        """A customer with these cart lines (and coupon), and their fresh cart"""
+        user, customer = self.make_customer(username)
+        self.fill_cart(customer, *quantities)
+        Cart.objects.filter(customer=customer).update(applied_coupon=coupon)
+        return customer, Cart.objects.get(customer=customer)
+
+    def cart_lines(self, customer):
+        return dict(CartItem.objects.filter(cart=customer.cart).values_list('book_id', 'quantity'))
+
+    def stock(self, book):
+        return Book.objects.values_list('stock', flat=True).get(pk=book.pk)
+
+    def set_stock(self, book, stock):
+        Book.objects.filter(pk=book.pk).update(stock=stock)
+
+    def place_orders(self, customer, count, lines):
+        for n in range(count):
+            order = Order.objects.create(customer=customer, applied_coupon=self.coupon if n % 2 else None)
+            Delivery.objects.create(order=order, recipient_name='Recipient', phone='0300', address='Lahore')
+            OrderItem.objects.bulk_create(
+                OrderItem(order=order, book=book, quantity=2, unit_price=book.price, subtotal=book.price * 2)
+                for book in self.books[:lines]
+            )
+
+
+class OrderHistoryQueryTests(ShopDataMixin, TestCase):
+    def count_queries(self, user):
+        self.client.force_login(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('order_history'))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_orders_or_items(self):
+        small_user, small_customer = self.make_customer('one-order')
+        self.place_orders(small_customer, count=1, lines=1)
+
+        large_user, large_customer = self.make_customer('many-orders')
+        self.place_orders(large_customer, count=ORDER_PAGE_SIZE + 5, lines=5)
+
+        self.assertEqual(self.count_queries(small_user), self.count_queries(large_user))
+
+    def test_pages_follow_the_cursor(self):
+        user, customer = self.make_customer('pager')
+        self.place_orders(customer, count=ORDER_PAGE_SIZE + 3, lines=1)
+        self.client.force_login(user)
+
+        first = self.client.get(reverse('order_history'))
+        self.assertEqual(len(first.context['orders']), ORDER_PAGE_SIZE)
+        second = self.client.get(reverse('order_history') + '?' + first.context['next_page_query'])
+        self.assertEqual(len(second.context['orders']), 3)
+        self.assertEqual(second.context['next_page_query'], '')
+
+        seen = [order.id for order in first.context['orders']] + [order.id for order in second.context['orders']]
+        self.assertEqual(seen, sorted(seen, reverse=True))
+
+
+@override_settings(QUERY_BUDGET_STRICT=True)
+class QueryBudgetTests(ShopDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.registry.clear()
+
+    def test_customer_pages_stay_within_budget(self):
+        user, customer = self.make_customer('budgeted')
+        self.place_orders(customer, count=ORDER_PAGE_SIZE + 5, lines=5)
+        CartItem.objects.bulk_create(CartItem(cart=customer.cart, book=book, quantity=1) for book in self.books)
+        self.client.force_login(user)
+
+        for name in ('home', 'book_list', 'view_cart', 'order_history', 'card_payment_form'):
+            self.assertEqual(self.client.get(reverse(name)).status_code, 200)
+        self.assertEqual(self.client.get(reverse('book_detail', args=[self.books[0].id])).status_code, 200)
+
+    def test_admin_changelists_stay_within_budget(self):
+        user, customer = self.make_customer('admin-budgeted')
+        self.place_orders(customer, count=30, lines=3)
+        # place_orders() writes legacy rows; the changelist relies on stored totals
+        call_command('backfill_order_totals', stdout=StringIO())
+        self.fill_cart(customer, 1, 2, 3)
+        self.client.force_login(User.objects.create_superuser('budget-admin', password='secret-pass-123'))
+
+        for model in ('order', 'book', 'coupon', 'cart'):
+            with self.subTest(model=model):
+                response = self.client.get(reverse(f'admin:bookstore_{model}_changelist'))
+                self.assertEqual(response.status_code, 200)
+
+    def test_exceeding_a_budget_fails(self):
+        user, customer = self.make_customer('over-budget')
+        self.client.force_login(user)
+        with override_settings(QUERY_BUDGETS={'order_history': 1}):
+            with self.assertRaises(metrics.QueryBudgetExceeded):
+                self.client.get(reverse('order_history'))
+
+    def test_metrics_endpoint_reports_each_view(self):
+        user, customer = self.make_customer('scraped')
+        self.client.force_login(user)
+        self.client.get(reverse('order_history'))
+
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('shelfly_view_requests_total{view="order_history"} 1', body)
+        self.assertIn('shelfly_view_queries{view="order_history",quantile="0.99"}', body)
+        self.assertNotIn('view="metrics"', body)
+
+
+class PageCacheTests(ShopDataMixin, TestCase):
+    def test_repeat_visits_skip_the_view(self):
+        url = reverse('book_detail', args=[self.books[0].id])
+        first = self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(url)
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+    def test_book_changes_retire_cached_pages(self):
+        url = reverse('book_list')
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.books[0].title = 'Renamed'
+            self.books[0].save()
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertContains(response, 'Renamed')
+
+    def test_a_new_release_retires_every_cached_page(self):
+        urls = (reverse('home'), reverse('book_list'), reverse('book_detail', args=[self.books[0].id]))
+        with self.settings(SHELFLY_RELEASE='a1'):
+            etags = {url: self.client.get(url)['ETag'] for url in urls}
+            for url in urls:
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etags[url]).status_code, 304)
+        with self.settings(SHELFLY_RELEASE='b2'):
+            for url in urls:
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etags[url])
+
+    def test_stock_moves_retire_only_the_pages_that_show_them(self):
+        home, listing, detail = (
+            reverse('home'), reverse('book_list'), reverse('book_detail', args=[self.books[0].id]),
+        )
+        etags = {url: self.client.get(url)['ETag'] for url in (home, listing, detail)}
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.decrement_stock({self.books[0].pk: 10})
+
+        self.assertEqual(self.client.get(home, HTTP_IF_NONE_MATCH=etags[home]).status_code, 304)
+        self.assertEqual(self.client.get(listing, HTTP_IF_NONE_MATCH=etags[listing]).status_code, 304)
+        self.assertContains(self.client.get(detail, HTTP_IF_NONE_MATCH=etags[detail]), '90 in stock')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.decrement_stock({self.books[0].pk: 86})
+        self.assertContains(self.client.get(listing, HTTP_IF_NONE_MATCH=etags[listing]), 'Only 4 left')
+
+    def test_signed_in_users_share_the_page_and_load_their_navbar(self):
+        anonymous = self.client.get(reverse('home'))
+        user, customer = self.make_customer('navbar-shopper')
+        self.client.force_login(user)
+        CartItem.objects.create(cart=customer.cart, book=self.books[0], quantity=3)
+
+        response = self.client.get(reverse('home'))
+        self.assertEqual(response.content, anonymous.content)
+        self.assertNotContains(response, 'navbar-shopper')
+        self.assertEqual(self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=anonymous['ETag']).status_code, 304)
+
+        fragment = self.client.get(reverse('navbar_fragment'))
+        self.assertContains(fragment, 'navbar-shopper')
+        self.assertContains(fragment, '<span class="cart-badge">3</span>', html=True)
+        self.assertIn('no-cache', fragment['Cache-Control'])
+
+    def test_flash_messages_arrive_with_the_navbar(self):
+        self.client.get(reverse('logout'))
+        self.assertNotContains(self.client.get(reverse('home')), 'logged out')
+        self.assertContains(self.client.get(reverse('navbar_fragment')), 'logged out')
+        self.assertNotContains(self.client.get(reverse('navbar_fragment')), 'logged out')
+
+
+class SearchIndexTests(ShopDataMixin, TestCase):
+    def test_renaming_a_book_reindexes_it(self):
+        book = self.books[0]
+        book.title = 'Zanzibar Nights'
+        book.save()
+        self.assertEqual([found.pk for found in search.search_books('zanzibar')], [book.pk])
+
+    def test_stock_only_saves_keep_the_postings(self):
+        book = self.books[0]
+        posting_ids = set(BookSearchTerm.objects.filter(book=book).values_list('pk', flat=True))
+        book.stock = 3
+        book.save(update_fields=['stock'])
+        self.assertEqual(set(BookSearchTerm.objects.filter(book=book).values_list('pk', flat=True)), posting_ids)
+
+
+class TypeaheadTests(ShopDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(setattr, typeahead, '_index', typeahead._index)
+        typeahead._index = typeahead.build_index()
+
+    def test_edits_reach_the_index_when_they_commit(self):
+        book = self.books[0]
+        book.title = 'Qayamat Express'
+        with self.captureOnCommitCallbacks() as callbacks:
+            book.save()
+        self.assertEqual(typeahead.suggest('qayamat'), [])
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual([suggestion['id'] for suggestion in typeahead.suggest('qiyamat')], [book.pk])
+
+
+class FacetCountTests(ShopDataMixin, TestCase):
+    def test_stock_moves_keep_the_counts_until_a_book_crosses_zero(self):
+        self.assertEqual(facets.facet_counts()['in_stock'], 5)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(inventory.decrement_stock({self.books[0].pk: 99}))
+        with self.assertNumQueries(0):
+            self.assertEqual(facets.facet_counts()['in_stock'], 5)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(inventory.decrement_stock({self.books[0].pk: 1}))
+        with self.assertNumQueries(1):
+            self.assertEqual(facets.facet_counts()['in_stock'], 4)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.increment_stock({self.books[0].pk: 2})
+        self.assertEqual(facets.facet_counts()['in_stock'], 5)
+
+
+class CartMutationTests(ShopDataMixin, TestCase):
+    def test_set_quantities_caps_at_stock_and_removes_zeroes(self):
+        user, customer = self.make_customer('batch-cart')
+        first, second, third = self.fill_cart(customer, 1, 1, 1)
+        self.set_stock(self.books[1], 3)
+
+        updated, removed = carts.set_quantities(customer.cart.pk, {first.pk: 4, second.pk: 7, third.pk: 0})
+        self.assertEqual((updated, removed), (2, 1))
+        self.assertEqual(self.cart_lines(customer), {self.books[0].pk: 4, self.books[1].pk: 3})
+
+    def test_sold_out_lines_stay_at_one(self):
+        user, customer = self.make_customer('sold-out-cart')
+        line, = self.fill_cart(customer, 2)
+        self.set_stock(self.books[0], 0)
+
+        carts.set_quantities(customer.cart.pk, {line.pk: 5})
+        self.assertEqual(self.cart_lines(customer), {self.books[0].pk: 1})
+
+    def test_increments_stop_at_stock(self):
+        user, customer = self.make_customer('bounded-cart')
+        self.set_stock(self.books[0], 2)
+        book = Book.objects.get(pk=self.books[0].pk)
+
+        self.assertEqual(carts.add_book(customer.cart.pk, book), carts.ADDED)
+        self.assertEqual(carts.add_book(customer.cart.pk, book), carts.INCREASED)
+        self.assertEqual(carts.add_book(customer.cart.pk, book), carts.MAX_STOCK)
+        self.set_stock(self.books[1], 0)
+        self.assertEqual(carts.add_book(customer.cart.pk, Book.objects.get(pk=self.books[1].pk)), carts.OUT_OF_STOCK)
+        self.assertEqual(self.cart_lines(customer), {self.books[0].pk: 2})
+
+    def test_the_carts_own_holds_count_as_available(self):
+        user, customer = self.make_customer('holding-cart')
+        line, = self.fill_cart(customer, 3)
+        self.set_stock(self.books[0], 5)
+        reservations.hold_cart(Cart.objects.get(pk=customer.cart.pk))
+        self.assertEqual(self.stock(self.books[0]), 2)
+
+        carts.set_quantities(customer.cart.pk, {line.pk: 5})
+        self.assertEqual(self.cart_lines(customer), {self.books[0].pk: 5})
+        self.assertEqual(carts.increase_item(customer.cart.pk, line.pk), carts.MAX_STOCK)
+
+
+class CheckoutServiceTests(ShopDataMixin, TestCase):
+    def count_queries(self, username, *quantities):
+        customer, cart = self.shopper(username, *quantities, coupon=self.coupon)
+        cart.pricing
+        with CaptureQueriesContext(connection) as queries:
+            place_order(cart, self.DELIVERY, 'Cash')
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_the_cart(self):
+        Coupon.objects.filter(pk=self.coupon.pk).update(max_usage=10)
+        self.coupon.refresh_from_db()
+        self.assertEqual(self.count_queries('one-line', 1), self.count_queries('five-lines', 1, 2, 3, 4, 5))
+
+    def test_order_takes_stock_and_redeems_the_coupon(self):
+        customer, cart = self.shopper('buyer', 2, 3, coupon=self.coupon)
+        order = place_order(cart, self.DELIVERY, 'Cash')
+
+        self.assertEqual([self.stock(book) for book in self.books[:2]], [98, 97])
+        self.assertEqual(order.orderitem_set.count(), 2)
+        self.assertEqual(order.payment.status, 'Unpaid')
+        self.assertTrue(CouponUsage.objects.filter(coupon=self.coupon, order=order).exists())
+        self.coupon.refresh_from_db()
+        self.assertEqual(self.coupon.usage_count, 1)
+        self.assertEqual(self.cart_lines(customer), {})
+
+    def test_a_short_line_rolls_the_whole_order_back(self):
+        customer, cart = self.shopper('too-many', 2, 3, coupon=self.coupon)
+        self.set_stock(self.books[0], 3)
+        self.set_stock(self.books[1], 2)
+
+        with self.assertRaises(inventory.InsufficientStock) as raised:
+            place_order(cart, self.DELIVERY, 'Cash')
+        self.assertEqual(raised.exception.titles, [self.books[1].title])
+        self.assertEqual([self.stock(book) for book in self.books[:2]], [3, 2])
+        self.assertFalse(Order.objects.filter(customer=customer).exists())
+        self.coupon.refresh_from_db()
+        self.assertEqual(self.coupon.usage_count, 0)
+        self.assertEqual(len(self.cart_lines(customer)), 2)
+
+    def test_a_spent_coupon_is_dropped_and_the_order_goes_through(self):
+        Coupon.objects.filter(pk=self.coupon.pk).update(usage_count=self.coupon.max_usage)
+        customer, cart = self.shopper('spent-coupon', 2, coupon=Coupon.objects.get(pk=self.coupon.pk))
+        self.assertEqual(cart.pricing.coupon_discount, 0)
+
+        order = place_order(cart, self.DELIVERY, 'Cash')
+        self.assertIsNone(order.applied_coupon)
+        self.assertEqual(order.coupon_discount_amount, 0)
+        self.assertFalse(CouponUsage.objects.filter(order=order).exists())
+        self.assertEqual(Coupon.objects.get(pk=self.coupon.pk).usage_count, self.coupon.max_usage)
+        self.assertIsNone(Cart.objects.get(pk=cart.pk).applied_coupon)
+
+    def test_a_coupon_spent_during_checkout_rolls_the_stock_back(self):
+        customer, cart = self.shopper('late-coupon', 2, coupon=self.coupon)
+        self.assertGreater(cart.pricing.coupon_discount, 0)
+        Coupon.objects.filter(pk=self.coupon.pk).update(usage_count=self.coupon.max_usage)
+
+        with self.assertRaises(coupons.CouponLimitReached):
+            place_order(cart, self.DELIVERY, 'Cash')
+        self.assertEqual(self.stock(self.books[0]), 100)
+        self.assertFalse(Order.objects.filter(customer=customer).exists())
+
+    def test_held_stock_is_not_taken_twice(self):
+        customer, cart = self.shopper('held-buyer', 4)
+        reservations.hold_cart(cart)
+        self.assertEqual(self.stock(self.books[0]), 96)
+
+        place_order(Cart.objects.get(pk=cart.pk), self.DELIVERY, 'Card', paid=True)
+        self.assertEqual(self.stock(self.books[0]), 96)
+        self.assertFalse(StockReservation.objects.filter(cart=cart).exists())
+
+
+class ReservationTests(ShopDataMixin, TestCase):
+    def holding(self, username, *quantities):
+        user, customer = self.make_customer(username)
+        lines = self.fill_cart(customer, *quantities)
+        reservations.hold_cart(Cart.objects.get(pk=customer.cart.pk))
+        return user, customer, lines
+
+    def held(self, customer):
+        return dict(StockReservation.objects.filter(cart=customer.cart).values_list('book_id', 'quantity'))
+
+    def test_holds_follow_the_cart(self):
+        user, customer, (first, second) = self.holding('follower', 3, 2)
+        self.assertEqual([self.stock(book) for book in self.books[:2]], [97, 98])
+
+        reservations.hold_cart(Cart.objects.get(pk=customer.cart.pk))
+        self.assertEqual([self.stock(book) for book in self.books[:2]], [97, 98])
+
+        carts.set_quantities(customer.cart.pk, {first.pk: 1})
+        self.client.force_login(user)
+        self.client.get(reverse('remove_from_cart', args=[second.pk]))
+        self.assertEqual(self.held(customer), {self.books[0].pk: 1})
+        self.assertEqual([self.stock(book) for book in self.books[:2]], [99, 100])
+
+    def test_a_short_book_leaves_the_holds_alone(self):
+        user, customer, (line,) = self.holding('short', 2)
+        CartItem.objects.filter(pk=line.pk).update(quantity=3)
+        CartItem.objects.create(cart=customer.cart, book=self.books[1], quantity=5)
+        self.set_stock(self.books[0], 1)
+        self.set_stock(self.books[1], 4)
+
+        with self.assertRaises(inventory.InsufficientStock) as raised:
+            reservations.hold_cart(Cart.objects.get(pk=customer.cart.pk))
+        self.assertEqual(raised.exception.titles, [self.books[1].title])
+        self.assertEqual(self.held(customer), {self.books[0].pk: 2})
+        self.assertEqual([self.stock(book) for book in self.books[:2]], [1, 4])
+
+    def test_expired_holds_go_back_to_stock(self):
+        user, customer, lines = self.holding('abandoned', 3)
+        StockReservation.objects.filter(cart=customer.cart).update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.holding('still-shopping', 2)
+
+        self.assertEqual(reservations.release_expired(), 1)
+        self.assertEqual(self.held(customer), {})
+        self.assertEqual(self.stock(self.books[0]), 98)
+        self.assertEqual(reservations.release_expired(), 0)
+
+    def test_deleting_a_customer_releases_their_holds(self):
+        user, customer, lines = self.holding('leaving', 4)
+        user.delete()
+        self.assertEqual(self.stock(self.books[0]), 100)
+        self.assertFalse(StockReservation.objects.exists())
+
+
+class IdempotencyTests(ShopDataMixin, TestCase):
+    def checkout(self, key):
+        return self.client.post(reverse('checkout'), {
+            'payment_method': 'Cash', 'delivery_name': 'Recipient', 'delivery_phone': '0300',
+            'delivery_address': 'Lahore', idempotency.IDEMPOTENCY_KEY_FIELD: key,
+        })
+
+    def setUp(self):
+        super().setUp()
+        self.user, self.customer = self.make_customer('retrier')
+        self.fill_cart(self.customer, 2)
+        self.client.force_login(self.user)
+
+    def test_a_retried_submission_replays_the_first_answer(self):
+        first = self.checkout('key-1')
+        second = self.checkout('key-1')
+
+        self.assertEqual(Order.objects.filter(customer=self.customer).count(), 1)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual((second.status_code, second['Location']), (first.status_code, first['Location']))
+        self.assertEqual(self.stock(self.books[0]), 98)
+
+    def test_a_retry_during_the_first_request_waits_for_it(self):
+        record, owned = idempotency.claim(self.customer, 'key-2', 'checkout')
+        self.assertTrue(owned)
+        self.assertFalse(idempotency.claim(self.customer, 'key-2', 'checkout')[1])
+
+        response = self.checkout('key-2')
+        self.assertRedirects(response, reverse('order_history'), fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+
+    @override_settings(IDEMPOTENCY_CLAIM_TIMEOUT=60)
+    def test_only_abandoned_claims_are_taken_over(self):
+        record, owned = idempotency.claim(self.customer, 'key-3', 'checkout')
+        IdempotencyKey.objects.filter(pk=record.pk).update(created_at=timezone.now() - timedelta(seconds=30))
+        self.assertFalse(idempotency.claim(self.customer, 'key-3', 'checkout')[1])
+
+        IdempotencyKey.objects.filter(pk=record.pk).update(created_at=timezone.now() - timedelta(seconds=120))
+        Order.objects.create(customer=self.customer)
+        self.assertFalse(idempotency.claim(self.customer, 'key-3', 'checkout')[1])
+
+        Order.objects.all().delete()
+        self.assertTrue(idempotency.claim(self.customer, 'key-3', 'checkout')[1])
+        self.assertFalse(idempotency.claim(self.customer, 'key-3', 'checkout')[1])
+
+
+class CancellationTests(ShopDataMixin, TestCase):
+    def test_cancelling_restocks_and_gives_the_coupon_back(self):
+        customer, cart = self.shopper('canceller', 2, 3, coupon=self.coupon)
+        order = place_order(cart, self.DELIVERY, 'Cash')
+        other = place_order(self.shopper('keeper', 1)[1], self.DELIVERY, 'Cash')
+
+        self.assertEqual(cancellation.cancel_orders([order.pk], reason='Changed my mind'), [order.pk])
+        self.assertEqual([self.stock(book) for book in self.books[:2]], [99, 100])
+        self.coupon.refresh_from_db()
+        self.assertEqual(self.coupon.usage_count, 0)
+        self.assertFalse(CouponUsage.objects.filter(order=order).exists())
+        self.assertEqual(order.cancellation.reason, 'Changed my mind')
+        self.assertNotEqual(Order.objects.get(pk=other.pk).status, 'Cancelled')
+
+    def test_cancelling_twice_restocks_once(self):
+        customer, cart = self.shopper('double-cancel', 4)
+        order = place_order(cart, self.DELIVERY, 'Cash')
+
+        self.assertEqual(cancellation.cancel_orders([order.pk]), [order.pk])
+        self.assertEqual(cancellation.cancel_orders([order.pk], statuses=None), [])
+        self.assertEqual(self.stock(self.books[0]), 100)
+
+    def test_shipped_orders_are_left_to_the_admin(self):
+        customer, cart = self.shopper('shipped', 1)
+        order = place_order(cart, self.DELIVERY, 'Cash')
+        Order.objects.filter(pk=order.pk).update(status='Shipped')
+
+        self.assertEqual(cancellation.cancel_orders([order.pk]), [])
+        self.assertEqual(cancellation.cancel_orders([order.pk], statuses=None), [order.pk])
+        self.assertEqual(self.stock(self.books[0]), 100)
+
+
+class CouponCounterTests(ShopDataMixin, TestCase):
+    def test_redeem_stops_at_the_usage_limit(self):
+        coupon = Coupon.objects.create(
+            code='TWICE', discount_type='fixed', discount_value=Decimal('50'), max_usage=2,
+            expiry_date=timezone.now() + timedelta(days=1),
+        )
+        coupons.redeem(coupon)
+        coupons.redeem(Coupon.objects.get(pk=coupon.pk))
+
+        with self.assertRaises(coupons.CouponLimitReached):
+            coupons.redeem(Coupon.objects.get(pk=coupon.pk))
+        coupon.refresh_from_db()
+        self.assertEqual(coupon.usage_count, 2)
+        self.assertFalse(coupon.is_valid()[0])
+
+    def test_release_never_goes_below_zero(self):
+        coupons.redeem(self.coupon)
+        self.assertEqual(coupons.release({self.coupon.pk: 3}), 1)
+        self.coupon.refresh_from_db()
+        self.assertEqual(self.coupon.usage_count, 0)
+
+
+class CouponGenerationTests(ShopDataMixin, TestCase):
+    def template(self):
+        return coupons.coupon_template('percentage', Decimal('15'), timezone.now() + timedelta(days=7))
+
+    def test_generated_codes_are_unique_and_typeable(self):
+        tag, created, elapsed = coupons.generate_codes(500, self.template(), 'spring', chunk_size=128)
+        codes = list(Coupon.objects.filter(code__startswith='SPRING' + tag).values_list('code', flat=True))
+
+        self.assertEqual(created, 500)
+        self.assertEqual(len(set(codes)), 500)
+        for code in codes:
+            self.assertEqual(len(code), len('SPRING') + coupons.BATCH_TAG_LENGTH + coupons.MIN_SEQUENCE_LENGTH)
+            self.assertTrue(set(code[len('SPRING'):]) <= set(coupons.CODE_ALPHABET), code)
+
+        second_tag = coupons.generate_codes(10, self.template(), 'spring')[0]
+        self.assertNotEqual(second_tag, tag)
+        self.assertEqual(Coupon.objects.filter(code__startswith='SPRING').count(), 510)
+
+    def test_codes_must_fit_the_code_column(self):
+        with self.assertRaises(ValueError):
+            coupons.generate_codes(10, self.template(), 'X' * 41)
+        with self.assertRaises(CommandError):
+            call_command('generate_coupons', '10', '--value', '5', '--prefix', 'X' * 41, stdout=StringIO())
+        self.assertFalse(Coupon.objects.filter(code__startswith='XXX').exists())
+
+        coupons.check_code_length('X' * 40, 10)
+
+    def test_imports_skip_codes_that_already_exist(self):
+        sent, elapsed = coupons.import_codes(['partner-1', 'PARTNER-2', 'partner-1', '', 'save10'], self.template())
+
+        self.assertEqual(sent, 4)
+        self.assertEqual(
+            set(Coupon.objects.filter(code__startswith='PARTNER').values_list('code', flat=True)),
+            {'PARTNER-1', 'PARTNER-2'},
+        )
+        # The existing coupon keeps its own terms
+        self.assertEqual(Coupon.objects.get(code='SAVE10').discount_value, Decimal('10'))
+
+
+class OrderTotalsTests(ShopDataMixin, TestCase):
+    def expected_subtotal(self, order):
+        return sum(item.subtotal for item in order.orderitem_set.all())
+
+    def test_placed_orders_store_the_cart_pricing(self):
+        customer, cart = self.shopper('priced', 2, 1, coupon=self.coupon)
+        pricing = cart.pricing
+        order = Order.objects.get(pk=place_order(cart, self.DELIVERY, 'Cash').pk)
+
+        self.assertEqual(order.subtotal_amount, pricing.subtotal)
+        self.assertEqual(order.grand_total_amount, pricing.total_amount)
+        self.assertEqual(order.total_discount, pricing.total_discount)
+        self.assertEqual(order.payment.amount, pricing.total_amount)
+
+    def test_backfill_fills_legacy_totals(self):
+        user, customer = self.make_customer('legacy')
+        self.place_orders(customer, count=3, lines=2)
+        legacy = list(Order.objects.filter(customer=customer).order_by('id'))
+        Order.objects.filter(pk=legacy[0].pk).update(subtotal_amount=None, grand_total_amount=None)
+        Order.objects.filter(pk=legacy[1].pk).update(subtotal_amount=0, grand_total_amount=0)
+        Order.objects.filter(pk=legacy[2].pk).update(subtotal_amount=Decimal('1.00'), grand_total_amount=Decimal('1.00'))
+
+        call_command('backfill_order_totals', stdout=StringIO())
+        orders = list(Order.objects.filter(customer=customer).order_by('id'))
+        for order in orders[:2]:
+            self.assertEqual(order.subtotal_amount, Decimal('1200.00'))
+            self.assertEqual(order.grand_total_amount, order._total_from_subtotal())
+        self.assertEqual(orders[2].subtotal_amount, Decimal('1.00'))
+
+        call_command('backfill_order_totals', '--all', stdout=StringIO())
+        self.assertEqual(Order.objects.get(pk=orders[2].pk).subtotal_amount, Decimal('1200.00'))
+
+    def test_admin_action_recomputes_totals(self):
+        user, customer = self.make_customer('edited')
+        self.place_orders(customer, count=2, lines=1)
+        Order.objects.filter(customer=customer).update(subtotal_amount=Decimal('5.00'), grand_total_amount=Decimal('5.00'))
+        self.client.force_login(User.objects.create_superuser('totals-admin', password='secret-pass-123'))
+
+        response = self.client.post(reverse('admin:bookstore_order_changelist'), {
+            'action': 'refresh_totals',
+            admin.helpers.ACTION_CHECKBOX_NAME: list(Order.objects.filter(customer=customer).values_list('pk', flat=True)),
+        })
+        self.assertEqual(response.status_code, 302)
+        for order in Order.objects.filter(customer=customer):
+            self.assertEqual(order.subtotal_amount, self.expected_subtotal(order))
+            self.assertEqual(order.grand_total_amount, order._total_from_subtotal())
+
+
+class BookCacheTests(ShopDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        book_cache.clear_local()
+        self.addCleanup(book_cache.clear_local)
+
+    def test_repeat_lookups_skip_the_database(self):
+        book_cache.get_book(self.books[0].pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(book_cache.get_book(self.books[0].pk).title, 'Book 0')
+
+    def test_saves_bump_the_version_for_every_process(self):
+        book = self.books[0]
+        book_cache.get_book(book.pk)
+        stale = book_cache.get_cache().shared.version(book.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            book.title = 'Retitled'
+            book.save()
+        self.assertNotEqual(book_cache.get_cache().shared.version(book.pk), stale)
+        self.assertEqual(book_cache.get_book(book.pk).title, 'Retitled')
+        with book_cache.shared_only():
+            self.assertEqual(book_cache.get_book(book.pk).title, 'Retitled')
+
+    def test_a_copy_read_before_a_change_is_not_served_after_it(self):
+        book = self.books[0]
+        shared = book_cache.get_cache().shared
+        stale_version = shared.version(book.pk)
+        stale_values = book_cache._values(Book.objects.get(pk=book.pk))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.filter(pk=book.pk).update(title='Edited elsewhere')
+            book_cache.invalidate([book.pk])
+        # A slow reader finishing now can only store under the retired version
+        shared.set(book.pk, stale_version, stale_values)
+        with book_cache.shared_only():
+            self.assertEqual(book_cache.get_book(book.pk).title, 'Edited elsewhere')
+
+    def test_stock_moves_refresh_the_cached_book_and_its_page(self):
+        book = self.books[0]
+        book_cache.get_book(book.pk)
+        self.client.get(reverse('book_detail', args=[book.pk]))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.decrement_stock({book.pk: 7})
+        self.assertEqual(book_cache.get_book(book.pk).stock, 93)
+        self.assertContains(self.client.get(reverse('book_detail', args=[book.pk])), '93 in stock')
+
+    def test_deleted_books_are_not_served(self):
+        book_id = self.books[4].pk
+        book_cache.get_book(book_id)
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.get(pk=book_id).delete()
+        with self.assertRaises(Book.DoesNotExist):
+            book_cache.get_book(book_id)
+
+
+class CartPricingTests(ShopDataMixin, TestCase):
+    def test_one_query_prices_the_whole_cart(self):
+        customer, cart = self.shopper('snapshot', 1, 2, 3, 1, 2, coupon=self.coupon)
+        cart = Cart.objects.select_related('applied_coupon', 'customer').get(pk=cart.pk)
+
+        with self.assertNumQueries(1):
+            figures = (cart.subtotal, cart.shipping_fee, cart.total_discount, cart.total_amount, len(cart.pricing.items))
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                figures, (cart.subtotal, cart.shipping_fee, cart.total_discount, cart.total_amount, len(cart.pricing.items)),
+            )
+        self.assertEqual(cart.pricing.subtotal, Decimal('2700'))
+        self.assertGreater(cart.pricing.coupon_discount, 0)
+
+    def test_the_cart_checkout_and_summary_agree(self):
+        user, customer = self.make_customer('agreeing')
+        self.fill_cart(customer, 2, 1)
+        Cart.objects.filter(pk=customer.cart.pk).update(applied_coupon=self.coupon)
+        self.client.force_login(user)
+
+        expected = Cart.objects.get(pk=customer.cart.pk).pricing
+        figures = ('subtotal', 'total_items', 'total_discount', 'shipping_fee', 'total_amount')
+        for name in ('view_cart', 'checkout', 'card_payment_form'):
+            pricing = self.client.get(reverse(name)).context['cart'].pricing
+            self.assertEqual([getattr(pricing, figure) for figure in figures], [getattr(expected, figure) for figure in figures], name)
+
+        totals = self.client.post(reverse('update_cart_batch_json'), '{"items": {}}', content_type='application/json')
+        self.assertEqual(totals.json()['cart']['total_amount'], f'{expected.total_amount:.2f}')
+        badge = self.client.get(reverse('navbar_fragment'))
+        self.assertContains(badge, f'<span class="cart-badge">{expected.total_items}</span>', html=True)
+
+
+class CatalogPaginationTests(ShopDataMixin, TestCase):
+    def walk(self, fetch):
+        """Follow next_cursor from the first page, returning every item's id"""
+        seen, cursor = [], None
+        while True:
+            page = fetch(cursor)
+            seen += [book.id for book in page.items]
+            if not page.has_next:
+                return seen
+            cursor = page.next_cursor
+
+    def test_browsing_visits_every_book_once(self):
+        seen = self.walk(lambda cursor: pagination.book_page(cursor, page_size=2))
+        self.assertEqual(seen, sorted(book.pk for book in self.books))
+
+    def test_search_pages_split_ties_on_the_score_by_id(self):
+        # Identical titles score the same, so only the id orders them
+        twins = [
+            Book.objects.create(title='Mirror Lake', author='Twin', category='Fiction', price=Decimal('100'), stock=1)
+            for n in range(5)
+        ]
+        seen = self.walk(lambda cursor: pagination.search_page('mirror', cursor, page_size=2))
+        self.assertEqual(seen, [book.pk for book in twins])
+
+    def test_the_next_page_link_round_trips(self):
+        Book.objects.bulk_create(
+            Book(title=f'Extra {n}', author='Author', category='Fiction', price=Decimal('100'), stock=1)
+            for n in range(pagination.CATALOG_PAGE_SIZE * 2)
+        )
+        seen, url = [], reverse('book_list_page')
+        while url:
+            response = self.client.get(url)
+            seen += [book.pk for book in response.context['books']]
+            url = response.get('X-Next-Page')
+        self.assertEqual(seen, list(Book.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_tampered_cursors_fall_back_to_the_first_page(self):
+        for cursor in ('abc', '-1', '99999999999999999999999999', '1.2.3', '.', '9' * 30 + '.1'):
+            for params in ({'after': cursor}, {'after': cursor, 'search': 'book'}):
+                with self.subTest(params=params):
+                    response = self.client.get(reverse('book_list_page'), params)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(len(response.context['books']), 5)
+
+
+class CoverDerivativeTests(ShopDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def upload(self, book, name, size):
+        image = BytesIO()
+        Image.new('RGB', size, 'navy').save(image, 'PNG')
+        with self.captureOnCommitCallbacks(execute=True):
+            book.cover_image = SimpleUploadedFile(name, image.getvalue(), content_type='image/png')
+            book.save()
+        return book.cover_image
+
+    def test_uploads_get_every_size_in_every_format(self):
+        cover = self.upload(self.books[0], 'tall.png', (400, 1200))
+        storage = cover.storage
+
+        for size, (max_width, max_height) in images.COVER_SIZES.items():
+            for fmt in images.available_formats():
+                with storage.open(images.derivative_name(cover.name, size, fmt)) as derivative:
+                    width, height = Image.open(derivative).size
+                self.assertLessEqual(width, max_width)
+                self.assertLessEqual(height, max_height)
+        self.assertEqual(images.derivatives(cover)['jpg'], {'thumb': 50, 'card': 150, 'detail': 300})
+        self.assertTrue(images.cover_url(self.books[0], 'card').endswith('-card.jpg'))
+
+    def test_a_new_cover_replaces_the_old_derivatives(self):
+        book = self.books[0]
+        old = self.upload(book, 'first.png', (300, 450)).name
+        new = self.upload(book, 'second.png', (300, 450)).name
+        storage = book.cover_image.storage
+
+        self.assertFalse(storage.exists(images.derivative_name(old, 'card', 'jpg')))
+        self.assertTrue(storage.exists(images.derivative_name(new, 'card', 'jpg')))
+        srcset = images.cover_srcset(book, 'jpg')
+        self.assertIn(images.derivative_name(new, 'card', 'jpg').rsplit('/', 1)[1] + ' 300w', srcset)
+        self.assertNotIn('first', srcset)
+
+    def test_a_missing_original_falls_back_without_failing(self):
+        book = self.books[1]
+        Book.objects.filter(pk=book.pk).update(cover_image='book_covers/gone.png')
+        book = Book.objects.get(pk=book.pk)
+
+        self.assertEqual(images.cover_url(book, 'card'), book.cover_image.url)
+        self.assertEqual(images.cover_srcset(book, 'jpg'), '')
+        stderr = StringIO()
+        call_command('generate_cover_derivatives', str(book.pk), stdout=StringIO(), stderr=stderr)
+        self.assertIn('gone.png', stderr.getvalue())
+
+
+class CartBadgeTests(ShopDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user, self.customer = self.make_customer('badge')
+        self.client.force_login(self.user)
+
+    def badge(self):
+        return self.client.get(reverse('navbar_fragment')).context['cart_summary']['item_count']
+
+    def test_every_cart_change_refreshes_the_count(self):
+        self.assertEqual(self.badge(), 0)
+        # The count is now cached, so a missed invalidation would show a stale badge below
+        self.assertEqual(cache.get(cart_summary.summary_key(self.customer.cart.pk)), {'item_count': 0})
+        self.client.get(reverse('add_to_cart', args=[self.books[0].pk]))
+        self.client.get(reverse('add_to_cart', args=[self.books[0].pk]))
+        self.assertEqual(self.badge(), 2)
+
+        line = CartItem.objects.get(cart=self.customer.cart)
+        self.client.post(reverse('update_cart_item', args=[line.pk]), {'action': 'decrease'})
+        self.assertEqual(self.badge(), 1)
+
+        self.client.post(reverse('update_cart_item_json', args=[line.pk]), {'quantity': 4})
+        self.assertEqual(self.badge(), 4)
+
+        self.client.get(reverse('remove_from_cart', args=[line.pk]))
+        self.assertEqual(self.badge(), 0)
+
+    def test_placing_an_order_empties_the_badge(self):
+        self.fill_cart(self.customer, 2, 3)
+        self.assertEqual(self.badge(), 5)
+        place_order(Cart.objects.get(pk=self.customer.cart.pk), self.DELIVERY, 'Cash')
+        self.assertEqual(self.badge(), 0)
+
+
+class RequestCustomerTests(ShopDataMixin, TestCase):
+    def test_the_customer_and_cart_come_with_the_session_user(self):
+        user, customer = self.make_customer('resolved')
+        self.client.force_login(user)
+
+        with CaptureQueriesContext(connection) as queries:
+            request = self.client.get(reverse('view_cart')).wsgi_request
+        profile_queries = [query['sql'] for query in queries if 'bookstore_customer' in query['sql']]
+        self.assertEqual(len(profile_queries), 1)
+        self.assertIn('bookstore_cart', profile_queries[0])
+        self.assertEqual((request.customer.pk, request.cart.pk), (customer.pk, customer.cart.pk))
+        self.assertIs(request.customer, request.user.customer)
+
+    def test_staff_and_anonymous_visitors_have_no_customer(self):
+        request = self.client.get(reverse('home')).wsgi_request
+        self.assertEqual((request.customer, request.cart), (None, None))
+
+        staff, customer = self.make_customer('staff-shopper')
+        User.objects.filter(pk=staff.pk).update(is_staff=True)
+        self.client.force_login(staff)
+        request = self.client.get(reverse('about')).wsgi_request
+        self.assertEqual((request.customer, request.cart), (None, None))
+
+    def test_a_missing_cart_is_created(self):
+        user, customer = self.make_customer('cartless')
+        Cart.objects.filter(customer=customer).delete()
+        self.client.force_login(user)
+
+        request = self.client.get(reverse('view_cart')).wsgi_request
+        self.assertEqual(request.cart.customer_id, customer.pk)
+
+    def test_sessions_from_the_model_backend_stay_signed_in(self):
+        user, customer = self.make_customer('old-session')
+        self.client.force_login(user, backend='django.contrib.auth.backends.ModelBackend')
+        request = self.client.get(reverse('view_cart')).wsgi_request
+        self.assertEqual(request.customer.pk, customer.pk)
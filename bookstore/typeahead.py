@@ -0,0 +1,254 @@
+"""
+In-process trigram/prefix index over Book titles and authors.
+
+Backs the autocomplete endpoint without touching the database: the index
+is built per process from a single query in a background thread, then
+kept current by the Book post_save/post_delete hooks as edits commit.
+Matching is typo tolerant, which helps with the inconsistent
+romanization of Urdu titles ("Pattay"/"Patte", "Qayamat"/"Qiyamat").
+"""
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import Book
+from .search import normalize
+
+logger = logging.getLogger(__name__)
+
+SUGGESTION_LIMIT = 8
+MIN_SIMILARITY = 0.45
+INDEXED_FIELDS = ('title', 'author')
+
+REPEATED_CHAR_RE = re.compile(r'(.)\1+')
+NON_WORD_RE = re.compile(r'[\W_]+')
+
+
+def fold(text):
+    """Normalize for fuzzy matching: casefold, strip diacritics and collapse doubled letters"""
+    text = NON_WORD_RE.sub(' ', normalize(text))
+    return REPEATED_CHAR_RE.sub(r'\1', text).strip()
+
+
+def trigrams(text):
+    """Return the set of trigrams of each word, padded so word boundaries count"""
+    grams = set()
+    for word in text.split():
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class TrigramIndex:
+    """Trigram postings plus a sorted word list for prefix lookups"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._reset()
+        self.built_at = None
+
+    def _reset(self):
+        self._books = {}                  # book_id -> (title, author)
+        self._grams = defaultdict(set)    # trigram -> {(book_id, field)}
+        self._doc_grams = {}              # (book_id, field) -> trigram set
+        self._words = []                  # sorted [(word, book_id, field)]
+
+    def __len__(self):
+        return len(self._books)
+
+    @property
+    def trigram_count(self):
+        return len(self._grams)
+
+    def build(self, rows):
+        """Index (id, title, author) rows, replacing the current contents"""
+        with self._lock:
+            self._reset()
+            for book_id, title, author in rows:
+                self._add(book_id, title, author)
+            self._words.sort()
+            self.built_at = time.monotonic()
+
+    def add(self, book_id, title, author):
+        with self._lock:
+            self._remove(book_id)
+            self._add(book_id, title, author, keep_sorted=True)
+
+    def remove(self, book_id):
+        with self._lock:
+            self._remove(book_id)
+
+    def _add(self, book_id, title, author, keep_sorted=False):
+        self._books[book_id] = (title, author)
+        for field, text in zip(INDEXED_FIELDS, (title, author)):
+            key = (book_id, field)
+            folded = fold(text)
+            grams = trigrams(folded)
+            self._doc_grams[key] = grams
+            for gram in grams:
+                self._grams[gram].add(key)
+            for word in set(folded.split()):
+                if keep_sorted:
+                    insort(self._words, (word, book_id, field))
+                else:
+                    self._words.append((word, book_id, field))
+
+    def _remove(self, book_id):
+        texts = self._books.pop(book_id, None)
+        if texts is None:
+            return
+        for field, text in zip(INDEXED_FIELDS, texts):
+            key = (book_id, field)
+            for gram in self._doc_grams.pop(key, ()):
+                postings = self._grams[gram]
+                postings.discard(key)
+                if not postings:
+                    del self._grams[gram]
+            for word in set(fold(text).split()):
+                entry = (word, book_id, field)
+                i = bisect_left(self._words, entry)
+                if i < len(self._words) and self._words[i] == entry:
+                    del self._words[i]
+
+    def _prefix_matches(self, prefix):
+        matches = set()
+        i = bisect_left(self._words, (prefix,))
+        while i < len(self._words) and self._words[i][0].startswith(prefix):
+            matches.add(self._words[i][1:])
+            i += 1
+        return matches
+
+    def suggest(self, query, limit=SUGGESTION_LIMIT):
+        """
+        Return up to `limit` suggestions for the query, best first.
+        Exact word prefixes rank above fuzzy trigram matches; fuzzy matches
+        are scored by the share of the query's trigrams found in the field.
+        """
+        folded = fold(query)
+        if not folded:
+            return []
+
+        with self._lock:
+            last_word = folded.split()[-1]
+            scores = Counter({key: 1.0 for key in self._prefix_matches(last_word)})
+
+            query_grams = trigrams(folded)
+            if len(folded) >= 3 and query_grams:
+                shared = Counter()
+                for gram in query_grams:
+                    shared.update(self._grams.get(gram, ()))
+                for key, count in shared.items():
+                    similarity = count / len(query_grams)
+                    if similarity >= MIN_SIMILARITY:
+                        scores[key] = max(scores[key], similarity)
+
+            best = {}
+            for (book_id, field), score in scores.items():
+                if score > best.get(book_id, (0, None))[0]:
+                    best[book_id] = (score, field)
+
+            ranked = sorted(best.items(), key=lambda item: (-item[1][0], self._books[item[0]][0]))
+            return [
+                {
+                    'id': book_id,
+                    'title': self._books[book_id][0],
+                    'author': self._books[book_id][1],
+                    'matched_field': field,
+                    'score': round(score, 3),
+                }
+                for book_id, (score, field) in ranked[:limit]
+            ]
+
+
+_index = TrigramIndex()
+_state_lock = threading.Lock()
+_builder = None
+# Edits committed while a rebuild runs, replayed onto the new index before
+# it is swapped in, since its query may have missed them
+_pending = []
+
+
+def load_rows():
+    return Book.objects.values_list('id', 'title', 'author').iterator(chunk_size=2000)
+
+
+def build_index():
+    index = TrigramIndex()
+    index.build(load_rows())
+    return index
+
+
+def _rebuild():
+    global _index
+    try:
+        index = build_index()
+        with _state_lock:
+            for book_id, row in _pending:
+                if row is None:
+                    index.remove(book_id)
+                else:
+                    index.add(book_id, *row)
+            _index = index
+    except Exception:
+        logger.exception('Could not build the typeahead index')
+    finally:
+        connection.close()
+
+
+def start_rebuild():
+    """Rebuild the index in a background thread, unless a rebuild is already running"""
+    global _builder
+    with _state_lock:
+        # is_alive() rather than a flag: a thread started before a fork does not exist in the child
+        if _builder is not None and _builder.is_alive():
+            return False
+        _pending.clear()
+        _builder = threading.Thread(target=_rebuild, name='typeahead-rebuild', daemon=True)
+        _builder.start()
+    return True
+
+
+def get_index():
+    """
+    Return the process-wide index. It is built on first use and rebuilt
+    once it is older than TYPEAHEAD_MAX_AGE seconds, so that edits made in
+    other worker processes are picked up. Builds run in a background
+    thread: callers never wait, and until the first build finishes they
+    get an empty index (the WSGI entry point starts that build at startup).
+    """
+    max_age = getattr(settings, 'TYPEAHEAD_MAX_AGE', 300)
+    index = _index
+    if index.built_at is None or time.monotonic() - index.built_at > max_age:
+        start_rebuild()
+    return index
+
+
+def suggest(query, limit=SUGGESTION_LIMIT):
+    return get_index().suggest(query, limit)
+
+
+def _apply(book_id, row):
+    with _state_lock:
+        if _builder is not None and _builder.is_alive():
+            _pending.append((book_id, row))
+        if _index.built_at is not None:
+            if row is None:
+                _index.remove(book_id)
+            else:
+                _index.add(book_id, *row)
+
+
+def refresh_book(book):
+    """Apply a single book edit once it commits, if this process has an index"""
+    row = (book.title, book.author)
+    transaction.on_commit(lambda: _apply(book.pk, row))
+
+
+def forget_book(book_id):
+    transaction.on_commit(lambda: _apply(book_id, None))
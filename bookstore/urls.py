@@ -4,9 +4,12 @@ from . import views
 urlpatterns = [
     path('', views.home_page, name='home'),
     path('books/', views.book_list, name='book_list'),
+    path('books/page/', views.book_list_page, name='book_list_page'),
+    path('books/autocomplete/', views.book_autocomplete, name='book_autocomplete'),
     path('book/<int:book_id>/', views.book_detail, name='book_detail'),
     path('about/', views.about_page, name='about'),
     path('contact/', views.contact, name='contact'),
+    path('navbar/', views.navbar_fragment, name='navbar_fragment'),
     
     path('register/', views.register, name='register'),
     path('login/', views.login_view, name='login'),
@@ -18,6 +21,9 @@ urlpatterns = [
     path('cart/add/<int:book_id>/', views.add_to_cart, name='add_to_cart'),
     path('cart/update/<int:item_id>/', views.update_cart_item, name='update_cart_item'),
     path('cart/remove/<int:item_id>/', views.remove_from_cart, name='remove_from_cart'),
+    path('cart/api/add/<int:book_id>/', views.add_to_cart_json, name='add_to_cart_json'),
+    path('cart/api/update/<int:item_id>/', views.update_cart_item_json, name='update_cart_item_json'),
+    path('cart/api/batch/', views.update_cart_batch_json, name='update_cart_batch_json'),
     
     path('coupon/apply/', views.apply_coupon, name='apply_coupon'),
     path('coupon/remove/', views.remove_coupon, name='remove_coupon'),
@@ -30,4 +36,6 @@ urlpatterns = [
     path('payment/process-card/', views.process_card_payment, name='process_card_payment'),
     path('orders/<int:order_id>/payment-success/', views.payment_success, name='payment_success'),
     path('payment/failed/', views.payment_failed, name='payment_failed'),
+
+    path('metrics/', views.metrics_view, name='metrics'),
 ]
\ No newline at end of file
@@ -3,15 +3,24 @@ from django.contrib.auth import login, logout, authenticate, update_session_auth
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.contrib import messages
-from .models import Book, Order, OrderItem, Customer, Payment, Cart, CartItem, Coupon, CouponUsage, ContactMessage, Delivery, OrderCancellation
+from .models import Book, Order, Customer, Payment, Cart, CartItem, Coupon, ContactMessage
 from decimal import Decimal
 import json
-from django.http import JsonResponse
-from django.db.models import Q
+from django.http import Http404, HttpResponse, JsonResponse
+from django.db.models import Prefetch, prefetch_related_objects
 from django.utils import timezone
+from django.conf import settings
 import re
+import uuid
+from django.views.decorators.cache import never_cache
 from django.views.decorators.http import require_http_methods
 from functools import wraps
+from django.urls import reverse
+from urllib.parse import urlencode
+from . import search, pagination, typeahead, facets, carts, reservations, cancellation, metrics, book_cache, page_cache
+from .checkout import place_order
+from .idempotency import completed, idempotent
+from .inventory import InsufficientStock
 
 def customer_required(view_func):
     """
@@ -27,13 +36,23 @@ def customer_required(view_func):
             messages.warning(request, 'This feature is for customers only. Please use the admin panel.')
             return redirect('/admin/')
         
-        if not hasattr(request.user, 'customer'):
+        if request.customer is None:
             messages.error(request, 'Customer profile not found. Please contact support.')
             return redirect('home')
         
         return view_func(request, *args, **kwargs)
     return wrapper
 
+def _get_cart(request):
+    """The request's cart with its items and their books loaded for one-pass pricing"""
+    cart = request.cart
+    prefetch_related_objects(
+        [cart],
+        Prefetch('cartitem_set', queryset=CartItem.objects.select_related('book').order_by('added_at', 'id')),
+    )
+    return cart
+
+
 def register(request):
     if request.method == 'POST':
         username = request.POST.get('username')
@@ -89,47 +108,120 @@ def logout_view(request):
     return redirect('home')
 
 
+@page_cache.cache_shared_page(page_cache.site_pages)
 def home_page(request):
     return render(request, 'bookstore/home.html')
 
 
-def book_list(request):
+def _catalog_page(request):
+    """Fetch the requested keyset page of the catalog or of a search"""
     search_query = request.GET.get('search', '').strip()
-    
-    books = Book.objects.all()
+    cursor = request.GET.get('after', '').strip()
+    filters = facets.parse_filters(request.GET)
     
     if search_query:
-        books = books.filter(
-            Q(title__icontains=search_query) |
-            Q(author__icontains=search_query) |
-            Q(category__icontains=search_query) |
-            Q(isbn__icontains=search_query)
-        )
+        page = pagination.search_page(search_query, cursor, filters)
+    else:
+        page = pagination.book_page(cursor, filters)
+    
+    next_page_query = ''
+    if page.has_next:
+        params = {'after': page.next_cursor, **filters}
+        if search_query:
+            params['search'] = search_query
+        next_page_query = urlencode(params)
+    
+    return search_query, filters, page, next_page_query
+
+
+@page_cache.cache_shared_page(page_cache.catalog_pages)
+def book_list(request):
+    search_query, filters, page, next_page_query = _catalog_page(request)
     
     context = {
-        'books': books,
+        'books': page.items,
         'search_query': search_query,
+        'next_page_query': next_page_query,
+        'filters': filters,
+        'facets': facets.build_facets(filters, {'search': search_query} if search_query else {}),
     }
     
+    if search_query and not request.GET.get('after'):
+        context['result_count'] = search.ranked_matches(search_query).filter(
+            facets.filter_q(filters, prefix='book__')
+        ).count()
+        if not page.items and not filters:
+            context['suggestions'] = typeahead.suggest(search_query)
+    
     return render(request, 'bookstore/book_list.html', context)
 
 
+def book_list_page(request):
+    """HTML fragment with the next page of book cards, for infinite scroll"""
+    search_query, filters, page, next_page_query = _catalog_page(request)
+    
+    response = render(request, 'bookstore/book_cards.html', {'books': page.items})
+    if next_page_query:
+        response['X-Next-Page'] = f"{reverse('book_list_page')}?{next_page_query}"
+    return response
+
+
+def book_autocomplete(request):
+    """JSON typeahead suggestions for titles and authors, served from memory"""
+    query = request.GET.get('q', '').strip()
+    
+    suggestions = typeahead.suggest(query) if query else []
+    for suggestion in suggestions:
+        suggestion['url'] = reverse('book_detail', args=[suggestion['id']])
+    
+    return JsonResponse({'query': query, 'results': suggestions})
+
+
+def _cached_book(book_id, fresh=False):
+    try:
+        return book_cache.get_book(book_id, fresh=fresh)
+    except Book.DoesNotExist:
+        raise Http404('No Book matches the given query.')
+
+
+def _book_for_cart(book_id):
+    """Cached book for the add-to-cart views; an out-of-stock copy is re-read so restocks show at once"""
+    book = _cached_book(book_id)
+    if book.stock < 1:
+        book = _cached_book(book_id, fresh=True)
+    return book
+
+
+@page_cache.cache_shared_page(page_cache.book_page)
 def book_detail(request, book_id):
-    book = get_object_or_404(Book, id=book_id)
+    book = _cached_book(book_id)
     return render(request, 'bookstore/book_detail.html', {'book': book})
 
 
 @login_required(login_url='login')
 def order_history(request):
-    customer = request.user.customer
-    orders = Order.objects.filter(customer=customer)
-    return render(request, 'bookstore/order_history.html', {'orders': orders})
+    customer = request.customer
+    cursor = request.GET.get('before', '').strip()
+    page = pagination.order_page(customer, cursor)
+    context = {
+        'orders': page.items,
+        'is_first_page': pagination.parse_cursor(cursor) is None,
+        'next_page_query': urlencode({'before': page.next_cursor}) if page.has_next else '',
+    }
+    return render(request, 'bookstore/order_history.html', context)
 
 
+@page_cache.cache_shared_page(page_cache.site_pages)
 def about_page(request):
     return render(request, 'bookstore/about.html')
 
 
+@never_cache
+def navbar_fragment(request):
+    """The navbar's per-user links and flash messages, loaded by page-cached pages"""
+    return render(request, 'bookstore/navbar_user.html')
+
+
 def contact(request):
     if request.method == 'POST':
         name = request.POST.get('name')
@@ -152,36 +244,99 @@ def contact(request):
     return render(request, 'bookstore/contact.html')
 
 
+def _add_to_cart_message(status, book):
+    if status == carts.ADDED:
+        return f"'{book.title}' added to cart!"
+    if status == carts.INCREASED:
+        return f"Increased quantity of '{book.title}' in cart!"
+    if status == carts.OUT_OF_STOCK:
+        return f"'{book.title}' is out of stock!"
+    return f"Cannot add more. Only {book.stock} in stock!"
+
+
+CART_UPDATE_MESSAGES = {
+    carts.INCREASED: 'Quantity updated!',
+    carts.DECREASED: 'Quantity updated!',
+    carts.UPDATED: 'Quantity updated!',
+    carts.REMOVED: 'Item removed from cart!',
+    carts.MAX_STOCK: 'Maximum stock reached!',
+    carts.MIN_QUANTITY: 'Minimum quantity is 1!',
+}
+
+CART_CHANGED = (carts.ADDED, carts.INCREASED, carts.DECREASED, carts.UPDATED, carts.REMOVED)
+
+
+def _money(amount):
+    return str(amount.quantize(Decimal('0.01')))
+
+
+def _cart_line_json(item):
+    return {
+        'id': item.id,
+        'book_id': item.book_id,
+        'title': item.book.title,
+        'quantity': item.quantity,
+        'unit_price': _money(item.book.price),
+        'subtotal': _money(item.subtotal),
+    }
+
+
+def _cart_json(request, status, message, item_id=None, all_items=False, **extra):
+    """JSON body for the AJAX cart endpoints: the outcome, the changed line(s) and fresh totals"""
+    pricing = _get_cart(request).pricing
+    item = next((line for line in pricing.items if line.id == item_id), None)
+    if all_items:
+        extra['items'] = [_cart_line_json(line) for line in pricing.items]
+    return JsonResponse({
+        'success': status in CART_CHANGED,
+        'status': status,
+        'message': message,
+        'item': _cart_line_json(item) if item else None,
+        'cart': {
+            'total_items': pricing.total_items,
+            'subtotal': _money(pricing.subtotal),
+            'coupon_discount': _money(pricing.coupon_discount),
+            'order_value_discount': _money(pricing.order_value_discount),
+            'first_time_discount': _money(pricing.first_time_discount),
+            'total_discount': _money(pricing.total_discount),
+            'shipping_fee': _money(pricing.shipping_fee),
+            'total_amount': _money(pricing.total_amount),
+        },
+        **extra,
+    })
+
+
 @customer_required
 def add_to_cart(request, book_id):
-    book = get_object_or_404(Book, id=book_id)
-    customer = request.user.customer
-    
-    cart, created = Cart.objects.get_or_create(customer=customer)
-    cart_item, created = CartItem.objects.get_or_create(cart=cart, book=book)
-    
-    if not created:
-        if cart_item.quantity < book.stock:
-            cart_item.quantity += 1
-            cart_item.save()
-            messages.success(request, f"Increased quantity of '{book.title}' in cart!")
-        else:
-            messages.warning(request, f"Cannot add more. Only {book.stock} in stock!")
+    book = _book_for_cart(book_id)
+    status = carts.add_book(request.cart.pk, book)
+
+    if status in CART_CHANGED:
+        messages.success(request, _add_to_cart_message(status, book))
     else:
-        messages.success(request, f"'{book.title}' added to cart!")
+        messages.warning(request, _add_to_cart_message(status, book))
     
     return redirect('view_cart')
 
 
+@customer_required
+@require_http_methods(["POST"])
+def add_to_cart_json(request, book_id):
+    book = _book_for_cart(book_id)
+    cart_id = request.cart.pk
+    status = carts.add_book(cart_id, book)
+
+    item_id = CartItem.objects.filter(cart_id=cart_id, book=book).values_list('id', flat=True).first()
+    return _cart_json(request, status, _add_to_cart_message(status, book), item_id=item_id)
+
+
 @customer_required
 def view_cart(request):
-    customer = request.user.customer
-    cart, created = Cart.objects.get_or_create(customer=customer)
-    cart_items = cart.cartitem_set.all()
+    cart = _get_cart(request)
     
     context = {
         'cart': cart,
-        'cart_items': cart_items,
+        'cart_items': cart.pricing.items,
     }
     return render(request, 'bookstore/cart.html', context)
 
@@ -190,8 +345,7 @@ def view_cart(request):
 def apply_coupon(request):
     if request.method == 'POST':
         coupon_code = request.POST.get('coupon_code', '').strip().upper()
-        customer = request.user.customer
-        cart = get_object_or_404(Cart, customer=customer)
+        cart = _get_cart(request)
         
         if not coupon_code:
             messages.error(request, 'Please enter a coupon code!')
@@ -225,8 +379,7 @@ def apply_coupon(request):
 @customer_required
 def remove_coupon(request):
     if request.method == 'POST':
-        customer = request.user.customer
-        cart = get_object_or_404(Cart, customer=customer)
+        cart = request.cart
         
         if cart.applied_coupon:
             coupon_code = cart.applied_coupon.code
@@ -243,41 +396,87 @@ def remove_coupon(request):
 
 @customer_required
 def update_cart_item(request, item_id):
-    cart_item = get_object_or_404(CartItem, id=item_id, cart__customer=request.user.customer)
-    
     if request.method == 'POST':
+        cart_id = request.cart.pk
         action = request.POST.get('action')
         
         if action == 'increase':
-            if cart_item.quantity < cart_item.book.stock:
-                cart_item.quantity += 1
-                cart_item.save()
-                messages.success(request, 'Quantity updated!')
-            else:
-                messages.warning(request, 'Maximum stock reached!')
-        
+            status = carts.increase_item(cart_id, item_id)
         elif action == 'decrease':
-            if cart_item.quantity > 1:
-                cart_item.quantity -= 1
-                cart_item.save()
-                messages.success(request, 'Quantity updated!')
-            else:
-                messages.warning(request, 'Minimum quantity is 1!')
+            status = carts.decrease_item(cart_id, item_id)
+        else:
+            return redirect('view_cart')
+        
+        if status == carts.NOT_FOUND:
+            raise Http404('Cart item not found')
+        if status in CART_CHANGED:
+            messages.success(request, CART_UPDATE_MESSAGES[status])
+        else:
+            messages.warning(request, CART_UPDATE_MESSAGES[status])
     
     return redirect('view_cart')
 
 
+def _set_quantity(cart_id, item_id, quantity):
+    updated, removed = carts.set_quantities(cart_id, {item_id: quantity})
+    if removed:
+        return carts.REMOVED
+    return carts.UPDATED if updated else carts.NOT_FOUND
+
+
+@customer_required
+@require_http_methods(["POST"])
+def update_cart_item_json(request, item_id):
+    """Change one line: action=increase|decrease, or quantity=<n> (0 removes it)"""
+    cart_id = request.cart.pk
+    action = request.POST.get('action')
+    quantity = request.POST.get('quantity')
+
+    if action == 'increase':
+        status = carts.increase_item(cart_id, item_id)
+    elif action == 'decrease':
+        status = carts.decrease_item(cart_id, item_id)
+    elif quantity is not None:
+        try:
+            status = _set_quantity(cart_id, item_id, int(quantity))
+        except ValueError:
+            return JsonResponse({'success': False, 'message': 'Quantity must be a whole number.'}, status=400)
+    else:
+        return JsonResponse({'success': False, 'message': 'Nothing to update.'}, status=400)
+
+    if status == carts.NOT_FOUND:
+        return JsonResponse({'success': False, 'status': status, 'message': 'Cart item not found.'}, status=404)
+    return _cart_json(request, status, CART_UPDATE_MESSAGES[status], item_id=item_id)
+
+
+@customer_required
+@require_http_methods(["POST"])
+def update_cart_batch_json(request):
+    """Set many quantities at once from a JSON body {"items": {"<item id>": quantity}}"""
+    try:
+        payload = json.loads(request.body)
+        quantities = {int(item_id): int(quantity) for item_id, quantity in payload['items'].items()}
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return JsonResponse({'success': False, 'message': 'Expected {"items": {"<item id>": quantity}}.'}, status=400)
+
+    updated, removed = carts.set_quantities(request.cart.pk, quantities)
+    if not (updated or removed):
+        return _cart_json(request, carts.NOT_FOUND, 'No matching cart items.', all_items=True, updated=0, removed=0)
+    return _cart_json(request, carts.UPDATED, 'Cart updated!', all_items=True, updated=updated, removed=removed)
+
+
 @customer_required
 def remove_from_cart(request, item_id):
-    cart_item = get_object_or_404(CartItem, id=item_id, cart__customer=request.user.customer)
+    cart_item = get_object_or_404(CartItem, id=item_id, cart=request.cart)
     book_title = cart_item.book.title
     cart_item.delete()
+    reservations.trim_holds(request.cart.pk)
     messages.success(request, f"'{book_title}' removed from cart!")
     return redirect('view_cart')
 
 @customer_required
 def edit_profile(request):
-    customer = request.user.customer
+    customer = request.customer
     
     if request.method == 'POST':
         email = request.POST.get('email')
@@ -304,30 +503,18 @@ def cancel_order(request, order_id):
     and restore stock for all items
     BCNF: Updated to use OrderCancellation model
     """
-    order = get_object_or_404(Order, id=order_id, customer=request.user.customer)
+    order = get_object_or_404(Order, id=order_id, customer=request.customer)
     
-    cancellable_statuses = ['Pending', 'Confirmed']
-    if order.status not in cancellable_statuses:
+    if order.status not in cancellation.CANCELLABLE_STATUSES:
         messages.error(request, f"Cannot cancel order in '{order.status}' status!")
         return redirect('order_history')
     
     if request.method == 'POST':
         cancellation_reason = request.POST.get('cancellation_reason', '').strip()
         
-        # for order_item in order.orderitem_set.all():
-        #     order_item.book.stock += order_item.quantity
-        #     order_item.book.save()
-        
-        # if order.applied_coupon:
-        #     CouponUsage.objects.filter(order=order).delete()
-        
-        order.status = 'Cancelled'
-        order.save()
-        
-        OrderCancellation.objects.create(
-            order=order,
-            reason=cancellation_reason if cancellation_reason else None
-        )
+        if not cancellation.cancel_order(order, cancellation_reason):
+            messages.error(request, f'Order #{order.id} can no longer be cancelled.')
+            return redirect('order_history')
         
         messages.success(
             request, 
@@ -460,14 +647,20 @@ def get_card_type(card_number):
 @customer_required
 def card_payment_form(request):
     """Display card payment form"""
-    customer = request.user.customer
-    cart = get_object_or_404(Cart, customer=customer)
-    cart_items = cart.cartitem_set.all()
+    customer = request.customer
+    cart = _get_cart(request)
+    cart_items = cart.pricing.items
     
     if not cart_items:
         messages.warning(request, 'Your cart is empty!')
         return redirect('view_cart')
     
+    try:
+        hold_expires_at = reservations.hold_cart(cart)
+    except InsufficientStock as e:
+        messages.error(request, f'{e}. Please update your cart.')
+        return redirect('view_cart')
+    
     delivery_name = request.POST.get('delivery_name', customer.user.get_full_name() or customer.user.username)
     delivery_phone = request.POST.get('delivery_phone', customer.phone)
     delivery_address = request.POST.get('delivery_address', customer.address)
@@ -481,18 +674,33 @@ def card_payment_form(request):
         'delivery_phone': delivery_phone,
         'delivery_address': delivery_address,
         'delivery_notes': delivery_notes,
+        'hold_expires_at': hold_expires_at,
+        'idempotency_key': uuid.uuid4().hex,
     }
     
     return render(request, 'bookstore/card_payment_form.html', context)
 
 
+def _card_payment_in_progress(request):
+    return JsonResponse({
+        'success': False,
+        'message': 'This payment is already being processed. Please wait a moment.'
+    }, status=409)
+
+
+def _checkout_in_progress(request):
+    messages.info(request, 'Your order is already being placed. It will appear here shortly.')
+    return redirect('order_history')
+
+
 @customer_required
 @require_http_methods(["POST"])
+@idempotent(_card_payment_in_progress)
 def process_card_payment(request):
     """Process card payment and create order with BCNF structure"""
-    customer = request.user.customer
-    cart = get_object_or_404(Cart, customer=customer)
-    cart_items = cart.cartitem_set.all()
+    customer = request.customer
+    cart = _get_cart(request)
+    cart_items = cart.pricing.items
     
     if not cart_items:
         return JsonResponse({'success': False, 'message': 'Cart is empty'})
@@ -534,76 +742,31 @@ def process_card_payment(request):
         })
     
     try:
-        coupon_discount_amt = cart.coupon_discount
-        order_value_discount_amt = cart.order_value_discount
-        first_time_discount_amt = cart.first_time_discount
-        
-        order = Order.objects.create(
-            customer=customer,
-            shipping_fee=cart.shipping_fee,
-            applied_coupon=cart.applied_coupon,
-            coupon_discount_amount=coupon_discount_amt,
-            order_value_discount_amount=order_value_discount_amt,
-            first_time_discount_amount=first_time_discount_amt,
-        )
-        
-        Delivery.objects.create(
-            order=order,
-            recipient_name=delivery_name,
-            phone=delivery_phone,
-            address=delivery_address,
-            notes=delivery_notes,
-        )
-        
-        for cart_item in cart_items:
-            OrderItem.objects.create(
-                order=order,
-                book=cart_item.book,
-                quantity=cart_item.quantity,
-                unit_price=cart_item.book.price,
-                subtotal=cart_item.subtotal
-            )
-        
-        if cart.applied_coupon:
-            coupon = cart.applied_coupon
-            CouponUsage.objects.create(
-                coupon=coupon,
-                customer=customer,
-                order=order
-            )
-        
-        if customer.is_first_time_buyer:
-            customer.is_first_time_buyer = False
-            customer.save()
-        
-        card_type = get_card_type(card_number)
-        masked_card = '**** **** **** ' + card_number[-4:]
-        
-        Payment.objects.create(
-            order=order,
-            amount=order.total_amount,
-            method='Card',
-            status='Paid',
-            transaction_id=f"CARD-{order.id}-{timezone.now().strftime('%Y%m%d%H%M%S')}"
+        order = place_order(
+            cart,
+            {
+                'recipient_name': delivery_name,
+                'phone': delivery_phone,
+                'address': delivery_address,
+                'notes': delivery_notes,
+            },
+            'Card',
+            paid=True,
         )
         
         request.session['payment_details'] = {
-            'card_type': card_type,
-            'masked_card': masked_card,
+            'card_type': get_card_type(card_number),
+            'masked_card': '**** **** **** ' + card_number[-4:],
             'card_holder': card_holder,
-            'transaction_id': f"CARD-{order.id}-{timezone.now().strftime('%Y%m%d%H%M%S')}",
+            'transaction_id': order.payment.transaction_id,
         }
         
-        cart_items.delete()
-        cart.applied_coupon = None
-        cart.save()
-        
-        return JsonResponse({
+        return completed(JsonResponse({
             'success': True,
             'message': 'Payment processed successfully!',
             'order_id': order.id,
             'redirect_url': f'/orders/{order.id}/payment-success/'
-        })
+        }))
         
     except Exception as e:
         return JsonResponse({
@@ -615,7 +778,7 @@ def process_card_payment(request):
 @customer_required
 def payment_success(request, order_id):
     """Display payment success page"""
-    order = get_object_or_404(Order, id=order_id, customer=request.user.customer)
+    order = get_object_or_404(Order, id=order_id, customer=request.customer)
     payment = get_object_or_404(Payment, order=order)
     payment_details = request.session.get('payment_details', {})
     
@@ -639,10 +802,11 @@ def payment_failed(request):
 
 
 @customer_required
+@idempotent(_checkout_in_progress)
 def checkout(request):
-    customer = request.user.customer
-    cart = get_object_or_404(Cart, customer=customer)
-    cart_items = cart.cartitem_set.all()
+    customer = request.customer
+    cart = _get_cart(request)
+    cart_items = cart.pricing.items
     
     if not cart_items:
         messages.warning(request, 'Your cart is empty!')
@@ -666,61 +830,19 @@ def checkout(request):
         
         if payment_method == 'Cash':
             try:
-                coupon_discount_amt = cart.coupon_discount
-                order_value_discount_amt = cart.order_value_discount
-                first_time_discount_amt = cart.first_time_discount
-                
-                order = Order.objects.create(
-                    customer=customer,
-                    shipping_fee=cart.shipping_fee,
-                    applied_coupon=cart.applied_coupon,
-                    coupon_discount_amount=coupon_discount_amt,
-                    order_value_discount_amount=order_value_discount_amt,
-                    first_time_discount_amount=first_time_discount_amt,
+                order = place_order(
+                    cart,
+                    {
+                        'recipient_name': delivery_name,
+                        'phone': delivery_phone,
+                        'address': delivery_address,
+                        'notes': delivery_notes,
+                    },
+                    payment_method,
                 )
                 
-                Delivery.objects.create(
-                    order=order,
-                    recipient_name=delivery_name,
-                    phone=delivery_phone,
-                    address=delivery_address,
-                    notes=delivery_notes if delivery_notes else None,
-                )
-                
-                for cart_item in cart_items:
-                    OrderItem.objects.create(
-                        order=order,
-                        book=cart_item.book,
-                        quantity=cart_item.quantity,
-                        unit_price=cart_item.book.price,
-                        subtotal=cart_item.subtotal
-                    )
-                
-                if cart.applied_coupon:
-                    coupon = cart.applied_coupon
-                    CouponUsage.objects.create(
-                        coupon=coupon,
-                        customer=customer,
-                        order=order
-                    )
-                
-                if customer.is_first_time_buyer:
-                    customer.is_first_time_buyer = False
-                    customer.save()
-                
-                Payment.objects.create(
-                    order=order,
-                    amount=order.total_amount,
-                    method=payment_method,
-                    status='Unpaid'
-                )
-                
-                cart_items.delete()
-                cart.applied_coupon = None
-                cart.save()
-                
                 messages.success(request, f'Order #{order.id} placed successfully! You saved Rs. {order.total_discount:.2f}')
-                return redirect('order_history')
+                return completed(redirect('order_history'))
             
             except Exception as e:
                 messages.error(request, f'Error creating order: {str(e)}')
@@ -733,9 +855,24 @@ def checkout(request):
             messages.error(request, 'Invalid payment method!')
             return redirect('checkout')
     
+    try:
+        hold_expires_at = reservations.hold_cart(cart)
+    except InsufficientStock as e:
+        messages.error(request, f'{e}. Please update your cart.')
+        return redirect('view_cart')
+    
     context = {
         'cart': cart,
         'cart_items': cart_items,
         'customer': customer,
+        'hold_expires_at': hold_expires_at,
+        'idempotency_key': uuid.uuid4().hex,
     }
-    return render(request, 'bookstore/checkout.html', context)
\ No newline at end of file
+    return render(request, 'bookstore/checkout.html', context)
+
+
+def metrics_view(request):
+    """Per-view request and page cache metrics in the Prometheus text format, for local scrapers only"""
+    if request.META.get('REMOTE_ADDR') not in getattr(settings, 'METRICS_ALLOWED_IPS', ('127.0.0.1', '::1')):
+        raise Http404
+    return HttpResponse(metrics.render_prometheus() + page_cache.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
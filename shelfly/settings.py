@@ -50,20 +50,48 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "bookstore.middleware.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "bookstore.middleware.CustomerMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# CustomerBackend loads the session user with their customer profile and
+# cart in one query. ModelBackend stays listed so sessions created before
+# it still resolve their user instead of being signed out.
+AUTHENTICATION_BACKENDS = [
+    "bookstore.backends.CustomerBackend",
+    "django.contrib.auth.backends.ModelBackend",
+]
+
 ROOT_URLCONF = "shelfly.urls"
 
+# Most queries one request to each view may run; exceeding a budget is
+# logged, or raises when QUERY_BUDGET_STRICT is on (see bookstore.metrics)
+QUERY_BUDGETS = {
+    "home": 5,
+    "book_list": 8,
+    "book_list_page": 5,
+    "book_autocomplete": 4,
+    "book_detail": 5,
+    "navbar_fragment": 3,
+    "view_cart": 5,
+    "order_history": 5,
+    "card_payment_form": 10,
+    "admin:bookstore_order_changelist": 6,
+    "admin:bookstore_book_changelist": 8,
+    "admin:bookstore_coupon_changelist": 7,
+    "admin:bookstore_cart_changelist": 8,
+}
+
 TEMPLATES = [
     {
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        "BACKEND": "bookstore.metrics.DjangoTemplates",
         "DIRS":  [BASE_DIR / 'templates'],
         "APP_DIRS": True,
         "OPTIONS": {
@@ -71,6 +99,7 @@ TEMPLATES = [
                 "django.template.context_processors.request",
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
+                "bookstore.context_processors.cart_summary",
             ],
         },
     },
@@ -96,6 +125,29 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Per-process memory cache unless REDIS_URL is set. Run several workers
+# against Redis: the page, book and facet caches are invalidated through
+# this cache, and with LocMemCache each worker only sees its own changes.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "shelfly",
+    }
+}
+
+if os.getenv('REDIS_URL'):
+    CACHES["default"] = {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.getenv('REDIS_URL'),
+    }
+
+# Deployed release, tying cached pages to the templates and assets that
+# rendered them (bookstore.page_cache); the git commit when unset
+SHELFLY_RELEASE = os.getenv('SHELFLY_RELEASE', '')
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
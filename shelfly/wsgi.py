@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "shelfly.settings")
 
 application = get_wsgi_application()
+
+# Build the autocomplete index before the first request asks for it
+from bookstore import typeahead  # noqa: E402
+
+typeahead.start_rebuild()